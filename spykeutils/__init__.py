@@ -37,6 +37,12 @@
     :show-inheritance:
     :undoc-members:
 
+:mod:`spike_detection` Module
+-----------------------------
+
+.. automodule:: spykeutils.spike_detection
+    :members:
+
 :mod:`spike_train_generation` Module
 ------------------------------------
 
@@ -1,10 +1,146 @@
 import scipy as sp
 import neo
+import quantities as pq
 
 from . import SpykeException
 
 
-def spike_train_to_spikes(spike_train, include_waveforms=True):
+class SpikeSequence(object):
+    """ A read-only sequence of :class:`neo.core.Spike` objects backed by
+    a spike train.
+
+    Spike objects are only created when they are accessed (and then
+    reused for further accesses of the same element), so large spike
+    trains can be used where a sequence of spikes is expected without
+    converting all spikes. :attr:`times` and :attr:`waveforms` give
+    access to the data of all spikes in the sequence as arrays. Slicing
+    returns another :class:`SpikeSequence` over the same spike train.
+    If the sequence contains the whole spike train or was created by
+    slicing, these arrays are views of the spike train data. If it was
+    created with an index array, they are copies.
+
+    The created spikes have the same properties as the spikes created by
+    :func:`spike_train_to_spikes`.
+
+    :param spike_train: The spike train containing the spikes.
+    :type spike_train: :class:`neo.core.SpikeTrain`
+    :param bool include_waveforms: Determines if the ``waveforms`` property
+        of the spike train is used for the spike waveforms.
+    :param indices: The indices of the spikes in ``spike_train`` that are
+        part of the sequence. If ``None``, all spikes are included.
+    :type indices: slice or 1-D array of int
+    """
+
+    def __init__(self, spike_train, include_waveforms=True, indices=None):
+        self.spike_train = spike_train
+        self.include_waveforms = include_waveforms
+        if indices is None:
+            indices = slice(None)
+        if isinstance(indices, slice):
+            start, stop, step = indices.indices(len(spike_train))
+            self._len = len(xrange(start, stop, step))
+            if stop < 0:  # Negative step up to the first spike
+                stop = None
+            self._index = slice(start, stop, step)
+        else:
+            self._index = sp.asarray(indices, dtype=int)
+            self._len = self._index.size
+        self._spikes = {}
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, item):
+        index = self._index
+        if isinstance(item, slice):
+            if not isinstance(index, slice):
+                return SpikeSequence(self.spike_train,
+                                     self.include_waveforms, index[item])
+            # Compose the slices to keep views of the spike train data
+            start, stop, step = item.indices(self._len)
+            num = len(xrange(start, stop, step))
+            if not num:
+                return SpikeSequence(self.spike_train,
+                                     self.include_waveforms, slice(0, 0))
+            start = index.start + start * index.step
+            step *= index.step
+            stop = start + num * step
+            if stop < 0:  # Negative step up to the first spike
+                stop = None
+            return SpikeSequence(self.spike_train, self.include_waveforms,
+                                 slice(start, stop, step))
+        if isinstance(index, slice):
+            if not -self._len <= item < self._len:
+                raise IndexError('SpikeSequence index out of range')
+            i = index.start + (item % self._len) * index.step
+        else:
+            i = index[item]
+        if i not in self._spikes:
+            self._spikes[i] = self._create_spike(i)
+        return self._spikes[i]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _create_spike(self, i):
+        train = self.spike_train
+        s = neo.Spike(train.view(pq.Quantity)[i],
+                      sampling_rate=train.sampling_rate,
+                      left_sweep=train.left_sweep)
+        waves = self._train_waveforms()
+        if waves is not None:
+            s.waveform = waves[i, :, :]
+        s.unit = train.unit
+        s.segment = train.segment
+        return s
+
+    def _train_waveforms(self):
+        """ Return the waveforms of the whole spike train or ``None`` if
+        waveforms are not included.
+        """
+        if not self.include_waveforms:
+            return None
+        return self.spike_train.waveforms
+
+    def _select(self, data):
+        """ Return the elements of ``data`` (an array over all spikes of the
+        spike train) that belong to the sequence.
+        """
+        index = self._index
+        if isinstance(index, slice) and \
+                index == slice(0, len(self.spike_train), 1):
+            return data
+        return data[index]
+
+    @property
+    def indices(self):
+        """ The indices of the spikes in the spike train.
+        """
+        if isinstance(self._index, slice):
+            return sp.arange(len(self.spike_train))[self._index]
+        return self._index
+
+    @property
+    def times(self):
+        """ The times of all spikes in the sequence. A view of the spike
+        train if possible (see :class:`SpikeSequence`).
+        """
+        return self._select(self.spike_train.view(pq.Quantity))
+
+    @property
+    def waveforms(self):
+        """ The waveforms of all spikes in the sequence (spikes x samples x
+        channels) or ``None`` if the spike train has no waveforms. A view of
+        the spike train waveforms if possible (see :class:`SpikeSequence`).
+        """
+        waves = self._train_waveforms()
+        if waves is None:
+            return None
+        return self._select(waves)
+
+
+def spike_train_to_spikes(spike_train, include_waveforms=True, lazy=False):
     """ Return a list of spikes for a spike train.
 
     Note that while the created spikes have references to the same segment and
@@ -19,27 +155,119 @@ def spike_train_to_spikes(spike_train, include_waveforms=True):
     :param bool include_waveforms: Determines if the ``waveforms`` property is
         converted to the spike waveforms. If ``waveforms`` is None, this
         parameter has no effect.
+    :param bool lazy: If ``True``, a :class:`SpikeSequence` is returned
+        that only creates the spikes when they are accessed.
     :returns: A list of :class:`neo.core.Spike` objects, one for every
         spike in ``spike_train``.
-    :rtype: list
+    :rtype: list or :class:`SpikeSequence`
     """
+    if lazy:
+        return SpikeSequence(spike_train, include_waveforms)
+
     waves = None
     if include_waveforms:
         waves = spike_train.waveforms
 
+    # Iterating over plain quantities avoids creating spike train objects
+    times = spike_train.view(pq.Quantity)
+    srate = spike_train.sampling_rate
+    left_sweep = spike_train.left_sweep
+    unit = spike_train.unit
+    segment = spike_train.segment
+
     spikes = []
-    for i, t in enumerate(spike_train):
-        s = neo.Spike(t, sampling_rate=spike_train.sampling_rate,
-                      left_sweep=spike_train.left_sweep)
+    for i, t in enumerate(times):
+        s = neo.Spike(t, sampling_rate=srate, left_sweep=left_sweep)
         if waves is not None:
             s.waveform = waves[i, :, :]
-        s.unit = spike_train.unit
-        s.segment = spike_train.segment
+        s.unit = unit
+        s.segment = segment
         spikes.append(s)
 
     return spikes
 
 
+def spike_times(spikes, unit=None):
+    """ Return the times of a sequence of spikes as one array.
+
+    :param sequence spikes: A sequence of :class:`neo.core.Spike` objects.
+    :param unit: The unit of the returned times. If ``None``, the unit of
+        the first spike is used.
+    :type unit: Quantity scalar
+    :returns: The spike times.
+    :rtype: Quantity 1D
+    """
+    if isinstance(spikes, SpikeSequence):
+        times = spikes.times
+        return times.rescale(unit) if unit is not None else times
+
+    if unit is None:
+        unit = spikes[0].time.units if spikes else pq.s
+    times = sp.fromiter((s.time.magnitude for s in spikes), dtype=float,
+                        count=len(spikes))
+
+    # Conversion factor of each distinct unit, indexed by a code per spike
+    codes = {}
+    factors = []
+    idx = sp.empty(len(spikes), dtype=int)
+    for i, s in enumerate(spikes):
+        k = _unit_key(s.time)
+        if k not in codes:
+            codes[k] = len(factors)
+            factors.append(float(pq.Quantity(1.0, s.time.units).rescale(unit)))
+        idx[i] = codes[k]
+    if any(f != 1.0 for f in factors):
+        times *= sp.array(factors)[idx]
+    return times * unit
+
+
+def spike_waveforms(spikes, unit=None):
+    """ Return the waveforms of a sequence of spikes as one array.
+
+    All spikes need a ``waveform`` with the same shape, otherwise a
+    ``SpykeException`` is raised.
+
+    :param sequence spikes: A sequence of :class:`neo.core.Spike` objects.
+    :param unit: The unit of the returned waveforms. If ``None``, the unit
+        of the first waveform is used.
+    :type unit: Quantity scalar
+    :returns: The waveforms (spikes x samples x channels).
+    :rtype: Quantity 3D
+    """
+    if isinstance(spikes, SpikeSequence):
+        waveforms = spikes.waveforms
+        if waveforms is None and len(spikes):
+            raise SpykeException('Cannot create waveform array from spikes '
+                                 'where some waveforms are None')
+        if waveforms is not None and unit is not None:
+            return waveforms.rescale(unit)
+        return waveforms
+
+    waveforms = [s.waveform for s in spikes]
+    if any(w is None for w in waveforms):
+        raise SpykeException('Cannot create waveform array from spikes '
+                             'where some waveforms are None')
+    if len(set(w.shape for w in waveforms)) > 1:
+        raise SpykeException('Cannot create waveform array from spikes '
+                             'with nonuniform waveform shapes!')
+    if not waveforms:
+        return sp.zeros((0, 0, 0)) * (unit or pq.dimensionless)
+
+    if unit is None:
+        unit = waveforms[0].units
+    unit_key = _unit_key(unit)
+    return sp.array([w.magnitude if _unit_key(w) == unit_key
+                     else w.rescale(unit).magnitude
+                     for w in waveforms]) * unit
+
+
+def _unit_key(q):
+    """ Return a hashable representation of the unit of a quantity that is
+    faster to compare than the unit itself.
+    """
+    return frozenset(q.dimensionality.iteritems())
+
+
 def spikes_to_spike_train(spikes, include_waveforms=True):
     """ Return a spike train for a list of spikes.
 
@@ -53,7 +281,9 @@ def spikes_to_spike_train(spikes, include_waveforms=True):
     referenced in the created spike train.
 
     :param sequence spikes: A sequence of :class:`neo.core.Spike` objects
-        from which the spike train is constructed.
+        from which the spike train is constructed. If this is a
+        :class:`SpikeSequence`, the data of its spike train is used
+        directly.
     :param bool include_waveforms: Determines if the waveforms from the spike
         objects are used to fill the ``waveforms`` property of the resulting
         spike train. If ``True``, all spikes need a ``waveform`` property
@@ -62,42 +292,46 @@ def spikes_to_spike_train(spikes, include_waveforms=True):
     :return: All elements of ``spikes`` as spike train.
     :rtype: :class:`neo.core.SpikeTrain`
     """
-    if not spikes:
+    if not len(spikes):
         raise SpykeException('No spikes to create spike train!')
 
-    tu = spikes[0].time.units
-    times = sp.zeros(len(spikes)) * tu
+    if isinstance(spikes, SpikeSequence):
+        # All spikes share the properties of the spike train
+        train = spikes.spike_train
+        times = spikes.times
+        waves = spikes.waveforms if include_waveforms else None
+        ret = neo.SpikeTrain(times, t_start=times.min(), t_stop=times.max(),
+                             waveforms=waves, left_sweep=train.left_sweep)
+        ret.unit = train.unit
+        ret.segment = train.segment
+        return ret
+
     s = spikes[0].segment
     u = spikes[0].unit
     ls = spikes[0].left_sweep
 
-    if include_waveforms and spikes[0].waveform is not None:
-        sh = spikes[0].waveform.shape
-        wu = spikes[0].waveform.units
-        waves = sp.zeros((len(spikes), sh[0], sh[1])) * wu
-    else:
-        waves = None
-        sh = None
-
-    for i, spike in enumerate(spikes):
-        if (u != spike.unit or s != spike.segment or
-                ls != spike.left_sweep):
-            raise SpykeException('Cannot create spike train from spikes with '
-                                 'nonuniform properties!')
-
-        times[i] = spikes[i].time
-
-        if include_waveforms:
-            if spike.waveform is None:
-                if waves is not None:
-                    raise SpykeException('Cannot create spike train from '
-                                         'spikes where some waveforms are '
-                                         'None')
-            elif sh != spike.waveform.shape:
-                raise SpykeException('Cannot create spike train from spikes '
-                                     'with nonuniform waveform shapes!')
-            if waves is not None:
-                waves[i, :, :] = spike.waveform
+    # Unit and segment are compared by identity, left sweeps by value
+    if len(set((id(spike.unit), id(spike.segment)) for spike in spikes)) > 1:
+        raise SpykeException('Cannot create spike train from spikes with '
+                             'nonuniform properties!')
+    sweeps = set(None if spike.left_sweep is None
+                 else float(spike.left_sweep.rescale(pq.s))
+                 for spike in spikes)
+    if len(sweeps) > 1:
+        raise SpykeException('Cannot create spike train from spikes with '
+                             'nonuniform properties!')
+
+    times = spike_times(spikes)
+
+    waves = None
+    if include_waveforms:
+        num_missing = sum(1 for spike in spikes if spike.waveform is None)
+        if 0 < num_missing < len(spikes):
+            raise SpykeException('Cannot create spike train from '
+                                 'spikes where some waveforms are '
+                                 'None')
+        if not num_missing:
+            waves = spike_waveforms(spikes)
 
     ret = neo.SpikeTrain(times, t_start=times.min(), t_stop=times.max(),
                          waveforms=waves, left_sweep=ls)
@@ -1,14 +1,19 @@
 import scipy as sp
+import numpy.fft
+import numpy.lib.format
+import scipy.sparse
 from collections import OrderedDict
+from itertools import combinations
 
 import quantities as pq
 
 from progress_indicator import ProgressIndicator
+import tools
 from . import SpykeException
 
 
 def correlogram(trains, bin_size, max_lag=500 * pq.ms, border_correction=True,
-                per_second=True, unit=pq.ms, progress=None):
+                per_second=True, unit=pq.ms, progress=None, binned=False):
     """ Return (cross-)correlograms from a dictionary of spike train
     lists for different units.
 
@@ -25,6 +30,13 @@ def correlogram(trains, bin_size, max_lag=500 * pq.ms, border_correction=True,
     :param Quantity unit: Unit of X-Axis.
     :param progress: A ProgressIndicator object for the operation.
     :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :param bool binned: If ``True``, the spike trains are binned with
+        ``bin_size`` and the correlograms of all pairs of indices are
+        calculated from the binned spike trains with FFTs. This is much
+        faster for large ``max_lag`` or many indices, but spike time
+        differences are only resolved to whole bins: Spikes in bins
+        ``a`` and ``b`` are counted in the correlogram bin centered at
+        ``(a - b) * bin_size``.
     :returns: Two values:
 
         * An ordered dictionary indexed with the indices of ``trains`` of
@@ -38,66 +50,39 @@ def correlogram(trains, bin_size, max_lag=500 * pq.ms, border_correction=True,
     if not progress:
         progress = ProgressIndicator()
 
-    bin_size.rescale(unit)
-    max_lag.rescale(unit)
-
-    # Create bins, making sure that 0 is at the center of central bin
-    half_bins = sp.arange(bin_size / 2, max_lag, bin_size)
-    all_bins = list(reversed(-half_bins))
-    all_bins.extend(half_bins)
-    bins = sp.array(all_bins) * unit
-    middle_bin = len(bins) / 2 - 1
-
+    bins, middle_bin = _correlogram_bins(bin_size, max_lag, unit)
     indices = trains.keys()
-    num_trains = len(trains[indices[0]])
-    if not num_trains:
-        raise SpykeException('Could not create correlogram: No spike trains!')
-    for u in range(1, len(indices)):
-        if len(trains[indices[u]]) != num_trains:
-            raise SpykeException('Could not create correlogram: All units ' +
-                                 'need the same number of spike trains!')
+    num_trains = _num_trials(trains)
 
     progress.set_ticks(sp.sum(range(len(trains) + 1) * num_trains))
 
     corrector = 1
     if border_correction:
-        # Need safe min/max functions
-        def safe_max(seq):
-            if len(seq) < 1:
-                return 0
-            return max(seq)
-
-        def safe_min(seq):
-            if len(seq) < 1:
-                return 2 ** 22  # Some arbitrary large value
-            return min(seq)
-
-        max_w = max([max([safe_max(t) for t in l])
-                     for l in trains.itervalues()])
-        min_w = min([min([safe_min(t) for t in l])
-                     for l in trains.itervalues()])
-
-        train_length = (max_w - min_w)
-        l = int(round(middle_bin)) + 1
-        cE = max(train_length - (l * bin_size) + 1 * unit, 1 * unit)
-
-        corrector = (train_length / sp.concatenate(
-            (sp.linspace(cE, train_length, l - 1, False),
-             sp.linspace(train_length, cE, l)))).magnitude
+        corrector = _border_corrector(trains, bin_size, middle_bin, unit)
+
+    if binned:
+        binned_histograms = _binned_correlograms(
+            trains, indices, num_trains, float(bin_size.rescale(unit)),
+            int(round(middle_bin)), unit, progress)
 
     correlograms = OrderedDict()
     for i1 in xrange(len(indices)):  # For each index
         # For all later indices, including itself
         for i2 in xrange(i1, len(indices)):
-            histogram = sp.zeros(len(bins) - 1)
-            for t in xrange(num_trains):
-                train1 = trains[indices[i1]][t].rescale(unit).reshape((1, -1))
-                train2 = trains[indices[i2]][t].rescale(unit).reshape((-1, 1))
-                histogram += sp.histogram(
-                    sp.subtract(train1, train2), bins=bins)[0]
-                if i1 == i2:  # Correction for autocorrelogram
-                    histogram[middle_bin] -= len(train2)
-                progress.step()
+            if binned:
+                histogram = binned_histograms[(i1, i2)]
+                train1 = trains[indices[i1]][-1].rescale(unit)
+                train2 = trains[indices[i2]][-1].rescale(unit)
+            else:
+                histogram = sp.zeros(len(bins) - 1)
+                for t in xrange(num_trains):
+                    train1 = trains[indices[i1]][t].rescale(unit)
+                    train2 = trains[indices[i2]][t].rescale(unit)
+                    histogram += _difference_histogram(
+                        train1.magnitude, train2.magnitude, bins.magnitude)
+                    if i1 == i2:  # Correction for autocorrelogram
+                        histogram[middle_bin] -= len(train2)
+                    progress.step()
 
             if per_second:
                 l = train1.t_stop - train1.t_start
@@ -116,4 +101,632 @@ def correlogram(trains, bin_size, max_lag=500 * pq.ms, border_correction=True,
                     correlograms[indices[i2]] = OrderedDict()
                 correlograms[indices[i2]][indices[i1]] = crg[::-1]
 
-    return correlograms, bins
\ No newline at end of file
+    return correlograms, bins
+
+
+def surrogate_correlograms(
+        trains, bin_size, max_lag=500 * pq.ms, surrogate='shift',
+        num_surrogates=100, jitter_window=20 * pq.ms, confidence=0.95,
+        border_correction=True, per_second=True, unit=pq.ms, progress=None):
+    """ Return (cross-)correlograms of surrogate data and significance
+    bands from a dictionary of spike train lists for different units.
+
+    The surrogate correlograms are normalized in the same way as the
+    correlograms returned by :func:`correlogram` with the same parameters,
+    so these can be compared to the significance bands. The spike times are
+    extracted once and the surrogates for all trials are created at once.
+    All surrogate correlograms of a pair of indices are computed in a single
+    pass over the spike pairs.
+
+    :param dict trains: Dictionary of :class:`neo.core.SpikeTrain` lists.
+        The lists are interpreted as trials and need to have the same
+        length for every index.
+    :param bin_size: Bin size (time).
+    :type bin_size: Quantity scalar
+    :param max_lag: Cut off (end time of calculated correlogram).
+    :type max_lag: Quantity scalar
+    :param str surrogate: The type of surrogate data:
+
+        * ``'shift'``: Shift predictor. The spike trains of the second index
+          in each pair are taken from different trials (a random cyclic
+          permutation of the trials for each surrogate). At least two
+          trials are needed.
+        * ``'jitter'``: Interval jitter. Every spike is moved to a random
+          time within its interval of length ``jitter_window`` (the
+          intervals start at multiples of ``jitter_window``).
+    :param int num_surrogates: The number of surrogates.
+    :param jitter_window: Length of the jitter intervals.
+    :type jitter_window: Quantity scalar
+    :param float confidence: The fraction of surrogate correlograms
+        enclosed by the significance bands.
+    :param bool border_correction: Apply correction for less data at higher
+        timelags (see :func:`correlogram`).
+    :param bool per_second: If ``True``, counts returned are per second.
+        Otherwise, counts per spike train are returned.
+    :param Quantity unit: Unit of X-Axis.
+    :param progress: A ProgressIndicator object for the operation.
+    :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :returns: Four values:
+
+        * An ordered dictionary of ordered dictionaries (indexed like the
+          result of :func:`correlogram`) of the surrogate correlograms as
+          2-D arrays with one row per surrogate.
+        * Dictionary of pointwise significance bands: For each bin, a
+          fraction of ``confidence`` of the surrogate values are between
+          the lower band (first row of the 2-D arrays) and the upper band
+          (second row).
+        * Dictionary of global significance bands: A fraction of
+          ``confidence`` of the surrogate correlograms are between the
+          lower and upper band in every bin. The bands have a constant
+          distance from the mean of the surrogates.
+        * The bins used for the correlogram calculation.
+    :rtype: dict, dict, dict, Quantity 1D
+    """
+    if not progress:
+        progress = ProgressIndicator()
+    if surrogate not in ('shift', 'jitter'):
+        raise ValueError('Unknown surrogate type: %s' % surrogate)
+
+    bins, middle_bin = _correlogram_bins(bin_size, max_lag, unit)
+    edges = bins.magnitude
+    num_bins = len(bins) - 1
+    indices = trains.keys()
+    num_trains = _num_trials(trains)
+    if surrogate == 'shift' and num_trains < 2:
+        raise SpykeException(
+            'Could not create shift predictor: At least two trials needed!')
+
+    progress.set_ticks(sp.sum(range(len(trains) + 1)))
+
+    corrector = 1
+    if border_correction:
+        corrector = _border_corrector(trains, bin_size, middle_bin, unit)
+
+    # Extract the spike times of all trials once
+    times = {}
+    trial_spikes = {}
+    for u in indices:
+        times[u] = [sp.sort(t.rescale(unit).magnitude) for t in trains[u]]
+        trial_spikes[u] = sp.array([len(t) for t in times[u]])
+
+    if surrogate == 'shift':
+        # Random cyclic permutation of the trials for each surrogate: no
+        # trial is paired with itself
+        order = sp.argsort(
+            sp.random.rand(num_surrogates, num_trains), axis=1)
+        rows = sp.arange(num_surrogates)[:, sp.newaxis]
+        partners = sp.empty_like(order)
+        partners[rows, order] = sp.roll(order, -1, axis=1)
+    else:
+        window = float(jitter_window.rescale(unit))
+        jittered = {}
+        for u in indices:
+            t = sp.concatenate(times[u])
+            jittered[u] = sp.floor(t / window) * window + \
+                sp.random.rand(num_surrogates, t.size) * window
+
+    # Every trial of every surrogate is moved to its own time segment. The
+    # segments are far enough apart so that no spike pair from different
+    # segments is counted in the correlograms.
+    all_times = sp.concatenate(
+        [sp.concatenate(t) for t in times.values()] +
+        ([j.ravel() for j in jittered.values()]
+         if surrogate == 'jitter' else []) + [sp.zeros(1)])
+    segment = all_times.max() - min(0, all_times.min()) + \
+        2 * (abs(edges[0]) + abs(edges[-1]))
+
+    def segments(u, trial_order):
+        """ Return the spike times of index ``u`` moved to the segments
+        and the surrogate number for each spike. ``trial_order`` gives
+        the trial used for each surrogate and trial.
+        """
+        counts = trial_spikes[u][trial_order].ravel()
+        offsets = (sp.arange(counts.size) * segment).repeat(counts)
+        if surrogate == 'shift':
+            t = sp.concatenate([times[u][i] for i in trial_order.ravel()])
+        else:
+            t = jittered[u].ravel()
+        labels = sp.arange(num_surrogates).repeat(
+            trial_spikes[u][trial_order].sum(axis=1))
+        return t + offsets, labels
+
+    same_order = sp.tile(sp.arange(num_trains), (num_surrogates, 1))
+    first = {}
+    for u in indices:
+        first[u] = segments(u, same_order)
+
+    surrogates = OrderedDict()
+    pointwise = OrderedDict()
+    global_bands = OrderedDict()
+    for i1 in xrange(len(indices)):  # For each index
+        u1 = indices[i1]
+        # For all later indices, including itself
+        for i2 in xrange(i1, len(indices)):
+            u2 = indices[i2]
+            train1, labels = first[u1]
+            if surrogate == 'shift':
+                train2 = segments(u2, partners)[0]
+            else:
+                train2 = first[u2][0]
+            histograms = _difference_histogram(
+                train1, train2, edges, labels, num_surrogates)
+            histograms = histograms.astype(float)
+            if i1 == i2 and surrogate == 'jitter':
+                # Correction for autocorrelogram
+                histograms[:, middle_bin] -= trial_spikes[u1].sum()
+
+            if per_second:
+                l = trains[u1][-1].t_stop - trains[u1][-1].t_start
+                histograms /= float(l.rescale(pq.s))
+
+            crg = corrector * histograms / num_trains
+            band, global_band = _significance_bands(crg, confidence)
+            for a, b, mirror in ((u1, u2, False), (u2, u1, True)):
+                if a == b and mirror:
+                    continue
+                for d, value in ((surrogates, crg), (pointwise, band),
+                                 (global_bands, global_band)):
+                    if a not in d:
+                        d[a] = OrderedDict()
+                    d[a][b] = value[:, ::-1] if mirror else value
+            progress.step()
+
+    return surrogates, pointwise, global_bands, bins
+
+
+def jpsth(trains, bin_size, pairs=None, start=0 * pq.ms, stop=sp.inf * pq.s,
+          shift_predictor=True, normalize=False, filename=None,
+          progress=None):
+    """ Return joint peri stimulus time histograms (JPSTHs) for pairs of
+    indices in a dictionary of spike train lists.
+
+    The spike trains are binned like in
+    :func:`.rate_estimation.psth`. The spike counts of every index are
+    binned once into a (trials x bins) matrix and the JPSTH of a pair is
+    the matrix product of the transposed count matrix of the first index
+    with the count matrix of the second index, divided by the number of
+    trials. Element ``[i, j]`` of a JPSTH therefore is the mean product of
+    the spike counts of the first index in bin ``i`` and the second index
+    in bin ``j``.
+
+    :param dict trains: Dictionary of :class:`neo.core.SpikeTrain` lists.
+        The lists are interpreted as trials and need to have the same
+        length for every index.
+    :param bin_size: The desired bin size (as a time quantity).
+    :type bin_size: Quantity scalar
+    :param sequence pairs: The pairs of indices for which JPSTHs are
+        calculated. If ``None``, all pairs of different indices are used.
+    :param start: The desired time for the start of the first bin. It
+        will be recalculated if there are spike trains which start
+        later than this time.
+    :type start: Quantity scalar
+    :param stop: The desired time for the end of the last bin. It will
+        be recalculated if there are spike trains which end earlier
+        than this time.
+    :type stop: Quantity scalar
+    :param bool shift_predictor: If ``True``, the shift predictor (the
+        mean JPSTH of all pairs of different trials) is subtracted.
+    :param bool normalize: If ``True``, the JPSTHs are divided by the
+        product of the (sample) standard deviations across trials of the
+        spike counts in the respective bins. Together with
+        ``shift_predictor``, this yields the correlation coefficients of
+        the spike counts. Elements with a standard deviation of zero are
+        set to zero.
+    :param str filename: If given, the JPSTHs are stored in a
+        memory-mapped ``.npy`` file with this name instead of memory.
+    :param progress: A ProgressIndicator object for the operation.
+    :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :returns: Three values:
+
+        * The JPSTHs as 3-D array with one JPSTH per pair (a
+          :class:`numpy.memmap` if ``filename`` is given).
+        * A list of the pairs of indices in the order of the JPSTHs.
+        * The bin borders.
+    :rtype: ndarray, list, Quantity 1D
+    """
+    if not progress:
+        progress = ProgressIndicator()
+
+    num_trains = _num_trials(trains)
+    if shift_predictor and num_trains < 2:
+        raise SpykeException(
+            'Could not create shift predictor: At least two trials needed!')
+    if pairs is None:
+        pairs = list(combinations(trains.keys(), 2))
+    else:
+        pairs = list(pairs)
+
+    start, stop = tools.minimum_spike_train_interval(trains, start, stop)
+    bins = tools.bin_edges(1.0 / bin_size, start, stop)
+    num_bins = bins.size - 1
+
+    shape = (len(pairs), num_bins, num_bins)
+    if filename is None:
+        result = sp.empty(shape)
+    else:
+        result = numpy.lib.format.open_memmap(
+            filename, mode='w+', dtype=float, shape=shape)
+
+    progress.set_ticks(len(pairs))
+
+    # Bin the spike trains of every index only once
+    counts = {}
+    sums = {}
+    deviations = {}
+    for u in set(u for p in pairs for u in p):
+        counts[u] = tools.spike_count_matrix(trains[u], bins).astype(float)
+        sums[u] = counts[u].sum(axis=0)
+        if normalize:
+            deviations[u] = counts[u].std(
+                axis=0, ddof=1 if num_trains > 1 else 0)
+
+    for i, (u1, u2) in enumerate(pairs):
+        raw = sp.dot(counts[u1].T, counts[u2])
+        if shift_predictor:
+            # Sum over all pairs of different trials
+            predictor = sp.outer(sums[u1], sums[u2]) - raw
+            j = raw / num_trains - \
+                predictor / (num_trains * (num_trains - 1))
+        else:
+            j = raw / num_trains
+        if normalize:
+            norm = sp.outer(deviations[u1], deviations[u2])
+            nonzero = norm > 0
+            j[nonzero] /= norm[nonzero]
+            j[~nonzero] = 0.0
+        result[i] = j
+        progress.step()
+
+    if filename is not None:
+        result.flush()
+    return result, pairs, bins
+
+
+def spike_count_correlations(
+        trains, bin_size, window_sizes=None, start=0 * pq.ms,
+        stop=sp.inf * pq.s, mode='total'):
+    """ Return the correlation and covariance matrices of spike counts
+    between all indices in a dictionary of spike train lists.
+
+    The spike trains are binned once with ``bin_size`` into a sparse
+    matrix containing all trials. For each size in ``window_sizes``, the
+    window of every nonzero bin is computed directly and the bins are
+    summed into a sparse matrix of window counts. The second moments of
+    all pairs of indices are then calculated with a sparse matrix product.
+    Memory use therefore depends on the number of spikes, not on the
+    length of the spike trains.
+
+    :param dict trains: Dictionary of :class:`neo.core.SpikeTrain` lists.
+        The lists are interpreted as trials and need to have the same
+        length for every index.
+    :param bin_size: Bin size for the initial binning (time). All window
+        sizes are rounded to multiples of it.
+    :type bin_size: Quantity scalar
+    :param window_sizes: Sizes of the counting windows. The windows of each
+        size cover the interval from ``start`` to ``stop`` of every trial
+        without overlap (a remaining part shorter than the window size is
+        not used). If ``None``, ``bin_size`` is used.
+    :type window_sizes: Quantity 1D
+    :param start: The desired time for the start of the first window. It
+        will be recalculated if there are spike trains which start later
+        than this time.
+    :type start: Quantity scalar
+    :param stop: The desired time for the end of the windows. It will be
+        recalculated if there are spike trains which end earlier than this
+        time.
+    :type stop: Quantity scalar
+    :param str mode: Determines which correlations are calculated:
+
+        * ``'total'``: Every window in every trial is an observation.
+        * ``'noise'``: Like ``'total'``, but the mean count over trials of
+          each window position is subtracted (noise correlations). At least
+          two trials are needed.
+        * ``'signal'``: The observations are the mean counts over trials
+          for each window position (signal correlations).
+    :returns: Three values:
+
+        * The correlation coefficients as 3-D array with one correlation
+          matrix per window size. Entries for indices without variance are
+          zero.
+        * The covariances as 3-D array with one covariance matrix per
+          window size. The covariances are normalized with the number of
+          observations minus the number of estimated means.
+        * A list of the indices in the order used in the matrices.
+    :rtype: ndarray, ndarray, list
+    """
+    if mode not in ('total', 'noise', 'signal'):
+        raise ValueError('Unknown mode: %s' % mode)
+    num_trains = _num_trials(trains)
+    if mode == 'noise' and num_trains < 2:
+        raise SpykeException(
+            'Could not calculate noise correlations: At least two trials '
+            'needed!')
+
+    start, stop = tools.minimum_spike_train_interval(trains, start, stop)
+    binned, bins, indices = tools.spike_count_array(
+        trains, 1.0 / bin_size, start, stop, sparse=True)
+    num_bins = bins.size - 1
+
+    # Nonzero bins: index, trial, bin and count
+    binned = binned.tocoo()
+    unit_rows, trial = divmod(binned.row, num_trains)
+    columns = binned.col
+    counts_data = binned.data.astype(float)
+
+    if window_sizes is None:
+        multiples = sp.array([1])
+    else:
+        multiples = sp.asarray((window_sizes / bin_size).simplified)
+        multiples = sp.maximum(1, sp.around(multiples).astype(int))
+
+    correlations = sp.zeros((len(multiples), len(indices), len(indices)))
+    covariances = sp.zeros_like(correlations)
+    for w, m in enumerate(multiples):
+        num_windows = num_bins // m
+        if num_windows < 1:
+            raise ValueError(
+                'Window size is larger than the interval of the spike trains.')
+
+        # Window of each nonzero bin, bins after the last window are dropped
+        used = columns < num_windows * m
+        rows = unit_rows[used]
+        data = counts_data[used]
+        positions = columns[used] // m
+
+        # Mean count of each window position over trials (sparse, indices x
+        # window positions)
+        position_means = scipy.sparse.csr_matrix(
+            (data / num_trains, (rows, positions)),
+            shape=(len(indices), num_windows))
+        position_second = position_means.dot(position_means.T).toarray()
+
+        if mode == 'signal':
+            means = sp.asarray(position_means.sum(axis=1)).ravel() / \
+                num_windows
+            cov = (position_second -
+                   num_windows * sp.outer(means, means)) / \
+                max(1, num_windows - 1)
+        else:
+            # Sparse (indices x (trials * windows)) count matrix
+            counts = scipy.sparse.csr_matrix(
+                (data, (rows, trial[used] * num_windows + positions)),
+                shape=(len(indices), num_trains * num_windows))
+            second = counts.dot(counts.T).toarray()
+            if mode == 'total':
+                num_obs = num_trains * num_windows
+                means = sp.asarray(counts.sum(axis=1)).ravel() / num_obs
+                cov = (second - num_obs * sp.outer(means, means)) / \
+                    max(1, num_obs - 1)
+            else:
+                cov = (second - num_trains * position_second) / \
+                    (num_windows * (num_trains - 1))
+
+        deviations = sp.sqrt(sp.maximum(sp.diag(cov), 0))
+        norm = sp.outer(deviations, deviations)
+        nonzero = norm > 0
+        correlations[w][nonzero] = cov[nonzero] / norm[nonzero]
+        covariances[w] = cov
+
+    return correlations, covariances, indices
+
+
+def _significance_bands(samples, confidence):
+    """ Return pointwise and global significance bands (2-D arrays with
+    the lower band in the first and the upper band in the second row) for
+    a 2-D array of samples with one sample per row.
+    """
+    lower = 50.0 * (1.0 - confidence)
+    upper = 50.0 * (1.0 + confidence)
+    pointwise = sp.percentile(samples, [lower, upper], axis=0)
+
+    mean = samples.mean(axis=0)
+    above = sp.percentile((samples - mean).max(axis=1), 100.0 * confidence)
+    below = sp.percentile((mean - samples).max(axis=1), 100.0 * confidence)
+    global_bands = sp.vstack((mean - below, mean + above))
+    return pointwise, global_bands
+
+
+def _correlogram_bins(bin_size, max_lag, unit):
+    """ Return the bins for a correlogram and the index of the middle bin.
+    """
+    bin_size.rescale(unit)
+    max_lag.rescale(unit)
+
+    # Create bins, making sure that 0 is at the center of central bin
+    half_bins = sp.arange(bin_size / 2, max_lag, bin_size)
+    all_bins = list(reversed(-half_bins))
+    all_bins.extend(half_bins)
+    bins = sp.array(all_bins) * unit
+    middle_bin = len(bins) / 2 - 1
+    return bins, middle_bin
+
+
+def _num_trials(trains):
+    """ Return the number of spike trains for each index of a dictionary of
+    spike train lists. Raises a :class:`SpykeException` if there are no spike
+    trains or the numbers differ.
+    """
+    indices = trains.keys()
+    num_trains = len(trains[indices[0]])
+    if not num_trains:
+        raise SpykeException('Could not create correlogram: No spike trains!')
+    for u in range(1, len(indices)):
+        if len(trains[indices[u]]) != num_trains:
+            raise SpykeException('Could not create correlogram: All units ' +
+                                 'need the same number of spike trains!')
+    return num_trains
+
+
+def _border_corrector(trains, bin_size, middle_bin, unit):
+    """ Return the factors for the border correction of correlograms.
+    """
+    # Need safe min/max functions
+    def safe_max(seq):
+        if len(seq) < 1:
+            return 0
+        return max(seq)
+
+    def safe_min(seq):
+        if len(seq) < 1:
+            return 2 ** 22  # Some arbitrary large value
+        return min(seq)
+
+    max_w = max([max([safe_max(t) for t in l])
+                 for l in trains.itervalues()])
+    min_w = min([min([safe_min(t) for t in l])
+                 for l in trains.itervalues()])
+
+    train_length = (max_w - min_w)
+    l = int(round(middle_bin)) + 1
+    cE = max(train_length - (l * bin_size) + 1 * unit, 1 * unit)
+
+    return (train_length / sp.concatenate(
+        (sp.linspace(cE, train_length, l - 1, False),
+         sp.linspace(train_length, cE, l)))).magnitude
+
+
+def _difference_histogram(train1, train2, bins, groups1=None, num_groups=1,
+                          max_pairs=2 ** 20):
+    """ Return the histogram of all differences between a spike in
+    ``train1`` and a spike in ``train2`` (equal to
+    ``sp.histogram(sp.subtract.outer(train1, train2), bins)[0]``).
+    If ``groups1`` (an integer group smaller than ``num_groups`` for each
+    spike in ``train1``) is given, separate histograms for each group are
+    returned as 2-D array with one row per group.
+
+    Only the spike pairs with a difference inside of the bins are visited:
+    For each spike of ``train1``, the range of spikes in ``train2`` within
+    the bins is found with binary searches in the sorted spike times. The
+    differences are computed for at most ``max_pairs`` pairs at once.
+
+    :param train1: Spike times.
+    :type train1: 1-D array
+    :param train2: Spike times in the same units as ``train1``.
+    :type train2: 1-D array
+    :param bins: Bin edges (including the rightmost edge) in the units of
+        ``train1``.
+    :type bins: 1-D array
+    :rtype: 1-D array or 2-D array
+    """
+    num_bins = len(bins) - 1
+    histogram = sp.zeros(num_groups * max(0, num_bins), dtype=int)
+    if groups1 is not None:
+        histogram = histogram.reshape(num_groups, -1)
+    if num_bins < 1 or len(train1) < 1 or len(train2) < 1:
+        return histogram
+    flat = histogram.reshape(-1)
+
+    train1 = sp.asarray(train1)
+    train2 = sp.sort(train2)
+
+    # Search with a margin, the exact differences are checked below
+    margin = bins[1] - bins[0]
+    lower = sp.searchsorted(train2, train1 - bins[-1] - margin, 'left')
+    upper = sp.searchsorted(train2, train1 - bins[0] + margin, 'right')
+    counts = upper - lower
+    offsets = sp.zeros(len(train1) + 1, dtype=int)
+    sp.cumsum(counts, out=offsets[1:])
+
+    i = 0
+    while i < len(train1):
+        end = sp.searchsorted(offsets, offsets[i] + max_pairs, 'right') - 1
+        end = min(len(train1), max(end, i + 1))
+        c = counts[i:end]
+        owner = sp.repeat(sp.arange(i, end), c)
+        partner = sp.arange(offsets[end] - offsets[i]) - \
+            sp.repeat(offsets[i:end] - offsets[i] - lower[i:end], c)
+        diffs = train1[owner] - train2[partner]
+
+        # Same bin assignment as sp.histogram: All bins but the last are
+        # half-open
+        inside = (diffs >= bins[0]) & (diffs <= bins[-1])
+        diffs = diffs[inside]
+        idx = sp.searchsorted(bins, diffs, 'right') - 1
+        idx[idx == num_bins] = num_bins - 1
+        if groups1 is not None:
+            idx += groups1[owner[inside]] * num_bins
+        flat += sp.bincount(idx, minlength=flat.size)
+        i = end
+    return histogram
+
+
+def _binned_correlograms(trains, indices, num_trains, bin_size, max_lag_bins,
+                         unit, progress, max_elements=2 ** 24):
+    """ Return the correlograms of all pairs of indices from binned spike
+    trains as a dictionary indexed by pairs of positions in ``indices``
+    (only for the first position smaller or equal to the second).
+
+    All spike trains of a trial are binned at once, starting at the
+    earliest start of the trial. Cross-spectra of all pairs are summed over
+    trials in the frequency domain and transformed back with a single
+    batched inverse FFT. Pairs are processed in blocks so that the summed
+    spectra have at most ``max_elements`` entries. The spectra of all
+    trials are computed once if they have at most ``max_elements``
+    entries, otherwise only the spectra of the spike trains used in a
+    block are computed for the block.
+
+    :param float bin_size: Bin size in ``unit``.
+    :param int max_lag_bins: Maximum lag in bins. The returned correlograms
+        have ``2 * max_lag_bins + 1`` bins.
+    """
+    num_units = len(indices)
+
+    # Bin all spike trains of each trial into a (units x bins) array
+    binned = []
+    for t in xrange(num_trains):
+        trial = [trains[u][t] for u in indices]
+        origin = min(float(st.t_start.rescale(unit)) for st in trial)
+        end = max(float(st.t_stop.rescale(unit)) for st in trial)
+        num_bins = max(1, int(sp.ceil((end - origin) / bin_size)))
+        idx = []
+        for st in trial:
+            i = sp.floor((st.rescale(unit).magnitude - origin) / bin_size)
+            idx.append(sp.clip(i.astype(int), 0, num_bins - 1))
+        units = sp.repeat(sp.arange(num_units), [len(st) for st in trial])
+        counts = sp.bincount(
+            units * num_bins + sp.concatenate(idx).astype(int),
+            minlength=num_units * num_bins)
+        binned.append(counts.reshape(num_units, num_bins).astype(float))
+
+    # Zero padding to avoid circular correlation for the used lags
+    longest = max(b.shape[1] for b in binned)
+    num_points = 2 ** int(sp.ceil(sp.log2(longest + max_lag_bins + 1)))
+    num_freqs = num_points // 2 + 1
+
+    first, second = sp.triu_indices(num_units)
+    block_size = max(1, max_elements // num_freqs)
+    lags = sp.arange(-max_lag_bins, max_lag_bins + 1)
+
+    cached = None
+    if num_trains * num_units * num_freqs <= max_elements:
+        cached = [numpy.fft.rfft(b, num_points, axis=1) for b in binned]
+
+    histograms = {}
+    for b in xrange(0, first.size, block_size):
+        f = first[b:b + block_size]
+        s = second[b:b + block_size]
+        if cached is None:
+            rows = sp.union1d(f, s)
+            f_rows = sp.searchsorted(rows, f)
+            s_rows = sp.searchsorted(rows, s)
+        spectra = sp.zeros((f.size, num_freqs), dtype=complex)
+        for t in xrange(num_trains):
+            if cached is not None:
+                transformed = cached[t]
+                spectra += transformed[f] * sp.conj(transformed[s])
+            else:
+                transformed = numpy.fft.rfft(
+                    binned[t][rows], num_points, axis=1)
+                spectra += transformed[f_rows] * sp.conj(transformed[s_rows])
+            progress.step(f.size)
+
+        # Element k is the number of spike pairs with the spike of the
+        # first index k bins after the spike of the second index
+        correlation = numpy.fft.irfft(spectra, num_points, axis=1)
+        correlation = sp.around(correlation[:, lags % num_points])
+        for i in xrange(f.size):
+            if f[i] == s[i]:  # Correction for autocorrelogram
+                correlation[i, max_lag_bins] -= sum(
+                    len(trains[indices[f[i]]][t]) for t in xrange(num_trains))
+            histograms[(f[i], s[i])] = correlation[i]
+    return histograms
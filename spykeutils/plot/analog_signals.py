@@ -69,10 +69,10 @@ def signals(signals, events=None, epochs=None, spike_trains=None,
     if spikes is None:
         spikes = []
 
+    waveform_trains = []
     if show_waveforms:
-        for st in spike_trains:
-            if st.waveforms is not None:
-                spikes.extend(conversions.spike_train_to_spikes(st))
+        waveform_trains = [st for st in spike_trains
+                           if st.waveforms is not None]
         spike_trains = []
     else:
         unit_spikes = {}
@@ -97,7 +97,8 @@ def signals(signals, events=None, epochs=None, spike_trains=None,
     if len(set(channel_indices)) != len(channel_indices) - nonindices:
         channel_indices = range(len(signals))
 
-    progress.set_ticks((len(spike_trains) + len(spikes) + 1) * len(channels))
+    progress.set_ticks((len(spike_trains) + len(waveform_trains) +
+                        len(spikes) + 1) * len(channels))
 
     offset = 0 * signals[0].units
     if use_subplots:
@@ -127,6 +128,9 @@ def signals(signals, events=None, epochs=None, spike_trains=None,
 
             _add_spike_waveforms(
                 plot, spikes, x.units, channel_indices[c], offset, progress)
+            _add_train_waveforms(
+                plot, waveform_trains, x.units, channel_indices[c], offset,
+                progress)
 
             for train in spike_trains:
                 color = helper.get_object_color(train.unit)
@@ -169,6 +173,9 @@ def signals(signals, events=None, epochs=None, spike_trains=None,
                 plot.add_item(make.curve(x, signals[c] + offset))
             _add_spike_waveforms(
                 plot, spikes, x.units, channel_indices[c], offset, progress)
+            _add_train_waveforms(
+                plot, waveform_trains, x.units, channel_indices[c], offset,
+                progress)
             offset += max_offset
             progress.step()
 
@@ -189,6 +196,7 @@ def signals(signals, events=None, epochs=None, spike_trains=None,
 
     units = set([s.unit for s in spike_trains])
     units = units.union([s.unit for s in spikes])
+    units = units.union([s.unit for s in waveform_trains])
 
     progress.done()
 
@@ -224,3 +232,28 @@ def _add_spike_waveforms(plot, spikes, x_units, channel, offset, progress):
             make.curve(spike_x, spike.waveform[:, channel] + offset,
                        color=color, linewidth=2))
         progress.step()
+
+
+def _add_train_waveforms(plot, trains, x_units, channel, offset, progress):
+    for train in trains:
+        if not train.sampling_rate or channel < 0 or \
+                train.waveforms.shape[2] <= channel:
+            progress.step()
+            continue
+
+        color = helper.get_object_color(train.unit)
+        if train.left_sweep:
+            lsweep = train.left_sweep
+        else:
+            lsweep = 0.0 * pq.ms
+        # Sample times of all waveforms at once
+        start = (train.view(pq.Quantity) - lsweep).rescale(x_units)
+        step = (1 / train.sampling_rate).rescale(x_units)
+        spike_x = start.magnitude[:, sp.newaxis] + \
+            sp.arange(train.waveforms.shape[1]) * float(step)
+        spike_y = (train.waveforms[:, :, channel] +
+                   offset).rescale(offset.units).magnitude
+
+        for x, y in zip(spike_x, spike_y):
+            plot.add_item(make.curve(x, y, color=color, linewidth=2))
+        progress.step()
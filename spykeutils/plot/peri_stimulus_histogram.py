@@ -54,7 +54,7 @@ def psth(trains, events=None, start=0 * pq.ms, stop=None,
     for u in trains:
         if events:
             trains[u] = rate_estimation.aligned_spike_trains(
-                trains[u], events)
+                trains[u], events, view=True)
 
     rates, bins = rate_estimation.psth(
         trains, bin_size, start=start, stop=stop,
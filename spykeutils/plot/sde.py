@@ -78,7 +78,7 @@ def sde(trains, events=None, start=0 * pq.ms, stop=None,
     for u in trains:
         if events:
             trains[u] = rate_estimation.aligned_spike_trains(
-                trains[u], events)
+                trains[u], events, view=True)
 
     # Calculate spike density estimation
     if optimize_steps:
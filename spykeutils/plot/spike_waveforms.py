@@ -7,6 +7,7 @@ from guiqwt.plot import BaseCurveWidget
 from PyQt4 import Qt
 
 from ..progress_indicator import ProgressIndicator
+from .. import conversions
 from .. import SpykeException
 from dialog import PlotDialog
 import helper
@@ -82,6 +83,8 @@ def spikes(spikes, axes_style, strong=None, anti_alias=False, fade=1.0,
                if k not in seen and not seen.add(k)]
 
     if axes_style <= 2:  # Separate channel plots
+        data = _waveform_data(spikes, ref_units, time_unit)
+        strong_data = _waveform_data(strong, ref_units, time_unit)
         for c in channels:
             pw = BaseCurveWidget(win)
             plot = pw.plot
@@ -95,17 +98,9 @@ def spikes(spikes, axes_style, strong=None, anti_alias=False, fade=1.0,
                 if len(spikes[u]) == 1:
                     alpha = 1.0
 
-                for s in spikes[u]:
-                    if s.waveform is None or s.sampling_rate is None:
-                        raise SpykeException(
-                            'Cannot create waveform plot: '
-                            'At least one spike has no '
-                            'waveform or sampling rate!')
-                    x = (sp.arange(s.waveform.shape[0]) /
-                         s.sampling_rate).rescale(time_unit)
+                for x, w in zip(*data[u]):
                     curve = make.curve(
-                        x, s.waveform[:, c].rescale(ref_units),
-                        title=u.name, color=color)
+                        x, w[:, c], title=u.name, color=color)
 
                     qcol.setAlphaF(alpha)
                     curve.setPen(Qt.QPen(qcol))
@@ -116,15 +111,11 @@ def spikes(spikes, axes_style, strong=None, anti_alias=False, fade=1.0,
 
             for u in strong:
                 color = helper.get_object_color(u)
-                for s in strong[u]:
-                    x = (sp.arange(s.waveform.shape[0]) /
-                         s.sampling_rate).rescale(time_unit)
+                for x, w in zip(*strong_data[u]):
                     outline = make.curve(
-                        x, s.waveform[:, c].rescale(ref_units),
-                        color='#000000', linewidth=4)
+                        x, w[:, c], color='#000000', linewidth=4)
                     curve = make.curve(
-                        x, s.waveform[:, c].rescale(ref_units),
-                        color=color, linewidth=2)
+                        x, w[:, c], color=color, linewidth=2)
                     plot.add_item(outline)
                     plot.add_item(curve)
                     progress.step()
@@ -237,23 +228,14 @@ def _find_y_offset(channels, spikes, strong, ref_units):
     """
     max_y = []
     min_y = []
-    if spikes:
+    for spike_dict in (spikes, strong):
+        if not spike_dict:
+            continue
+        waves = [w for _, w in
+                 _waveform_data(spike_dict, ref_units, None).itervalues()]
         for i, c in enumerate(channels):
-            max_y.append(
-                max(max(s.waveform[:, c].max() for s in d)
-                    for d in spikes.itervalues()))
-            min_y.append(
-                min(min(s.waveform[:, c].min() for s in d)
-                    for d in spikes.itervalues()))
-
-    if strong:
-        for i, c in enumerate(channels):
-            max_y.append(
-                max(max(s.waveform[:, c].max() for s in d)
-                    for d in strong.itervalues()))
-            min_y.append(
-                min(min(s.waveform[:, c].min() for s in d)
-                    for d in strong.itervalues()))
+            max_y.append(max(_channel_values(w, c).max() for w in waves))
+            min_y.append(min(_channel_values(w, c).min() for w in waves))
 
     max_offset = 0 * ref_units
     for i in range(1, len(channels)):
@@ -269,6 +251,8 @@ def _split_plot_ver(channels, spikes, strong, fade, ref_units, time_unit,
     """ Fill a plot with spikes vertically split by channel. Returns legend.
     """
     offset = 0 * ref_units
+    data = _waveform_data(spikes, ref_units, time_unit)
+    strong_data = _waveform_data(strong, ref_units, time_unit)
 
     for c in channels:
         for u in spikes:
@@ -280,17 +264,8 @@ def _split_plot_ver(channels, spikes, strong, fade, ref_units, time_unit,
             if len(spikes[u]) == 1:
                 alpha = 1.0
 
-            for s in spikes[u]:
-                if s.waveform is None or s.sampling_rate is None:
-                    raise SpykeException('Cannot create waveform plot: '
-                                         'At least one spike has no '
-                                         'waveform or sampling rate!')
-                x = (sp.arange(s.waveform.shape[0]) /
-                     s.sampling_rate).rescale(time_unit)
-                curve = make.curve(
-                    x,
-                    s.waveform[:, c].rescale(ref_units) + offset,
-                    u.name, color=color)
+            for x, w in zip(*data[u]):
+                curve = make.curve(x, w[:, c] + offset, u.name, color=color)
 
                 qcol.setAlphaF(alpha)
                 curve.setPen(Qt.QPen(qcol))
@@ -301,15 +276,11 @@ def _split_plot_ver(channels, spikes, strong, fade, ref_units, time_unit,
 
         for u in strong:
             color = helper.get_object_color(u)
-            for s in strong[u]:
-                x = (sp.arange(s.waveform.shape[0]) /
-                     s.sampling_rate).rescale(time_unit)
+            for x, w in zip(*strong_data[u]):
                 outline = make.curve(
-                    x, s.waveform[:, c].rescale(ref_units) + offset,
-                    color='#000000', linewidth=4)
+                    x, w[:, c] + offset, color='#000000', linewidth=4)
                 curve = make.curve(
-                    x, s.waveform[:, c].rescale(ref_units) + offset,
-                    color=color, linewidth=2)
+                    x, w[:, c] + offset, color=color, linewidth=2)
                 plot.add_item(outline)
                 plot.add_item(curve)
                 progress.step()
@@ -326,6 +297,8 @@ def _split_plot_hor(channels, spikes, strong, fade, ref_units, time_unit,
     """ Fill a plot with spikeshorizontally split by channel. Returns legend.
     """
     offset = 0 * time_unit
+    data = _waveform_data(spikes, ref_units, time_unit)
+    strong_data = _waveform_data(strong, ref_units, time_unit)
 
     for c in channels:
         x_off = 0 * time_unit
@@ -338,19 +311,9 @@ def _split_plot_hor(channels, spikes, strong, fade, ref_units, time_unit,
             if len(spikes[u]) == 1:
                 alpha = 1.0
 
-            for s in spikes[u]:
-                if s.waveform is None or s.sampling_rate is None:
-                    raise SpykeException(
-                        'Cannot create waveform plot: '
-                        'At least one spike has no '
-                        'waveform or sampling rate!')
-                x = (sp.arange(s.waveform.shape[0]) /
-                     s.sampling_rate).rescale(time_unit)
+            for x, w in zip(*data[u]):
                 x_off = max(x_off, x[-1])
-                curve = make.curve(
-                    x + offset,
-                    s.waveform[:, c].rescale(ref_units), u.name,
-                    color=color)
+                curve = make.curve(x + offset, w[:, c], u.name, color=color)
 
                 qcol.setAlphaF(alpha)
                 curve.setPen(Qt.QPen(qcol))
@@ -361,16 +324,12 @@ def _split_plot_hor(channels, spikes, strong, fade, ref_units, time_unit,
 
         for u in strong:
             color = helper.get_object_color(u)
-            for s in strong[u]:
-                x = (sp.arange(s.waveform.shape[0]) /
-                     s.sampling_rate).rescale(time_unit)
+            for x, w in zip(*strong_data[u]):
                 x_off = max(x_off, x[-1])
                 outline = make.curve(
-                    x + offset, s.waveform[:, c].rescale(ref_units),
-                    color='#000000', linewidth=4)
+                    x + offset, w[:, c], color='#000000', linewidth=4)
                 curve = make.curve(
-                    x + offset, s.waveform[:, c].rescale(ref_units),
-                    color=color, linewidth=2)
+                    x + offset, w[:, c], color=color, linewidth=2)
                 plot.add_item(outline)
                 plot.add_item(curve)
                 progress.step()
@@ -387,6 +346,50 @@ def _split_plot_hor(channels, spikes, strong, fade, ref_units, time_unit,
     return l
 
 
+def _waveform_data(spikes, ref_units, time_unit):
+    """ Return a dictionary with the sample times (in ``time_unit``) and the
+    waveforms (in ``ref_units``) for each list in a dictionary of spike
+    lists. The waveforms of a list are converted at once if they have the
+    same shape. ``time_unit`` can be ``None`` if no sample times are needed.
+    """
+    data = {}
+    for u, spks in spikes.iteritems():
+        for s in spks:
+            if s.waveform is None or s.sampling_rate is None:
+                raise SpykeException(
+                    'Cannot create waveform plot: '
+                    'At least one spike has no '
+                    'waveform or sampling rate!')
+        try:
+            waves = conversions.spike_waveforms(spks, ref_units)
+        except SpykeException:  # Nonuniform waveform shapes
+            waves = [s.waveform.rescale(ref_units) for s in spks]
+
+        times = []
+        if time_unit is not None:
+            # Sample times only depend on waveform length and sampling rate
+            cache = {}
+            for s, w in zip(spks, waves):
+                rate = s.sampling_rate
+                key = (w.shape[0], float(rate.magnitude),
+                       rate.dimensionality.string)
+                if key not in cache:
+                    cache[key] = (sp.arange(w.shape[0]) /
+                                  rate).rescale(time_unit)
+                times.append(cache[key])
+        data[u] = (times, waves)
+    return data
+
+
+def _channel_values(waves, channel):
+    """ Return all values of one channel from a waveform array or list.
+    """
+    if isinstance(waves, sp.ndarray):
+        return waves[:, :, channel]
+    return sp.concatenate([w[:, channel].magnitude for w in waves]) * \
+        waves[0].units
+
+
 def _add_legend(plot, spikes, strong):
     # Keys from spikes and strong without duplicates in original order
     seen = set()
@@ -1,6 +1,8 @@
 from __future__ import division
 
+import numpy.fft
 import scipy as sp
+import scipy.optimize
 import quantities as pq
 import neo
 from progress_indicator import ProgressIndicator
@@ -18,8 +20,10 @@ def psth(
 
     :param dict trains: A dictionary of lists of :class:`neo.core.SpikeTrain`
         objects.
-    :param bin_size: The desired bin size (as a time quantity).
-    :type bin_size: Quantity scalar
+    :param bin_size: The desired bin size (as a time quantity). If
+        ``'auto'``, the bin size is chosen with
+        :func:`optimal_psth_bin_size` (using the default candidate sizes).
+    :type bin_size: Quantity scalar or str
     :param bool rate_correction: Determines if a rates (``True``) or
         counts (``False``) are returned.
     :param start: The desired time for the start of the first bin. It
@@ -35,28 +39,306 @@ def psth(
         and the bin borders.
     :rtype: dict, Quantity 1D
     """
+    return _psth(trains, bin_size, rate_correction, start, stop, 0, 0)[:2]
+
+
+def bootstrap_psth(
+        trains, bin_size, n_bootstrap=1000, confidence=0.95,
+        rate_correction=True, start=0 * pq.ms, stop=sp.inf * pq.s):
+    """ Return dictionaries of peri stimulus time histograms and their
+    bootstrap confidence bands for a dictionary of spike train lists.
+
+    The histograms are identical to those of :func:`psth`. Each bootstrap
+    sample is a list of trials drawn with replacement. The trials are
+    binned once and all samples are calculated with a single matrix
+    product.
+
+    :param dict trains: A dictionary of lists of :class:`neo.core.SpikeTrain`
+        objects.
+    :param bin_size: The desired bin size (as a time quantity) or
+        ``'auto'`` (see :func:`psth`).
+    :type bin_size: Quantity scalar or str
+    :param int n_bootstrap: Number of bootstrap samples.
+    :param float confidence: The fraction of bootstrap samples enclosed by
+        the confidence bands.
+    :param bool rate_correction: Determines if a rates (``True``) or
+        counts (``False``) are returned.
+    :param start: The desired time for the start of the first bin (see
+        :func:`psth`).
+    :type start: Quantity scalar
+    :param stop: The desired time for the end of the last bin (see
+        :func:`psth`).
+    :type stop: Quantity scalar
+    :returns: A dictionary of histograms, the bin borders and a dictionary
+        of confidence bands (both dictionaries with the same indices as
+        ``trains``). Each band is a 2-D array with the lower band in the
+        first and the upper band in the second row.
+    :rtype: dict, Quantity 1D, dict
+    """
+    if n_bootstrap < 1:
+        raise ValueError('Bootstrap needs at least one sample')
+    return _psth(trains, bin_size, rate_correction, start, stop,
+                 n_bootstrap, confidence)
+
+
+def _psth(trains, bin_size, rate_correction, start, stop, n_bootstrap,
+          confidence):
+    """ Return histograms, bin borders and (if ``n_bootstrap`` is larger
+    than 0, otherwise an empty dictionary) confidence bands for
+    :func:`psth` and :func:`bootstrap_psth`.
+    """
     if not trains:
         raise SpykeException('No spike trains for PSTH!')
 
     start, stop = tools.minimum_spike_train_interval(trains, start, stop)
-    binned, bins = tools.bin_spike_trains(trains, 1.0 / bin_size, start, stop)
+    if isinstance(bin_size, basestring):
+        if bin_size != 'auto':
+            raise ValueError('Unknown bin size: %s' % bin_size)
+        bin_size = optimal_psth_bin_size(trains, start=start, stop=stop)
+    bins = tools.bin_edges(1.0 / bin_size, start, stop)
+    num_bins = bins.size - 1
 
     cumulative = {}
+    bands = {}
     time_multiplier = 1.0 / float(bin_size.rescale(pq.s))
-    for u in binned:
-        if not binned[u]:
+    for u in trains:
+        if not trains[u]:
             cumulative[u] = sp.array([])
+            bands[u] = sp.zeros((2, 0))
+            continue
+
+        if rate_correction:
+            factor = time_multiplier / len(trains[u])
         else:
-            if rate_correction:
-                cumulative[u] = sp.mean(sp.array(binned[u]), 0)
-            else:
-                cumulative[u] = sp.sum(sp.array(binned[u]), 0)
-            cumulative[u] *= time_multiplier
+            factor = 1
+
+        if n_bootstrap > 0:
+            counts = tools.spike_count_matrix(trains[u], bins)
+            cumulative[u] = counts.sum(axis=0) * factor
+            bands[u] = _percentile_bands(
+                _bootstrap_sums(counts, n_bootstrap) * factor, confidence)
+            continue
+
+        # Sum counts of all trials with a single bincount
+        bin_indices = tools.spike_train_bin_indices(trains[u], bins)[0]
+        counts = sp.bincount(bin_indices, minlength=num_bins)[:num_bins]
+        cumulative[u] = counts * factor
 
-    return cumulative, bins
+    if n_bootstrap < 1:
+        bands = {}
+    return cumulative, bins, bands
 
 
-def aligned_spike_trains(trains, events, copy=True):
+def optimal_psth_bin_size(
+        trains, bin_sizes=None, start=0 * pq.ms, stop=sp.inf * pq.s,
+        resolution=None):
+    """ Return the optimal bin size for a PSTH of a dictionary of spike
+    train lists.
+
+    Implements the histogram bin width optimization from
+    (Shimazaki, Shinomoto. Neural Computation. 2007). The spike counts
+    of all candidate bin sizes are derived from a single cumulative spike
+    count with a fine resolution, so the spike trains are only binned once.
+    The bin sizes are therefore rounded to multiples of this resolution.
+    If ``trains`` contains multiple indices, the bin size minimizing the sum
+    of the cost functions for all indices is returned.
+
+    :param dict trains: A dictionary of lists of :class:`neo.core.SpikeTrain`
+        objects.
+    :param bin_sizes: Candidate bin sizes. If ``None``, 100 logarithmically
+        spaced bin sizes between ``resolution`` and half of the duration
+        are used.
+    :type bin_sizes: Quantity 1D
+    :param start: The desired time for the start of the first bin. It
+        will be recalculated if there are spike trains which start
+        later than this time.
+    :type start: Quantity scalar
+    :param stop: The desired time for the end of the last bin. It will
+        be recalculated if there are spike trains which end earlier
+        than this time.
+    :type stop: Quantity scalar
+    :param resolution: The resolution of the cumulative spike count. If
+        ``None``, a tenth of the smallest bin size is used or, if
+        ``bin_sizes`` is ``None``, 1/10000 of the duration.
+    :type resolution: Quantity scalar
+    :returns: The bin size with the smallest cost.
+    :rtype: Quantity scalar
+    """
+    start, stop = tools.minimum_spike_train_interval(trains, start, stop)
+    duration = stop - start.rescale(stop.units)
+
+    if bin_sizes is None:
+        if resolution is None:
+            resolution = duration / 10000
+        num_fine = int(round(float((duration / resolution).simplified), 6))
+        multiples = sp.logspace(0, sp.log10(max(1, num_fine // 2)), 100)
+    else:
+        if resolution is None:
+            resolution = bin_sizes.min() / 10
+        num_fine = int(round(float((duration / resolution).simplified), 6))
+        multiples = sp.asarray((bin_sizes / resolution).simplified)
+    multiples = sp.unique(sp.maximum(1, sp.around(multiples).astype(int)))
+
+    dt = float(resolution.rescale(stop.units))
+    fine_bins = tools.bin_edges(
+        1.0 / resolution, start, start + num_fine * dt * stop.units)
+
+    costs = sp.zeros(multiples.size)
+    costs[multiples > num_fine] = sp.inf
+    for t in trains.itervalues():
+        if not t:
+            continue
+
+        bin_indices = tools.spike_train_bin_indices(t, fine_bins)[0]
+        cumulative = sp.zeros(num_fine + 1, dtype=int)
+        sp.cumsum(sp.bincount(bin_indices, minlength=num_fine)[:num_fine],
+                  out=cumulative[1:])
+        for i, m in enumerate(multiples):
+            if m > num_fine:
+                continue
+            counts = sp.diff(cumulative[::m])
+            costs[i] += (2 * sp.mean(counts) - sp.var(counts)) / \
+                (len(t) * m * dt) ** 2
+
+    return multiples[sp.argmin(costs)] * resolution.rescale(stop.units)
+
+
+def _bootstrap_sums(per_trial, n_bootstrap):
+    """ Return sums over resampled trials for a 2-D array with one row per
+    trial. The trials of each bootstrap sample are drawn with replacement.
+    All samples are calculated with a single matrix product of the trial
+    weights (how often each trial is drawn) with ``per_trial``.
+
+    :returns: 2-D array with one row per bootstrap sample.
+    """
+    num_trials = per_trial.shape[0]
+    weights = sp.random.multinomial(
+        num_trials, sp.ones(num_trials) / num_trials, size=n_bootstrap)
+    return sp.dot(weights, per_trial)
+
+
+def _percentile_bands(samples, confidence):
+    """ Return lower and upper band enclosing the fraction ``confidence`` of
+    the rows of ``samples`` as a 2-D array with two rows.
+    """
+    return sp.percentile(
+        samples, [50.0 * (1.0 - confidence), 50.0 * (1.0 + confidence)],
+        axis=0)
+
+
+class AlignedSpikeTrain(object):
+    """ A view of a :class:`neo.core.SpikeTrain` shifted by a time offset.
+
+    Only the original spike train and the offset are stored. The shifted
+    spike times are computed when they are accessed and the waveforms are
+    shared with the original spike train, so creating a view does not copy
+    any data. Views can be used instead of spike trains in :func:`psth`,
+    :func:`spike_density_estimation` and :func:`collapsed_spike_trains`.
+
+    :param train: The original spike train.
+    :type train: :class:`neo.core.SpikeTrain`
+    :param offset: The time in ``train`` that will be time 0 in the view.
+    :type offset: Quantity scalar
+    """
+
+    def __init__(self, train, offset):
+        self.train = train
+        self.offset = offset
+
+    def _offset_magnitude(self):
+        return float(self.offset.rescale(self.train.units))
+
+    @property
+    def units(self):
+        return self.train.units
+
+    @property
+    def magnitude(self):
+        """ The shifted spike times in :attr:`units` without units.
+        """
+        return self.train.magnitude - self._offset_magnitude()
+
+    @property
+    def times(self):
+        """ The shifted spike times.
+        """
+        return self.magnitude * self.units
+
+    @property
+    def t_start(self):
+        return self.train.t_start - self.offset.rescale(self.train.units)
+
+    @property
+    def t_stop(self):
+        return self.train.t_stop - self.offset.rescale(self.train.units)
+
+    @property
+    def size(self):
+        return self.train.size
+
+    @property
+    def waveforms(self):
+        return self.train.waveforms
+
+    @property
+    def sampling_rate(self):
+        return self.train.sampling_rate
+
+    @property
+    def left_sweep(self):
+        return self.train.left_sweep
+
+    @property
+    def segment(self):
+        return self.train.segment
+
+    @property
+    def unit(self):
+        return self.train.unit
+
+    @property
+    def annotations(self):
+        return self.train.annotations
+
+    def __len__(self):
+        return len(self.train)
+
+    def __getitem__(self, key):
+        # Only shift the requested spikes
+        return (self.train.magnitude[key] - self._offset_magnitude()) * \
+            self.units
+
+    def __iter__(self):
+        return iter(self.times)
+
+    def rescale(self, units):
+        """ Return the shifted spike times in the given units.
+
+        :param units: The desired units.
+        :type units: Quantity scalar
+        :rtype: Quantity 1D
+        """
+        return self.times.rescale(units)
+
+    def spike_train(self):
+        """ Return a new spike train with the shifted spike times. The
+        waveforms are not copied.
+
+        :rtype: :class:`neo.core.SpikeTrain`
+        """
+        t = self.train
+        st = neo.SpikeTrain(
+            self.times, self.t_stop, t_start=self.t_start,
+            sampling_rate=t.sampling_rate, waveforms=t.waveforms,
+            left_sweep=t.left_sweep, name=t.name,
+            file_origin=t.file_origin, description=t.description,
+            **t.annotations)
+        st.segment = t.segment
+        st.unit = t.unit
+        return st
+
+
+def aligned_spike_trains(trains, events, copy=True, view=False):
     """ Return a list of spike trains aligned to an event (the event will
     be time 0 on the returned trains).
 
@@ -68,12 +350,17 @@ def aligned_spike_trains(trains, events, copy=True):
         spike trains  will be returned. If not, every spike train needs
         exactly one corresponding event, otherwise a ``ValueError`` will
         be raised. Otherwise, entries with no event will be ignored.
+    :param bool view: If ``True``, :class:`AlignedSpikeTrain` views of the
+        original spike trains are returned instead of spike trains. The
+        original spike trains are not modified and no spike times or
+        waveforms are copied. Entries with no event will be ignored and
+        ``copy`` has no effect.
     """
     ret = []
     for t in trains:
         s = t.segment
         if s not in events:
-            if not copy:
+            if not copy and not view:
                 raise ValueError(
                     'Cannot align spike trains: At least one segment does' +
                     'not have an align event.')
@@ -81,6 +368,10 @@ def aligned_spike_trains(trains, events, copy=True):
 
         e = events[s]
 
+        if view:
+            ret.append(AlignedSpikeTrain(t, e.time))
+            continue
+
         if copy:
             st = neo.SpikeTrain(
                 t, t.t_stop, units=t.units,
@@ -99,15 +390,108 @@ def aligned_spike_trains(trains, events, copy=True):
     return ret
 
 
+class PSTHAccumulator(object):
+    """ Incrementally calculates peri stimulus time histograms when trials
+    become available one at a time, e.g. during an experiment.
+
+    The bins are fixed when the accumulator is created. Adding a trial only
+    updates the summed counts of the bins containing spikes of the trial,
+    so the cost does not depend on the number of trials that were already
+    added. For spike trains covering the whole interval from ``start`` to
+    ``stop``, the results are the same as calculated by :func:`psth` for
+    all added trials.
+
+    :param bin_size: The desired bin size (as a time quantity).
+    :type bin_size: Quantity scalar
+    :param start: The time for the start of the first bin.
+    :type start: Quantity scalar
+    :param stop: The time for the end of the last bin.
+    :type stop: Quantity scalar
+    :param sequence units: If given, only spike trains with these indices
+        are included when adding trials. Otherwise, all indices are used.
+    """
+
+    def __init__(self, bin_size, start, stop, units=None):
+        self.bin_size = bin_size
+        self.bins = tools.bin_edges(1.0 / bin_size, start, stop)
+        self.units = units
+        self.counts = {}
+        self.num_trials = {}
+        if units is not None:
+            for u in units:
+                self._add_unit(u)
+
+    def _add_unit(self, unit):
+        self.counts[unit] = sp.zeros(self.bins.size - 1, dtype=int)
+        self.num_trials[unit] = 0
+
+    def add_trial(self, trains, event=None):
+        """ Add the spike trains of a trial.
+
+        :param dict trains: A dictionary of :class:`neo.core.SpikeTrain`
+            objects (one spike train for each index) recorded in the trial.
+        :param event: If given, the spike trains are aligned to this event
+            (it will be at time 0 in the histograms).
+        :type event: :class:`neo.core.Event`
+        """
+        for u, t in trains.iteritems():
+            if self.units is not None and u not in self.counts:
+                continue
+            if u not in self.counts:
+                self._add_unit(u)
+            if event is not None:
+                t = AlignedSpikeTrain(t, event.time)
+
+            bin_indices = tools.spike_train_bin_indices([t], self.bins)[0]
+            sp.add.at(self.counts[u], bin_indices, 1)
+            self.num_trials[u] += 1
+
+    def current(self, kernel=None):
+        """ Return the histograms for all trials added so far.
+
+        :param kernel: If given, the rates are also smoothed with this
+            kernel.
+        :type kernel: :class:`.signal_processing.Kernel`
+        :returns: Three dictionaries (with the same indices as the added
+            spike trains) containing the summed counts, the rates (as
+            returned by :func:`psth`) and, if ``kernel`` is given, the
+            smoothed rates (Quantity 1D in Hz). The last value is the bin
+            borders.
+        :rtype: dict, dict, dict or ``None``, Quantity 1D
+        """
+        counts = {}
+        rates = {}
+        smoothed = None
+        if kernel is not None:
+            smoothed = {}
+
+        time_multiplier = 1.0 / float(self.bin_size.rescale(pq.s))
+        for u, c in self.counts.iteritems():
+            counts[u] = c.copy()
+            num_trials = max(1, self.num_trials[u])
+            rates[u] = c * time_multiplier / num_trials
+            if kernel is not None:
+                smoothed[u] = sigproc.smooth(
+                    c / num_trials, kernel, 1.0 / self.bin_size,
+                    ensure_unit_area=True).rescale(pq.Hz)
+        return counts, rates, smoothed, self.bins
+
+
 def spike_density_estimation(trains, start=0 * pq.ms, stop=None,
                              kernel=None, kernel_size=100 * pq.ms,
-                             optimize_steps=None, progress=None):
+                             optimize_steps=None, progress=None,
+                             adaptive=False, num_points=1024,
+                             resolution=None, eval_points=None,
+                             binless=False):
     """ Create a spike density estimation from a dictionary of
     lists of spike trains.
 
     The spike density estimations give an estimate of the instantaneous
-    rate. The density estimation is evaluated at 1024 equally spaced
-    points covering the range of the input spike trains. Optionally finds
+    rate. By default, the density estimation is evaluated at 1024 equally
+    spaced points covering the range of the input spike trains by
+    convolving the binned spike trains with the discretized kernel.
+    Alternatively, the density can be evaluated exactly (without binning)
+    at arbitrary time points. Optionally finds
     optimal kernel size for given data using the algorithm from
     (Shimazaki, Shinomoto. Journal of Computational Neuroscience. 2010).
 
@@ -139,19 +523,109 @@ def spike_density_estimation(trains, start=0 * pq.ms, stop=None,
     :type optimize_steps: Quantity 1D
     :param progress: Set this parameter to report progress.
     :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :param bool adaptive: If ``True``, a locally optimal kernel size is
+        chosen from ``optimize_steps`` for each evaluation point (see
+        :func:`optimal_local_gauss_kernel_sizes`). A Gaussian kernel
+        will always be used in this case and ``optimize_steps`` has to be
+        given.
+    :param int num_points: Number of equally spaced evaluation points
+        covering the estimation interval.
+    :param resolution: If given, the number of evaluation points is chosen
+        so that their distance is at most this time. Overrides
+        ``num_points``.
+    :type resolution: Quantity scalar
+    :param eval_points: If given, the density estimation is evaluated
+        exactly (as with ``binless``) at these time points instead of
+        equally spaced points. Only spikes between ``start`` and ``stop``
+        are included in the estimation.
+    :type eval_points: Quantity 1D
+    :param bool binless: If ``True``, the density estimation is not
+        calculated with a convolution of binned spike trains. Instead, the
+        kernel is evaluated exactly at each evaluation point for all spikes
+        within the support of the kernel. This is faster than the
+        convolution for sparse spike trains or few evaluation points and
+        avoids discretization errors. The kernel has to be a normalized
+        :class:`.signal_processing.Kernel` in this case and ``adaptive``
+        is not supported.
 
     :returns: Three values:
 
         * A dictionary of the spike density estimations (Quantity 1D in
           Hz). Indexed the same as ``trains``.
-        * A dictionary of kernel sizes (Quantity scalars). Indexed the
-          same as ``trains``.
+        * A dictionary of kernel sizes (Quantity scalars or, if
+          ``adaptive`` is ``True``, Quantity 1D with the kernel size for
+          each evaluation point). Indexed the same as ``trains``.
         * The used evaluation points.
     :rtype: dict, dict, Quantity 1D
     """
+    return _spike_density_estimation(
+        trains, start, stop, kernel, kernel_size, optimize_steps, progress,
+        adaptive, num_points, resolution, eval_points, binless, 0, 0)[:3]
+
+
+def bootstrap_spike_density_estimation(
+        trains, n_bootstrap=1000, confidence=0.95, start=0 * pq.ms,
+        stop=None, kernel=None, kernel_size=100 * pq.ms,
+        optimize_steps=None, progress=None, num_points=1024,
+        resolution=None, eval_points=None, binless=False):
+    """ Create a spike density estimation with bootstrap confidence bands
+    from a dictionary of lists of spike trains.
+
+    The density estimations are identical to those of
+    :func:`spike_density_estimation` (adaptive kernel sizes are not
+    supported). Each bootstrap sample is a list of trials drawn with
+    replacement. The trials are only binned (or, if ``binless`` is
+    ``True``, evaluated) once and all bootstrap samples are smoothed
+    together.
+
+    :param dict trains: A dictionary of :class:`neo.core.SpikeTrain` lists.
+    :param int n_bootstrap: Number of bootstrap samples.
+    :param float confidence: The fraction of bootstrap samples enclosed by
+        the confidence bands.
+
+    For the other parameters, see :func:`spike_density_estimation`.
+
+    :returns: Four values:
+
+        * A dictionary of the spike density estimations (Quantity 1D in
+          Hz). Indexed the same as ``trains``.
+        * A dictionary of kernel sizes (Quantity scalars). Indexed the same
+          as ``trains``.
+        * The used evaluation points.
+        * A dictionary of confidence bands. Each band is a Quantity 2D in
+          Hz with the lower band in the first and the upper band in the
+          second row. Indexed the same as ``trains``.
+    :rtype: dict, dict, Quantity 1D, dict
+    """
+    if n_bootstrap < 1:
+        raise ValueError('Bootstrap needs at least one sample')
+    return _spike_density_estimation(
+        trains, start, stop, kernel, kernel_size, optimize_steps, progress,
+        False, num_points, resolution, eval_points, binless, n_bootstrap,
+        confidence)
+
+
+def _spike_density_estimation(
+        trains, start, stop, kernel, kernel_size, optimize_steps, progress,
+        adaptive, num_points, resolution, eval_points, binless, n_bootstrap,
+        confidence):
+    """ Return density estimations, kernel sizes, evaluation points and
+    (if ``n_bootstrap`` is larger than 0, otherwise an empty dictionary)
+    confidence bands for :func:`spike_density_estimation` and
+    :func:`bootstrap_spike_density_estimation`.
+    """
     if not progress:
         progress = ProgressIndicator()
 
+    if adaptive and (optimize_steps is None or len(optimize_steps) < 1):
+        raise ValueError(
+            'Adaptive spike density estimation needs optimize_steps.')
+    if eval_points is not None:
+        binless = True
+    if adaptive and binless:
+        raise ValueError(
+            'Adaptive spike density estimation cannot be binless.')
+
     if optimize_steps is None or len(optimize_steps) < 1:
         units = kernel_size.units
     else:
@@ -170,8 +644,29 @@ def spike_density_estimation(trains, start=0 * pq.ms, stop=None,
     else:
         stop = max_stop
     stop.units = units
-    bins = sp.linspace(start, stop, 1025)
-    eval_points = bins[:-1] + (bins[1] - bins[0]) / 2
+    if resolution is not None:
+        num_points = max(1, int(sp.ceil(round(
+            float((stop - start) / resolution.rescale(units)), 6))))
+    if eval_points is None:
+        bins = sp.linspace(start, stop, num_points + 1)
+        eval_points = bins[:-1] + (bins[1] - bins[0]) / 2
+    else:
+        eval_points = eval_points.rescale(units)
+
+    if adaptive:
+        progress.set_ticks(len(optimize_steps) * len(trains))
+        progress.set_status('Creating adaptive spike density plot')
+        kernel_size = {}
+        kde = {}
+        for u, t in trains.iteritems():
+            sliced = collapsed_spike_trains(t).rescale(units).time_slice(
+                start, stop)
+            kernel_size[u], kde[u] = optimal_local_gauss_kernel_sizes(
+                sliced, optimize_steps, progress=progress,
+                num_bins=num_points)
+            kde[u] = kde[u] / max(1, len(t))
+            kde[u].units = pq.Hz
+        return kde, kernel_size, eval_points, {}
 
     if optimize_steps is None or len(optimize_steps) < 1:
         kernel_size = {u: kernel_size for u in trains}
@@ -190,44 +685,170 @@ def spike_density_estimation(trains, start=0 * pq.ms, stop=None,
 
     # Calculate KDEs
     kde = {}
+    bands = {}
     for u, t in trains.iteritems():
         # Collapse spike trains
-        collapsed = collapsed_spike_trains(t).rescale(units)
+        collapsed, labels = collapsed_spike_trains(t, return_labels=True)
+        collapsed = collapsed.rescale(units)
         scaled_kernel = sigproc.as_kernel_of_size(kernel, kernel_size[u])
+        sliced = collapsed.time_slice(start, stop)
+
+        if binless:
+            if not scaled_kernel.normalize:
+                raise ValueError(
+                    'Binless spike density estimation needs a normalized '
+                    'kernel.')
+            num_trials = max(1, len(t))
+            if n_bootstrap > 0:
+                inside = (collapsed >= start) & (collapsed <= stop)
+                per_trial = _binless_kernel_sum(
+                    collapsed.magnitude[inside], eval_points.magnitude,
+                    scaled_kernel, units, labels[inside], num_trials)
+                kde[u] = per_trial.sum(axis=0)
+                bands[u] = _percentile_bands(
+                    _bootstrap_sums(per_trial, n_bootstrap),
+                    confidence) / num_trials / units
+                bands[u] = bands[u].rescale(pq.Hz)
+            else:
+                kde[u] = _binless_kernel_sum(
+                    sliced.magnitude, eval_points.magnitude, scaled_kernel,
+                    units)
+            kde[u] = (kde[u] / num_trials / units).rescale(pq.Hz)
+            progress.step()
+            continue
 
         # Create density estimation using convolution
-        sliced = collapsed.time_slice(start, stop)
-        sampling_rate = 1024.0 / (sliced.t_stop - sliced.t_start)
+        sampling_rate = num_points / (sliced.t_stop - sliced.t_start)
+        discretization_params = {
+            'num_bins': 2 * num_points, 'ensure_unit_area': True}
         kde[u] = sigproc.st_convolve(
             sliced, scaled_kernel, sampling_rate,
-            kernel_discretization_params={
-                'num_bins': 2048, 'ensure_unit_area': True})[0] / len(trains[u])
+            kernel_discretization_params=discretization_params)[0] / len(t)
         kde[u].units = pq.Hz
-    return kde, kernel_size, eval_points
-
 
-def collapsed_spike_trains(trains):
+        if n_bootstrap > 0:
+            # Bin all trials once and smooth all bootstrap samples together
+            bins = tools.bin_edges(
+                sampling_rate, sliced.t_start, sliced.t_stop)
+            counts = tools.spike_count_matrix(t, bins)
+            smoothed = sigproc.smooth(
+                _bootstrap_sums(counts, n_bootstrap) / len(t),
+                scaled_kernel, sampling_rate, **discretization_params)
+            bands[u] = _percentile_bands(
+                smoothed.magnitude, confidence) * smoothed.units
+            bands[u] = bands[u].rescale(pq.Hz)
+
+    return kde, kernel_size, eval_points, bands
+
+
+def _binless_kernel_sum(times, points, kernel, time_unit, labels=None,
+                        num_labels=1, max_pairs=2 ** 20):
+    """ Return the sum of the kernel functions centered at ``times``
+    evaluated at ``points`` (both arrays in ``time_unit`` without units).
+    If ``labels`` (an integer label smaller than ``num_labels`` for each
+    spike) is given, separate sums for each label are returned as 2-D
+    array with one row per label.
+
+    Only spikes within the support of the kernel (as given by
+    :meth:`.signal_processing.Kernel.boundary_enclosing_at_least`) are
+    considered for each point. They are found with binary searches in the
+    sorted spike times and the kernel is evaluated for at most ``max_pairs``
+    point-spike pairs at once.
+    """
+    evaluate = kernel.bound_evaluator(time_unit)
+    try:
+        boundary = float(kernel.boundary_enclosing_at_least(
+            sigproc.default_kernel_area_fraction).rescale(time_unit))
+    except NotImplementedError:
+        boundary = sp.inf
+
+    times = sp.asarray(times, dtype=float)
+    order = sp.argsort(times)
+    times = times[order]
+    if labels is not None:
+        labels = sp.asarray(labels)[order]
+    points = sp.asarray(points, dtype=float)
+    lower = sp.searchsorted(times, points - boundary, 'left')
+    upper = sp.searchsorted(times, points + boundary, 'right')
+    counts = upper - lower
+    offsets = sp.zeros(points.size + 1, dtype=int)
+    sp.cumsum(counts, out=offsets[1:])
+
+    result = sp.zeros((num_labels, points.size))
+    i = 0
+    while i < points.size:
+        end = sp.searchsorted(offsets, offsets[i] + max_pairs, 'right') - 1
+        end = min(points.size, max(end, i + 1))
+        c = counts[i:end]
+        owner = sp.repeat(sp.arange(end - i), c)
+        spike_idx = sp.arange(offsets[end] - offsets[i]) - \
+            sp.repeat(offsets[i:end] - offsets[i] - lower[i:end], c)
+        values = evaluate(points[i + owner] - times[spike_idx])
+        if labels is not None:
+            owner += labels[spike_idx] * (end - i)
+        result[:, i:end] = sp.bincount(
+            owner, weights=values,
+            minlength=num_labels * (end - i)).reshape(num_labels, end - i)
+        i = end
+    if labels is None:
+        return result[0]
+    return result
+
+
+def collapsed_spike_trains(trains, sort=False, return_labels=False):
     """ Return a superposition of a list of spike trains.
 
     :param iterable trains: A list of :class:`neo.core.SpikeTrain` objects
+    :param bool sort: If ``True``, the spikes in the returned spike train
+        are sorted by time. Spikes with the same time are ordered by the
+        index of their spike train in ``trains``.
+    :param bool return_labels: If ``True``, an array containing the index
+        of the spike train in ``trains`` for each spike is returned in
+        addition to the superposition.
     :returns: A spike train object containing all spikes of the given
-        spike trains.
-    :rtype: :class:`neo.core.SpikeTrain`
+        spike trains. If ``return_labels`` is ``True``, a tuple of the spike
+        train and the labels.
+    :rtype: :class:`neo.core.SpikeTrain` or
+        (:class:`neo.core.SpikeTrain`, 1-D array)
     """
     if not trains:
-        return neo.SpikeTrain([] * pq.s, 0 * pq.s)
+        collapsed = neo.SpikeTrain([] * pq.s, 0 * pq.s)
+        if return_labels:
+            return collapsed, sp.array([], dtype=int)
+        return collapsed
 
     start = min((t.t_start for t in trains))
     stop = max((t.t_stop for t in trains))
 
-    collapsed = []
+    # Concatenate all spike times at once
+    times = []
     for t in trains:
-        collapsed.extend(sp.asarray(t.rescale(stop.units)))
-
-    return neo.SpikeTrain(collapsed * stop.units, t_stop=stop, t_start=start)
-
-
-def optimal_gauss_kernel_size(train, optimize_steps, progress=None):
+        factor = float(t.units.rescale(stop.units))
+        if factor == 1.0:
+            times.append(t.magnitude)
+        else:
+            times.append(factor * t.magnitude)
+    times = sp.concatenate(times).astype(float)
+
+    labels = None
+    if return_labels:
+        labels = sp.repeat(sp.arange(len(trains)), [len(t) for t in trains])
+    if sort:
+        # Stable sort, the spike trains are usually already sorted
+        order = sp.argsort(times, kind='mergesort')
+        times = times[order]
+        if labels is not None:
+            labels = labels[order]
+
+    collapsed = neo.SpikeTrain(
+        times, units=stop.units, t_stop=stop, t_start=start, copy=False)
+    if return_labels:
+        return collapsed, labels
+    return collapsed
+
+
+def optimal_gauss_kernel_size(
+        train, optimize_steps, progress=None, refine=False):
     """ Return the optimal kernel size for a spike density estimation
     of a spike train for a gaussian kernel. This function takes a single
     spike train, which can be a superposition of multiple spike trains
@@ -236,6 +857,9 @@ def optimal_gauss_kernel_size(train, optimize_steps, progress=None):
 
     Implements the algorithm from
     (Shimazaki, Shinomoto. Journal of Computational Neuroscience. 2010).
+    The cost function is evaluated for all kernel sizes at once in the
+    frequency domain, using the analytic transfer function of the Gaussian
+    kernel.
 
     :param train: The spike train for which the kernel
         size should be optimized.
@@ -246,6 +870,11 @@ def optimal_gauss_kernel_size(train, optimize_steps, progress=None):
     :param progress: Set this parameter to report progress. Will be
         advanced by len(`optimize_steps`) steps.
     :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :param bool refine: If ``True``, the best kernel size from
+        ``optimize_steps`` will be refined by a continuous search (Brent's
+        method using golden-section steps) between its neighboring sizes.
+        The returned size will then in general not be one of
+        ``optimize_steps``.
     :returns: Best of the given kernel sizes
     :rtype: Quantity scalar
     """
@@ -255,24 +884,137 @@ def optimal_gauss_kernel_size(train, optimize_steps, progress=None):
     x = train.rescale(optimize_steps.units)
 
     N = len(train)
-    C = {}
 
     sampling_rate = 1024.0 / (x.t_stop - x.t_start)
     dt = float(1.0 / sampling_rate)
     y_hist = tools.bin_spike_trains({0: [x]}, sampling_rate)[0][0][0]
     y_hist = sp.asfarray(y_hist) / N / dt
-    for step in optimize_steps:
-        s = float(step)
-        yh = sigproc.smooth(
-            y_hist, sigproc.GaussianKernel(2 * step), sampling_rate, num_bins=2048,
-            ensure_unit_area=True) * optimize_steps.units
+
+    smooth = _gauss_smoother(y_hist, dt)
+
+    def cost(steps):
+        yh = smooth(steps)
 
         # Equation from Matlab code, 7/2012
-        c = (sp.sum(yh ** 2) * dt -
-             2 * sp.sum(yh * y_hist) * dt +
-             2 * 1 / sp.sqrt(2 * sp.pi) / s / N)
-        C[s] = c * N * N
-        progress.step()
+        c = (sp.sum(yh ** 2, axis=1) * dt -
+             2 * sp.dot(yh, y_hist) * dt +
+             2 * 1 / sp.sqrt(2 * sp.pi) / steps / N)
+        return c * N * N
+
+    steps = sp.sort(sp.asarray(optimize_steps, dtype=float))
+    C = cost(steps)
+    progress.step(len(steps))
+
+    best = sp.argmin(C)
+    best_step = steps[best]
+    if refine and steps.size > 1:
+        lower = steps[max(0, best - 1)]
+        upper = steps[min(steps.size - 1, best + 1)]
+        refined = scipy.optimize.minimize_scalar(
+            lambda s: cost(sp.array([s]))[0], bounds=(lower, upper),
+            method='bounded')
+        if refined.fun < C[best]:
+            best_step = refined.x
 
     # Return kernel size with smallest cost
-    return min(C, key=C.get) * optimize_steps.units
+    return best_step * optimize_steps.units
+
+
+def optimal_local_gauss_kernel_sizes(
+        train, optimize_steps, window_factor=5.0, progress=None,
+        num_bins=1024):
+    """ Return locally optimal kernel sizes for a spike density estimation
+    of a spike train with a gaussian kernel and the resulting density
+    estimation. Like :func:`optimal_gauss_kernel_size`, this function takes
+    a single spike train, which can be a superposition of multiple spike
+    trains.
+
+    Implements the locally adaptive variant of the algorithm from
+    (Shimazaki, Shinomoto. Journal of Computational Neuroscience. 2010):
+    The cost function is integrated over a window around each time point
+    and the kernel size with the lowest local cost is used at this time
+    point. The smoothing for all kernel sizes is done in the frequency
+    domain and the windowed integration with cumulative sums, so the
+    run-time is :math:`O(k \cdot n \log n)` for :math:`k` kernel sizes and
+    :math:`n` bins.
+
+    :param train: The spike train for which the kernel sizes should be
+        optimized. The estimation covers the time from ``t_start`` to
+        ``t_stop`` of the spike train with ``num_bins`` bins.
+    :type train: :class:`neo.core.SpikeTrain`
+    :param optimize_steps: Array of kernel sizes to choose from.
+    :type optimize_steps: Quantity 1D
+    :param float window_factor: Length of the window for the local cost
+        function relative to the respective kernel size. Larger values lead
+        to less variation in the kernel sizes.
+    :param progress: Set this parameter to report progress. Will be
+        advanced by len(`optimize_steps`) steps.
+    :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :param int num_bins: Number of bins for the estimation.
+    :returns: Two values:
+
+        * The kernel size for each bin (Quantity 1D with the units of
+          ``optimize_steps``).
+        * The density estimation for each bin using the respective kernel
+          size (Quantity 1D with the inverse units of ``optimize_steps``).
+          It is not divided by the number of superimposed spike trains.
+    :rtype: Quantity 1D, Quantity 1D
+    """
+    if not progress:
+        progress = ProgressIndicator()
+
+    x = train.rescale(optimize_steps.units)
+
+    sampling_rate = num_bins / (x.t_stop - x.t_start)
+    dt = float(1.0 / sampling_rate)
+    y_hist = tools.bin_spike_trains({0: [x]}, sampling_rate)[0][0][0]
+    y_hist = sp.asfarray(y_hist) / dt
+
+    steps = sp.sort(sp.asarray(optimize_steps, dtype=float))
+    yh = _gauss_smoother(y_hist, dt)(steps)
+
+    # Local cost density, integrating it over time yields the cost function
+    # used in optimal_gauss_kernel_size (multiplied with the squared
+    # number of spikes).
+    c = yh ** 2 - 2 * yh * y_hist + \
+        2 / sp.sqrt(2 * sp.pi) / sp.atleast_2d(steps).T * y_hist
+
+    # Mean of the local cost in a window around each bin
+    cumulative = sp.zeros((steps.size, y_hist.size + 1))
+    sp.cumsum(c, axis=1, out=cumulative[:, 1:])
+    half_window = sp.atleast_2d(sp.around(
+        0.5 * window_factor * steps / dt).astype(int)).T
+    positions = sp.arange(y_hist.size)
+    lower = sp.clip(positions - half_window, 0, y_hist.size)
+    upper = sp.clip(positions + half_window + 1, 0, y_hist.size)
+    rows = sp.atleast_2d(sp.arange(steps.size)).T
+    local_cost = (cumulative[rows, upper] - cumulative[rows, lower]) / \
+        (upper - lower)
+    progress.step(len(steps))
+
+    best = sp.argmin(local_cost, axis=0)
+    return (steps[best] * optimize_steps.units,
+            yh[best, positions] / optimize_steps.units)
+
+
+def _gauss_smoother(y_hist, dt):
+    """ Return a function smoothing a histogram with Gaussian kernels.
+
+    The returned function takes a 1D array of kernel sizes (standard
+    deviations in the units of ``dt``) and returns a 2D array with one
+    smoothed histogram for each kernel size. The Fourier transform of the
+    histogram is only calculated once and the analytic transfer function
+    of the Gaussian kernel is used for the smoothing.
+    """
+    # Zero padding to avoid circular convolution effects
+    num_points = 2 * y_hist.size
+    spectrum = numpy.fft.rfft(y_hist, num_points)
+    freqs = numpy.fft.rfftfreq(num_points, dt)
+
+    def smooth(steps):
+        # Transfer function of a Gaussian kernel with standard deviation
+        # sigma: exp(-2 (pi f sigma)^2)
+        transfer = sp.exp(-2.0 * (sp.pi * sp.outer(steps, freqs)) ** 2)
+        return numpy.fft.irfft(
+            spectrum * transfer, num_points, axis=1)[:, :y_hist.size]
+    return smooth
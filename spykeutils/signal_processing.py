@@ -1,6 +1,8 @@
 import copy
 import quantities as pq
 import scipy as sp
+import scipy.linalg
+import scipy.optimize
 import scipy.signal
 import scipy.special
 import tools
@@ -42,6 +44,70 @@ class Kernel(object):
 
         return self._evaluate(t, kernel_size) * normalization
 
+    def bound_evaluator(self, time_unit=pq.s):
+        """ Returns a function evaluating the kernel on plain arrays.
+
+        The kernel size and normalization are converted to `time_unit` once,
+        so the returned function does not need to do any unit handling. This
+        makes it suitable for use in inner loops. The evaluators are cached
+        per time unit and kernel size.
+
+        :param time_unit: Unit of the time points passed to the returned
+            function.
+        :type time_unit: Quantity scalar
+        :returns: A function taking a 1D or 2D array of time points in
+            `time_unit` (without units) and returning the kernel evaluations
+            as array without units. For normalized kernels the values are in
+            the inverse of `time_unit`, otherwise they are dimensionless.
+        :rtype: func
+        """
+
+        if hasattr(self.kernel_size, 'rescale'):
+            size = float(self.kernel_size.rescale(time_unit))
+        else:
+            size = float(self.kernel_size)
+
+        key = (time_unit.dimensionality.string, size, self.normalize)
+        cache = self.__dict__.setdefault('_bound_evaluators', {})
+        if key not in cache:
+            if self.normalize:
+                normalization = self.normalization_factor(self.kernel_size)
+                if hasattr(normalization, 'rescale'):
+                    normalization = normalization.rescale(time_unit ** -1)
+                normalization = float(normalization)
+            else:
+                normalization = 1.0
+            cache[key] = self._create_bound_evaluator(
+                time_unit, size, normalization)
+        return cache[key]
+
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        """ Creates the function returned by :meth:`bound_evaluator`.
+
+        This default implementation falls back to calling the kernel with
+        Quantities. Subclasses should override it with a unit-free
+        implementation.
+
+        :param time_unit: Unit of the time points passed to the evaluator.
+        :type time_unit: Quantity scalar
+        :param float size: Kernel size in `time_unit`.
+        :param float normalization: Normalization factor in the inverse of
+            `time_unit` (or 1.0 if the kernel is not normalized).
+        :rtype: func
+        """
+
+        if self.normalize:
+            result_unit = time_unit ** -1
+        else:
+            result_unit = pq.dimensionless
+
+        def evaluate(t):
+            result = self(sp.asarray(t) * time_unit)
+            if hasattr(result, 'rescale'):
+                result = result.rescale(result_unit).magnitude
+            return result
+        return evaluate
+
     def _evaluate(self, t, kernel_size):
         """ Evaluates the kernel.
 
@@ -203,9 +269,69 @@ class CausalDecayingExpKernel(Kernel):
     def __init__(self, kernel_size=1.0 * pq.s, normalize=True):
         Kernel.__init__(self, kernel_size, normalize)
 
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        def evaluate(t):
+            return normalization * (t >= 0) * sp.exp(
+                -sp.maximum(t, 0.0) / size)
+        return evaluate
+
     def boundary_enclosing_at_least(self, fraction):
         return -self.kernel_size * sp.log(1.0 - fraction)
 
+    def summed_dist_matrix(self, vectors, presorted=False):
+        # This implementation uses the same kind of recursion as
+        # LaplacianKernel.summed_dist_matrix. As the kernel is one-sided, only
+        # the elements of the second vector which are smaller or equal to an
+        # element of the first vector contribute. For the j-th element of a
+        # sorted vector b the markage
+        #
+        # m_j = sum_{k <= j} exp(-(b_j - b_k) / tau)
+        #       = 1 + exp(-(b_j - b_{j-1}) / tau) * m_{j-1}
+        #
+        # accumulates the contributions of all preceding elements. Thus, each
+        # element a_i of the first vector needs only to be combined with the
+        # largest b_j <= a_i: sum_{j | b_j <= a_i} K(a_i - b_j) =
+        # exp(-(a_i - b_j) / tau) * m_j.
+        #
+        # Given N vectors with n entries on average the run-time complexity is
+        # O(N^2 * n * log(n)). O(N^2 + N * n) memory will be needed.
+
+        if len(vectors) <= 0:
+            return sp.zeros((0, 0))
+
+        if not presorted:
+            vectors = [v.copy() for v in vectors]
+            for v in vectors:
+                v.sort()
+
+        values = [sp.asarray(
+            (v / self.kernel_size * pq.dimensionless).simplified).flatten()
+            for v in vectors]
+
+        markage = []
+        for v in values:
+            exp_diffs = sp.exp(v[:-1] - v[1:])
+            m = sp.ones(v.size)
+            for i in xrange(v.size - 1):
+                m[i + 1] += exp_diffs[i] * m[i]
+            markage.append(m)
+
+        D = sp.empty((len(vectors), len(vectors)))
+        for v in xrange(D.shape[1]):
+            for u in xrange(D.shape[0]):
+                js = sp.searchsorted(values[v], values[u], 'right') - 1
+                contributing = js >= 0
+                js = js[contributing]
+                D[u, v] = sp.sum(
+                    sp.exp(values[v][js] - values[u][contributing]) *
+                    markage[v][js])
+
+        if self.normalize:
+            normalization = self.normalization_factor(self.kernel_size)
+        else:
+            normalization = 1.0
+        return normalization * D
+
 
 class GaussianKernel(SymmetricKernel):
     r""" Unnormalized: :math:`K(t) = \exp(-\frac{t^2}{2 \sigma^2})` with kernel
@@ -229,6 +355,11 @@ class GaussianKernel(SymmetricKernel):
     def __init__(self, kernel_size=1.0 * pq.s, normalize=True):
         Kernel.__init__(self, kernel_size, normalize)
 
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        def evaluate(t):
+            return normalization * sp.exp(-0.5 * (t / size) ** 2)
+        return evaluate
+
     def boundary_enclosing_at_least(self, fraction):
         return self.kernel_size * sp.sqrt(2.0) * \
             scipy.special.erfinv(fraction + scipy.special.erf(0.0))
@@ -255,6 +386,11 @@ class LaplacianKernel(SymmetricKernel):
     def __init__(self, kernel_size=1.0 * pq.s, normalize=True):
         Kernel.__init__(self, kernel_size, normalize)
 
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        def evaluate(t):
+            return normalization * sp.exp(-sp.absolute(t) / size)
+        return evaluate
+
     def boundary_enclosing_at_least(self, fraction):
         return -self.kernel_size * sp.log(1.0 - fraction)
 
@@ -345,6 +481,11 @@ class RectangularKernel(SymmetricKernel):
     def __init__(self, half_width=1.0 * pq.s, normalize=True):
         Kernel.__init__(self, half_width, normalize)
 
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        def evaluate(t):
+            return normalization * (sp.absolute(t) < size)
+        return evaluate
+
     def boundary_enclosing_at_least(self, fraction):
         return self.kernel_size
 
@@ -373,10 +514,222 @@ class TriangularKernel(SymmetricKernel):
     def __init__(self, half_width=1.0 * pq.s, normalize=True):
         Kernel.__init__(self, half_width, normalize)
 
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        def evaluate(t):
+            return normalization * sp.maximum(0.0, 1.0 - sp.absolute(t) / size)
+        return evaluate
+
     def boundary_enclosing_at_least(self, fraction):
         return self.kernel_size
 
 
+class SumOfExponentialsKernel(Kernel):
+    r""" Unnormalized: :math:`K(t) = \sum_{c=1}^C w_c \exp(-\frac{|t|}{r_c
+    \tau})` with weights :math:`w_c`, relative sizes :math:`r_c` and kernel
+    size :math:`\tau`. If the kernel is causal, it is :math:`K(t) = \sum_{c=1}^C
+    w_c \exp(-\frac{t}{r_c \tau}) \Theta(t)` with :math:`\Theta(t)` being
+    the Heaviside step function (see :class:`CausalDecayingExpKernel`).
+
+    Normalized to unit area: :math:`K'(t) = \frac{1}{2 \tau \sum_c w_c r_c}
+    K(t)` and :math:`K'(t) = \frac{1}{\tau \sum_c w_c r_c} K(t)` for the
+    causal kernel.
+
+    The summed distances of this kernel can be calculated with a run-time
+    complexity of :math:`O(C N^2 n \log n)` for :math:`N` vectors with
+    :math:`n` entries on average. Use :meth:`fit` to approximate other
+    kernels with this kernel.
+    """
+
+    def __init__(
+            self, weights, relative_sizes, kernel_size=1.0 * pq.s,
+            causal=False, normalize=True):
+        """
+        :param sequence weights: Weights :math:`w_c` of the exponentials.
+        :param sequence relative_sizes: Sizes :math:`r_c` of the exponentials
+            relative to the kernel size.
+        :param kernel_size: Parameter controlling the kernel size.
+        :type kernel_size: Quantity scalar
+        :param bool causal: Whether to use causal exponentials instead of
+            symmetric ones.
+        :param bool normalize: Whether to normalize the kernel to unit area.
+        """
+        Kernel.__init__(self, kernel_size, normalize)
+        self.weights = sp.asarray(weights, dtype=float)
+        self.relative_sizes = sp.asarray(relative_sizes, dtype=float)
+        if self.weights.size < 1 or \
+                self.weights.shape != self.relative_sizes.shape:
+            raise ValueError(
+                'Weights and relative sizes need to have the same, non-zero '
+                'length.')
+        self.causal = causal
+
+    @classmethod
+    def fit(
+            cls, kernel, tolerance=1e-3, max_components=12, support=None,
+            causal=None, num_samples=2000):
+        """ Creates a sum of exponentials approximating another kernel.
+
+        The weights are fitted with least squares to the kernel evaluated
+        from `-support` to `support`. The number of exponentials is
+        increased until the maximum absolute error in this range is below
+        `tolerance` times the maximum absolute value of the kernel.
+
+        A sum of exponentials is either causal or symmetric, so only kernels
+        that are zero for negative times or symmetric (both within the
+        tolerance) can be approximated.
+
+        :param kernel: The kernel to approximate, for example
+            a :class:`GaussianKernel` or :class:`KernelFromFunction`.
+        :type kernel: :class:`Kernel`
+        :param float tolerance: Maximum allowed error relative to the
+            maximum of `kernel`.
+        :param int max_components: Maximum number of exponentials to use.
+        :param support: Time scalar up to which the kernel will be
+            approximated. If `None`, the boundary enclosing
+            :const:`default_kernel_area_fraction` of the area of `kernel`
+            will be used. Has to be given for kernels not implementing
+            :meth:`Kernel.boundary_enclosing_at_least`.
+        :type support: Quantity scalar
+        :param bool causal: Whether to fit a causal kernel. If `None`,
+            a causal kernel will be fitted if `kernel` is zero for negative
+            times and a symmetric kernel if `kernel` is symmetric. A
+            ``ValueError`` is raised if it is neither.
+        :param int num_samples: Number of points to evaluate the kernel at.
+        :returns: The fitted kernel with the same kernel size and
+            normalization setting as `kernel`.
+        :rtype: :class:`SumOfExponentialsKernel`
+        """
+
+        if support is None:
+            support = kernel.boundary_enclosing_at_least(
+                default_kernel_area_fraction)
+
+        x_max = float(
+            ((support / kernel.kernel_size) * pq.dimensionless).simplified)
+        # Odd number of points so that the samples are symmetric around 0
+        x = sp.linspace(-x_max, x_max, num_samples // 2 * 2 + 1)
+        y = kernel(x * kernel.kernel_size)
+        y = sp.asarray(getattr(y, 'magnitude', y), dtype=float)
+        max_error = tolerance * sp.amax(sp.absolute(y))
+        if max_error <= 0.0:
+            raise ValueError('Cannot fit a kernel which is zero.')
+
+        if causal is None:
+            if sp.amax(sp.absolute(y[x < 0])) <= max_error:
+                causal = True
+            elif sp.amax(sp.absolute(y - y[::-1])) <= max_error:
+                causal = False
+            else:
+                raise ValueError(
+                    'Only causal or symmetric kernels can be approximated '
+                    'by a sum of exponentials.')
+        if causal:
+            distance = sp.maximum(x, 0.0)
+            mask = sp.atleast_2d(x >= 0).T
+        else:
+            distance = sp.absolute(x)
+            mask = 1.0
+
+        best = None
+        for num_components in xrange(1, max_components + 1):
+            for low in (0.01, 0.02, 0.05):
+                for high in (0.1, 0.2, 0.5, 1.0):
+                    relative_sizes = x_max * sp.logspace(
+                        sp.log10(low), sp.log10(high), num_components)
+                    exps = mask * sp.exp(
+                        -sp.atleast_2d(distance).T / relative_sizes)
+                    weights = scipy.linalg.lstsq(exps, y)[0]
+                    error = sp.amax(sp.absolute(sp.dot(exps, weights) - y))
+                    if best is None or error < best[0]:
+                        best = (error, weights, relative_sizes)
+            if best[0] <= max_error:
+                return cls(
+                    best[1], best[2], kernel.kernel_size, causal,
+                    kernel.normalize)
+
+        raise ValueError(
+            'Could not approximate kernel with %d exponentials to the '
+            'requested tolerance.' % max_components)
+
+    def _evaluate(self, t, kernel_size):
+        if self.causal:
+            evaluate = CausalDecayingExpKernel.evaluate
+        else:
+            evaluate = LaplacianKernel.evaluate
+        return sum(w * evaluate(t, r * kernel_size)
+                   for w, r in zip(self.weights, self.relative_sizes))
+
+    def _create_bound_evaluator(self, time_unit, size, normalization):
+        sizes = size * self.relative_sizes
+        weights = normalization * self.weights
+
+        if self.causal:
+            def evaluate(t):
+                t = sp.asarray(t)
+                exps = sp.exp(-sp.maximum(t, 0.0)[..., sp.newaxis] / sizes)
+                return (t >= 0) * sp.dot(exps, weights)
+        else:
+            def evaluate(t):
+                exps = sp.exp(
+                    -sp.absolute(sp.asarray(t))[..., sp.newaxis] / sizes)
+                return sp.dot(exps, weights)
+        return evaluate
+
+    def _area_factor(self):
+        area = sp.sum(self.weights * self.relative_sizes)
+        if self.causal:
+            return area
+        return 2.0 * area
+
+    def normalization_factor(self, kernel_size):
+        return 1.0 / (self._area_factor() * kernel_size)
+
+    def is_symmetric(self):
+        return not self.causal
+
+    def boundary_enclosing_at_least(self, fraction):
+        area = sp.sum(self.weights * self.relative_sizes)
+
+        def enclosed(x):
+            return sp.sum(self.weights * self.relative_sizes * (
+                1.0 - sp.exp(-x / self.relative_sizes))) / area - fraction
+
+        upper = sp.amax(-self.relative_sizes * sp.log(1.0 - fraction))
+        for i in xrange(64):
+            if enclosed(upper) >= 0.0:
+                break
+            upper *= 2.0
+        return scipy.optimize.brentq(enclosed, 0.0, upper) * self.kernel_size
+
+    def summed_dist_matrix(self, vectors, presorted=False):
+        # Each exponential is handled by the recursive calculation of
+        # LaplacianKernel or CausalDecayingExpKernel.
+
+        if len(vectors) <= 0:
+            return sp.zeros((0, 0))
+
+        if not presorted:
+            vectors = [v.copy() for v in vectors]
+            for v in vectors:
+                v.sort()
+
+        if self.causal:
+            component_class = CausalDecayingExpKernel
+        else:
+            component_class = LaplacianKernel
+
+        D = sp.zeros((len(vectors), len(vectors)))
+        for w, r in zip(self.weights, self.relative_sizes):
+            component = component_class(r * self.kernel_size, normalize=False)
+            D += w * component.summed_dist_matrix(vectors, presorted=True)
+
+        if self.normalize:
+            normalization = self.normalization_factor(self.kernel_size)
+        else:
+            normalization = 1.0
+        return normalization * D
+
+
 def discretize_kernel(
         kernel, sampling_rate, area_fraction=default_kernel_area_fraction,
         num_bins=None, ensure_unit_area=False):
@@ -394,7 +747,10 @@ def discretize_kernel(
     :param sampling_rate: Sampling rate for the discretization. The unit will
         typically be a frequency unit.
     :type sampling_rate: Quantity scalar
-    :param int num_bins: Number of bins to use for the discretization.
+    :param int num_bins: Number of bins to use for the discretization. The
+        bin at time zero will be the center bin (the left one of the two
+        center bins for an even number of bins) as expected by a convolution
+        in ``'same'`` mode.
     :param bool ensure_unit_area: If `True`, the area of the discretized
         kernel will be normalized to 1.0.
     :rtype: Quantity 1D
@@ -403,8 +759,8 @@ def discretize_kernel(
     t_step = 1.0 / sampling_rate
 
     if num_bins is not None:
-        start = -num_bins // 2
-        stop = num_bins // 2
+        start = -((num_bins - 1) // 2)
+        stop = start + num_bins
     elif area_fraction is not None:
         boundary = kernel.boundary_enclosing_at_least(area_fraction)
         if hasattr(boundary, 'rescale'):
@@ -427,8 +783,9 @@ def smooth(
     """ Smoothes a binned representation (e.g. of a spike train) by convolving
     with a kernel.
 
-    :param binned: Bin array to smooth.
-    :type binned: 1-D array
+    :param binned: Bin array to smooth. If a 2-D array is passed, each row
+        will be smoothed.
+    :type binned: 1-D or 2-D array
     :param kernel: The kernel instance to convolve with.
     :type kernel: :class:`Kernel`
     :param sampling_rate: The sampling rate which will be used to discretize the
@@ -449,10 +806,13 @@ def smooth(
     :param dict kernel_discretization_params: Additional discretization
         arguments which will be passed to :func:`.discretize_kernel`.
     :returns: The smoothed representation of `binned`.
-    :rtype: Quantity 1D
+    :rtype: Quantity 1D or Quantity 2D
     """
     k = discretize_kernel(
         kernel, sampling_rate=sampling_rate, **kernel_discretization_params)
+    if sp.ndim(binned) == 2:
+        return scipy.signal.convolve(
+            binned, sp.atleast_2d(k.magnitude), mode) * k.units
     return scipy.signal.convolve(binned, k, mode) * k.units
 
 
@@ -511,3 +871,106 @@ def st_convolve(
         bins = [] * pq.s
 
     return result, bins
+
+
+def st_convolve_chunks(
+        train, kernel, sampling_rate, chunk_size, mode='same',
+        binning_params=None, kernel_discretization_params=None):
+    """ Convolves a :class:`neo.core.SpikeTrain` with a kernel and yields the
+    result in consecutive chunks of fixed duration.
+
+    In contrast to :func:`st_convolve` neither the complete binned spike
+    train nor the complete convolution result will be held in memory. Each
+    chunk is computed from the bins it depends on, including the overlap
+    with the discretized kernel (overlap-save method). Concatenating all
+    yielded chunks gives the same result as :func:`st_convolve` with the same
+    arguments.
+
+    :param train: Spike train to convolve.
+    :type train: :class:`neo.core.SpikeTrain`
+    :param kernel: The kernel instance to convolve with.
+    :type kernel: :class:`Kernel`
+    :param sampling_rate: The sampling rate which will be used to bin
+        the spike train. The unit will typically be a frequency unit.
+    :type sampling_rate: Quantity scalar
+    :param chunk_size: Duration covered by each yielded chunk as time scalar.
+        It will be rounded down to a multiple of the bin size, but at least
+        one bin will be used. The last chunk may be shorter.
+    :type chunk_size: Quantity scalar
+    :param mode: See :func:`st_convolve`.
+    :type mode: {'same', 'full', 'valid'}
+    :param dict binning_params: Additional discretization arguments. Only
+        ``t_start`` and ``t_stop`` are supported (see
+        :func:`.tools.bin_spike_trains`).
+    :param dict kernel_discretization_params: Additional discretization
+        arguments which will be passed to :func:`.discretize_kernel`.
+    :returns: A generator yielding tuples of a chunk of the convolved spike
+        train and the boundaries of the discretization bins of this chunk.
+    :rtype: generator of (Quantity 1D, Quantity 1D with the inverse units of
+        `sampling_rate`)
+    """
+    if binning_params is None:
+        binning_params = {}
+    if kernel_discretization_params is None:
+        kernel_discretization_params = {}
+
+    t_start = binning_params.get('t_start', train.t_start)
+    t_stop = binning_params.get('t_stop', train.t_stop)
+    t_start = t_start.rescale(t_stop.units)
+    duration = t_stop - t_start
+    num_bins = (sampling_rate * duration).simplified
+    # Same bin count as the sp.arange call in tools.bin_spike_trains
+    num_bins_int = int(sp.ceil(float(num_bins) + 1)) - 1
+    bin_width = float(duration / num_bins)
+    first_edge = float(t_start)
+
+    k = discretize_kernel(
+        kernel, sampling_rate=sampling_rate, **kernel_discretization_params)
+    k_units = getattr(k, 'units', pq.dimensionless)
+    k = sp.asarray(k)
+
+    if mode == 'full':
+        offset = 0
+        size = num_bins_int + k.size - 1
+    elif mode == 'same':
+        offset = (k.size - 1) // 2
+        size = num_bins_int
+    elif mode == 'valid':
+        offset = k.size - 1
+        size = num_bins_int - k.size + 1
+    else:
+        raise ValueError("Unknown convolution mode '%s'." % mode)
+    if num_bins_int <= 0 or size <= 0:
+        return
+
+    padding = (size - num_bins_int) // 2 / float(
+        sampling_rate.rescale(1.0 / t_stop.units))
+    out_first_edge = first_edge - padding
+    out_step = (num_bins_int * bin_width + 2 * padding) / size
+
+    times = sp.sort(train.rescale(t_stop.units).magnitude)
+    bins_per_chunk = max(
+        1, int((chunk_size * sampling_rate).simplified))
+
+    for chunk_start in xrange(0, size, bins_per_chunk):
+        chunk_stop = min(size, chunk_start + bins_per_chunk)
+
+        # Indices into the complete, full-mode convolution and the bins
+        # contributing to them.
+        full_start = chunk_start + offset
+        full_stop = chunk_stop + offset
+        a = max(0, full_start - k.size + 1)
+        b = min(num_bins_int, full_stop)
+
+        edges = sp.arange(a, b + 1) * bin_width + first_edge
+        # Only the last bin of the complete binning is closed on the right.
+        side = 'right' if b == num_bins_int else 'left'
+        lo = sp.searchsorted(times, edges[0], 'left')
+        hi = sp.searchsorted(times, edges[-1], side)
+        binned = sp.histogram(times[lo:hi], edges)[0]
+
+        convolved = scipy.signal.convolve(binned, k, 'full')
+        chunk = convolved[full_start - a:full_stop - a]
+        bins = (sp.arange(chunk_start, chunk_stop + 1) * out_step +
+                out_first_edge) * t_stop.units
+        yield chunk * k_units, bins
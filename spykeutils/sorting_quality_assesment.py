@@ -11,7 +11,8 @@ import neo
 
 from progress_indicator import ProgressIndicator
 from . import SpykeException
-from conversions import spikes_to_spike_train
+from conversions import (spikes_to_spike_train, spike_waveforms,
+                         SpikeSequence)
 
 
 def get_refperiod_violations(spike_trains, refperiod, progress=None):
@@ -287,13 +288,19 @@ def overlap_fp_fn(spikes, means=None, covariances=None):
         if not spks or (len(spks) < 2 and u not in covariances):
             units.remove(u)
             continue
-        for s in spks:
-            if isinstance(s, neo.Spike):
-                spikelist.append(
-                    sp.asarray(s.waveform.rescale(pq.uV)).T.flatten())
-            else:
-                spikelist.append(s)
-        spike_arrays[u] = sp.array(spikelist).T
+        if (isinstance(spks, SpikeSequence) or
+                all(isinstance(s, neo.Spike) for s in spks)):
+            waves = sp.asarray(spike_waveforms(spks, pq.uV))
+            spike_arrays[u] = waves.transpose(0, 2, 1).reshape(
+                len(spks), -1).T
+        else:
+            for s in spks:
+                if isinstance(s, neo.Spike):
+                    spikelist.append(
+                        sp.asarray(s.waveform.rescale(pq.uV)).T.flatten())
+                else:
+                    spikelist.append(s)
+            spike_arrays[u] = sp.array(spikelist).T
         if dimensionality is None:
             dimensionality = spike_arrays[u].shape[0]
         elif dimensionality != spike_arrays[u].shape[0]:
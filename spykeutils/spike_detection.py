@@ -0,0 +1,315 @@
+import neo
+import quantities as pq
+import scipy as sp
+
+from progress_indicator import ProgressIndicator
+
+
+class ThresholdDetector(object):
+    """ Detects spikes as threshold crossings in a stream of signal chunks.
+
+    The data is passed to :meth:`process` in consecutive chunks of samples
+    (samples x channels). The detector keeps the state that is needed to
+    find crossings and peaks across chunk boundaries, so the result does not
+    depend on the chunk size. After the last chunk, :meth:`finish` returns
+    the detected spikes.
+
+    The threshold for each channel is a multiple of its noise level. If the
+    noise levels are not given, they are estimated from the first
+    ``noise_duration`` of the data (the data is buffered until this
+    duration is available) using the median absolute value of the signal
+    (Quiroga et al. 2004.
+    Unsupervised spike detection and sorting with wavelets and
+    superparamagnetic clustering. *Neural Computation*, 16(8), 1661-1687.),
+    which assumes that the signal is high-pass filtered.
+
+    After a crossing, the spike time is set to the peak of the signal within
+    ``peak_window``. Crossings within ``dead_time`` of the first crossing of
+    a spike are considered part of the same spike. With
+    ``merge_channels``, this applies to crossings on all channels and the
+    spike is assigned to the channel with the largest peak (relative to the
+    threshold). Otherwise, each channel is treated separately.
+
+    :type sampling_rate: Quantity scalar
+    :param sampling_rate: The sampling rate of the data.
+    :param float threshold: The threshold as multiple of the noise level.
+    :param str direction: The direction of the threshold crossings:
+        ``'negative'``, ``'positive'`` or ``'both'``.
+    :type dead_time: Quantity scalar
+    :param dead_time: The minimum time between two spikes.
+    :type peak_window: Quantity scalar
+    :param peak_window: The time after a crossing in which the peak is
+        searched.
+    :param bool merge_channels: Determines if crossings on different
+        channels are merged.
+    :param noise: The noise level of each channel (in units of the data).
+        If ``None``, the noise levels are estimated from the data.
+    :type noise: sequence
+    :type t_start: Quantity scalar
+    :param t_start: The time of the first sample.
+    :type noise_duration: Quantity scalar
+    :param noise_duration: The length of the data at the start used to
+        estimate the noise levels if ``noise`` is ``None``. If there is
+        less data, all of it is used.
+    """
+
+    def __init__(self, sampling_rate, threshold=5.0, direction='negative',
+                 dead_time=1 * pq.ms, peak_window=0.5 * pq.ms,
+                 merge_channels=True, noise=None, t_start=0 * pq.s,
+                 noise_duration=1 * pq.s):
+        if direction not in ('negative', 'positive', 'both'):
+            raise ValueError('Unknown direction: %s' % direction)
+
+        self.sampling_rate = sampling_rate
+        self.threshold = threshold
+        self.direction = direction
+        self.merge_channels = merge_channels
+        self.noise = None
+        if noise is not None:
+            self.noise = sp.asarray(noise, dtype=float).ravel()
+        self.t_start = t_start
+
+        self._noise_samples = max(
+            1, int(round((noise_duration * sampling_rate).simplified)))
+        self._pending = []  # Data buffered for noise estimation
+        self._num_pending = 0
+        self._dead_samples = int(round((dead_time * sampling_rate).simplified))
+        self._peak_samples = max(
+            1, int(round((peak_window * sampling_rate).simplified)))
+        self._buffer = None
+        self._buffer_start = 0  # Sample index of first buffered sample
+        self._next = 1  # First sample index that might be a crossing
+        self._num_samples = 0
+        self._groups = {}
+        self._peaks = []
+        self._channels = []
+
+    def process(self, data):
+        """ Detect spikes in the next chunk of data.
+
+        :param data: The next samples (samples x channels). One-dimensional
+            data is treated as a single channel.
+        :type data: array-like
+        """
+        data = sp.asarray(data, dtype=float)
+        if data.ndim == 1:
+            data = data[:, sp.newaxis]
+        if self.noise is None:
+            self._pending.append(data)
+            self._num_pending += data.shape[0]
+            if self._num_pending < self._noise_samples:
+                return
+            self._process_pending()
+            return
+        if self.noise.size != data.shape[1]:
+            raise ValueError('Number of channels does not match noise levels')
+
+        scaled = self._scale(data)
+        if self._buffer is not None:
+            scaled = sp.vstack((self._buffer, scaled))
+        self._num_samples += data.shape[0]
+        self._detect(scaled, self._num_samples - self._peak_samples)
+
+    def finish(self):
+        """ Detect spikes in the remaining data and return all spikes.
+
+        :returns: A spike train with the detected spikes. The annotation
+            ``channels`` contains the channel index of each spike.
+        :rtype: :class:`neo.core.SpikeTrain`
+        """
+        if self._pending:
+            self._process_pending()
+        if self._buffer is not None:
+            self._detect(self._buffer, self._num_samples)
+        for g in self._groups.values():
+            self._emit(g)
+        self._groups = {}
+
+        peaks = sp.array(self._peaks, dtype=float)
+        channels = sp.array(self._channels, dtype=int)
+        order = sp.argsort(peaks, kind='mergesort')
+        peaks = peaks[order]
+        channels = channels[order]
+
+        rate = self.sampling_rate
+        units = self.t_start.units
+        times = self.t_start + (peaks / rate).rescale(units)
+        t_stop = self.t_start + (self._num_samples / rate).rescale(units)
+        return neo.SpikeTrain(
+            times, t_start=self.t_start, t_stop=t_stop, sampling_rate=rate,
+            channels=channels)
+
+    def _process_pending(self):
+        """ Estimate the noise levels from the buffered data and detect
+        spikes in it.
+        """
+        data = sp.vstack(self._pending)
+        self._pending = []
+        self.noise = sp.median(
+            sp.absolute(data[:self._noise_samples]), axis=0) / 0.6745
+        self.process(data)
+
+    def _scale(self, data):
+        """ Return data relative to the noise level, oriented so that
+        spikes have large positive values.
+        """
+        noise = self.noise.copy()
+        noise[noise == 0] = sp.inf
+        scaled = data / noise
+        if self.direction == 'negative':
+            return -scaled
+        if self.direction == 'both':
+            return sp.absolute(scaled)
+        return scaled
+
+    def _detect(self, scaled, stop):
+        """ Find crossings in the buffered scaled data that start before
+        sample index ``stop`` and keep the rest in the buffer.
+        """
+        above = scaled > self.threshold
+        crossing = above[1:] & ~above[:-1]
+        samples, channels = sp.nonzero(crossing)
+        samples += self._buffer_start + 1
+        ok = (samples >= self._next) & (samples < stop)
+        samples = samples[ok]
+        channels = channels[ok]
+
+        if samples.size:
+            # Peak within peak window, limited to the available data
+            window = samples[:, sp.newaxis] + sp.arange(self._peak_samples)
+            window = sp.minimum(window, self._num_samples - 1)
+            values = scaled[window - self._buffer_start,
+                            channels[:, sp.newaxis]]
+            peaks = window[sp.arange(samples.size), values.argmax(axis=1)]
+            amplitudes = values.max(axis=1)
+
+            order = sp.argsort(peaks, kind='mergesort')
+            self._merge(peaks[order], channels[order], amplitudes[order])
+
+        # Keep the sample before the first unprocessed sample
+        self._next = max(self._next, stop)
+        keep = max(self._next - 1, self._buffer_start)
+        self._buffer = scaled[keep - self._buffer_start:]
+        self._buffer_start = keep
+
+    def _merge(self, peaks, channels, amplitudes):
+        """ Combine crossings within the dead time into spikes.
+        """
+        for p, c, a in zip(peaks, channels, amplitudes):
+            key = 0 if self.merge_channels else c
+            group = self._groups.get(key)
+            if group is not None and p - group[0] <= self._dead_samples:
+                if a > group[2]:
+                    group[1:] = [p, a, c]
+                continue
+            if group is not None:
+                self._emit(group)
+            self._groups[key] = [p, p, a, c]
+
+    def _emit(self, group):
+        self._peaks.append(group[1])
+        self._channels.append(group[3])
+
+
+def detect_spikes(signals, threshold=5.0, direction='negative',
+                  dead_time=1 * pq.ms, peak_window=0.5 * pq.ms,
+                  merge_channels=True, noise=None, chunk_size=2 ** 16,
+                  sampling_rate=None, t_start=None, noise_duration=1 * pq.s,
+                  progress=None):
+    """ Detect spikes as threshold crossings in analog signals.
+
+    The signals are processed in chunks by a :class:`ThresholdDetector`,
+    so they can be memory-mapped or otherwise larger than the available
+    memory. See :class:`ThresholdDetector` for details on the detection.
+    The returned spike train can be used with
+    :func:`spykeutils.tools.extract_spikes` to extract the spike waveforms.
+
+    :param signals: The signals, one of:
+
+        * A sequence of :class:`neo.core.AnalogSignal` objects with the
+          same sampling rate.
+        * A :class:`neo.core.AnalogSignalArray`.
+        * An array (samples x channels), e.g. a :class:`numpy.memmap`.
+          ``sampling_rate`` has to be given in this case.
+    :param float threshold: The threshold as multiple of the noise level.
+    :param str direction: The direction of the threshold crossings:
+        ``'negative'``, ``'positive'`` or ``'both'``.
+    :type dead_time: Quantity scalar
+    :param dead_time: The minimum time between two spikes.
+    :type peak_window: Quantity scalar
+    :param peak_window: The time after a crossing in which the peak is
+        searched.
+    :param bool merge_channels: Determines if crossings on different
+        channels are merged.
+    :param noise: The noise level of each channel. If ``None``, the noise
+        levels are estimated from the first ``noise_duration`` of the
+        signals.
+    :type noise: Quantity 1D or sequence
+    :param int chunk_size: The number of samples processed at once.
+    :type sampling_rate: Quantity scalar
+    :param sampling_rate: The sampling rate. Only used (and required) if
+        ``signals`` is an array.
+    :type t_start: Quantity scalar
+    :param t_start: The time of the first sample. If ``None``, the start
+        time of the signals or 0 seconds for arrays is used.
+    :type noise_duration: Quantity scalar
+    :param noise_duration: The length of the data used to estimate the
+        noise levels if ``noise`` is ``None``.
+    :param progress: A ProgressIndicator object for the operation.
+    :type progress: :class:`.progress_indicator.ProgressIndicator`
+    :returns: A spike train with the detected spikes. The annotation
+        ``channels`` contains the channel index of each spike.
+    :rtype: :class:`neo.core.SpikeTrain`
+    """
+    if not progress:
+        progress = ProgressIndicator()
+
+    if isinstance(signals, (list, tuple)):
+        if not signals:
+            raise ValueError('No signals to detect spikes in')
+        for s in signals[1:]:
+            if s.sampling_rate != signals[0].sampling_rate:
+                raise ValueError(
+                    'All signals for spike detection need the same '
+                    'sampling rate')
+        unit = signals[0].units
+        sampling_rate = signals[0].sampling_rate
+        if t_start is None:
+            t_start = signals[0].t_start
+        factors = [float((1 * s.units).rescale(unit)) for s in signals]
+        data = [sp.asarray(s) for s in signals]
+        num_samples = min(d.shape[0] for d in data)
+
+        def chunk(i, j):
+            return sp.column_stack(
+                [d[i:j] * f for d, f in zip(data, factors)])
+    else:
+        if isinstance(signals, neo.AnalogSignalArray):
+            unit = signals.units
+            sampling_rate = signals.sampling_rate
+            if t_start is None:
+                t_start = signals.t_start
+        elif sampling_rate is None:
+            raise ValueError(
+                'Sampling rate is needed for spike detection in arrays')
+        else:
+            unit = None
+        if t_start is None:
+            t_start = 0 * pq.s
+        data = signals
+        num_samples = data.shape[0]
+
+        def chunk(i, j):
+            return sp.asarray(data[i:j])
+
+    if noise is not None and isinstance(noise, pq.Quantity) and unit:
+        noise = noise.rescale(unit).magnitude
+
+    detector = ThresholdDetector(
+        sampling_rate, threshold, direction, dead_time, peak_window,
+        merge_channels, noise, t_start, noise_duration)
+    progress.set_ticks((num_samples + chunk_size - 1) // chunk_size)
+    for i in xrange(0, num_samples, chunk_size):
+        detector.process(chunk(i, min(i + chunk_size, num_samples)))
+        progress.step()
+    return detector.finish()
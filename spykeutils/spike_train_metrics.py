@@ -145,24 +145,30 @@ def event_synchronization(
     trains = [st.view(type=pq.Quantity) for st in trains]
     if sort:
         trains = [sp.sort(st) for st in trains]
+    if len(trains) > 0:
+        units = trains[0].units
+        trains = [st.rescale(units).magnitude for st in trains]
+        if hasattr(tau, 'rescale'):
+            tau = tau.rescale(units).magnitude
 
     if tau is None:
         inf_array = sp.array([sp.inf])
-        isis = [spq.concatenate(
-                (inf_array * st.units, sp.diff(st), inf_array * st.units))
+        isis = [sp.concatenate((inf_array, sp.diff(st), inf_array))
                 for st in trains]
-        auto_taus = [spq.minimum(t[:-1], t[1:]) for t in isis]
+        auto_taus = [sp.minimum(t[:-1], t[1:]) for t in isis]
+
+    evaluate = kernel.bound_evaluator(pq.dimensionless)
 
     def compute(i, j):
         if i == j:
             return 1.0
         else:
             if tau is None:
-                tau_mat = spq.minimum(*spq.meshgrid(
+                tau_mat = sp.minimum(*sp.meshgrid(
                     auto_taus[i], auto_taus[j])) / 2.0
             else:
-                tau_mat = sp.tile(tau, (trains[j].size, trains[i].size))
-            coincidence = sp.sum(kernel(
+                tau_mat = tau
+            coincidence = sp.sum(evaluate(
                 (trains[i] - sp.atleast_2d(trains[j]).T) / tau_mat))
             normalization = 1.0 / sp.sqrt(trains[i].size * trains[j].size)
             return normalization * coincidence
@@ -209,6 +215,11 @@ def hunter_milton_similarity(trains, tau=1.0 * pq.s, kernel=None):
     if kernel is None:
         kernel = sigproc.LaplacianKernel(tau, normalize=False)
 
+    if len(trains) > 0:
+        units = trains[0].units
+        trains = [st.rescale(units).magnitude for st in trains]
+        evaluate = kernel.bound_evaluator(units)
+
     def compute(i, j):
         if i == j:
             return 1.0
@@ -217,8 +228,10 @@ def hunter_milton_similarity(trains, tau=1.0 * pq.s, kernel=None):
         else:
             diff_matrix = sp.absolute(trains[i] - sp.atleast_2d(trains[j]).T)
             return 0.5 * (
-                sp.sum(kernel(sp.amin(diff_matrix, axis=0))) / trains[i].size +
-                sp.sum(kernel(sp.amin(diff_matrix, axis=1))) / trains[j].size)
+                sp.sum(evaluate(sp.amin(diff_matrix, axis=0))) /
+                trains[i].size +
+                sp.sum(evaluate(sp.amin(diff_matrix, axis=1))) /
+                trains[j].size)
 
     return _create_matrix_from_indexed_function(
         (len(trains), len(trains)), compute, kernel.is_symmetric())
@@ -656,8 +669,11 @@ def _victor_purpura_dist_for_trial_pair(a, b, kernel):
     min_dim, max_dim = b.size, a.size + 1
     cost = sp.asfortranarray(sp.tile(sp.arange(float(max_dim)), (2, 1)))
     decreasing_sequence = sp.asfortranarray(cost[:, ::-1])
-    k = 1 - 2 * sp.asfortranarray(kernel(
-        (sp.atleast_2d(a).T - b).view(type=pq.Quantity)).simplified)
+    # Kernel values in 1/s independent of the units of the spike trains
+    evaluate = kernel.bound_evaluator(pq.s)
+    k = 1 - 2 * sp.asfortranarray(evaluate(
+        sp.atleast_2d(a.rescale(pq.s).magnitude).T -
+        b.rescale(pq.s).magnitude))
 
     for i in xrange(min_dim):
         # determine G[i, i] == accumulated_min[:, 0]
@@ -779,8 +795,11 @@ def _victor_purpura_multiunit_dist_for_trial_pair(
     reassignment_costs = sp.empty((a_merged[0].size,) + b_train_mat.shape)
     reassignment_costs.fill(reassignment_cost)
     reassignment_costs[sp.arange(a_merged[1].size), a_merged[1], :] = 0.0
-    k = 1 - 2 * kernel(sp.atleast_2d(
-        a_merged[0]).T - b_train_mat.flatten()).simplified.reshape(
+    # Kernel values in 1/s independent of the units of the spike trains
+    evaluate = kernel.bound_evaluator(pq.s)
+    k = 1 - 2 * evaluate(
+        sp.atleast_2d(a_merged[0].rescale(pq.s).magnitude).T -
+        b_train_mat.rescale(pq.s).magnitude.flatten()).reshape(
             (a_merged[0].size,) + b_train_mat.shape) + reassignment_costs
 
     decreasing_sequence = flat_b_indices[::-1]
@@ -797,12 +816,7 @@ def _victor_purpura_multiunit_dist_for_trial_pair(
             b_indices[min_base_cost_labels, flat_b_indices] - 1]
 
         cost_delete_in_a = cost.flat[flat_b_indices]
-
-        # cost_shift is dimensionless, but there is a bug in quantities with
-        # the minimum function:
-        # <https://github.com/python-quantities/python-quantities/issues/52>
-        # The explicit request for the magnitude circumvents this problem.
-        cost.flat = sp.minimum(cost_delete_in_a, cost_shift.magnitude) + 1
+        cost.flat = sp.minimum(cost_delete_in_a, cost_shift) + 1
         cost.flat[0] = sp.inf
 
         # Minimum with cost for deleting in b
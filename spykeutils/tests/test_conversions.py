@@ -0,0 +1,145 @@
+try:
+    import unittest2 as ut
+    assert ut  # Suppress pyflakes warning about redefinition of unused ut
+except ImportError:
+    import unittest as ut
+
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from spykeutils import SpykeException
+import spykeutils.conversions as conv
+import neo
+import quantities as pq
+import scipy as sp
+
+
+class TestSpikeConversions(ut.TestCase):
+    def setUp(self):
+        self.unit = neo.Unit()
+        self.waves = sp.random.RandomState(7).randn(4, 10, 2)
+        self.train = neo.SpikeTrain(
+            sp.array([0.5, 1.0, 2.0, 3.0]) * pq.s, t_start=0.5 * pq.s,
+            t_stop=3.0 * pq.s, waveforms=self.waves * pq.mV,
+            sampling_rate=10 * pq.kHz, left_sweep=0.2 * pq.ms)
+        self.train.unit = self.unit
+
+    def test_round_trip(self):
+        spikes = conv.spike_train_to_spikes(self.train)
+        self.assertEqual(4, len(spikes))
+        for s in spikes:
+            self.assertIs(self.unit, s.unit)
+        train = conv.spikes_to_spike_train(spikes)
+        assert_array_almost_equal(self.train.magnitude, train.magnitude)
+        assert_array_almost_equal(self.waves, train.waveforms.magnitude)
+        self.assertIs(self.unit, train.unit)
+        self.assertEqual(0.2 * pq.ms, train.left_sweep)
+
+    def test_rescales_times_and_waveforms(self):
+        spikes = conv.spike_train_to_spikes(self.train)
+        spikes[1].time = spikes[1].time.rescale(pq.ms)
+        spikes[2].waveform = spikes[2].waveform.rescale(pq.uV)
+        spikes[3].left_sweep = spikes[3].left_sweep.rescale(pq.s)
+        assert_array_almost_equal(
+            [500.0, 1000.0, 2000.0, 3000.0],
+            conv.spike_times(spikes, pq.ms).magnitude)
+        train = conv.spikes_to_spike_train(spikes)
+        self.assertEqual(pq.s, train.units)
+        assert_array_almost_equal(self.train.magnitude, train.magnitude)
+        self.assertEqual(pq.mV, train.waveforms.units)
+        assert_array_almost_equal(self.waves, train.waveforms.magnitude)
+
+    def test_nonuniform_spikes_raise_exception(self):
+        spikes = conv.spike_train_to_spikes(self.train)
+        spikes[1].unit = neo.Unit()
+        with self.assertRaises(SpykeException):
+            conv.spikes_to_spike_train(spikes)
+        spikes[1].unit = self.unit
+        spikes[2].left_sweep = 0.3 * pq.ms
+        with self.assertRaises(SpykeException):
+            conv.spikes_to_spike_train(spikes)
+        spikes[2].left_sweep = 0.2 * pq.ms
+        spikes[3].waveform = None
+        with self.assertRaises(SpykeException):
+            conv.spikes_to_spike_train(spikes)
+        conv.spikes_to_spike_train(spikes, include_waveforms=False)
+        spikes[3].waveform = spikes[0].waveform[:5]
+        with self.assertRaises(SpykeException):
+            conv.spikes_to_spike_train(spikes)
+
+
+class TestSpikeSequence(ut.TestCase):
+    def setUp(self):
+        self.unit = neo.Unit()
+        self.waves = sp.random.RandomState(8).randn(5, 8, 3)
+        self.train = neo.SpikeTrain(
+            sp.arange(1.0, 6.0) * pq.s, t_stop=6.0 * pq.s,
+            waveforms=self.waves * pq.uV, sampling_rate=10 * pq.kHz)
+        self.train.unit = self.unit
+        self.seq = conv.spike_train_to_spikes(self.train, lazy=True)
+
+    def test_elements_equal_converted_spikes(self):
+        expected = conv.spike_train_to_spikes(self.train)
+        self.assertEqual(5, len(self.seq))
+        for e, s in zip(expected, self.seq):
+            self.assertEqual(e.time, s.time)
+            assert_array_almost_equal(e.waveform, s.waveform)
+            self.assertIs(self.unit, s.unit)
+        self.assertEqual(5.0 * pq.s, self.seq[-1].time)
+        self.assertIs(self.seq[2], self.seq[2])
+
+    def test_slices_and_arrays(self):
+        sliced = self.seq[1::2]
+        self.assertIsInstance(sliced, conv.SpikeSequence)
+        assert_array_almost_equal([2.0, 4.0], sliced.times.magnitude)
+        assert_array_almost_equal(
+            self.waves[1::2], sliced.waveforms.magnitude)
+        self.assertEqual(4.0 * pq.s, sliced[1].time)
+        assert_array_almost_equal(
+            [2000.0, 4000.0], conv.spike_times(sliced, pq.ms).magnitude)
+        assert_array_almost_equal(
+            self.waves[1::2] / 1000.0,
+            conv.spike_waveforms(sliced, pq.mV).magnitude)
+
+    def test_composed_slices(self):
+        times = sp.arange(1.0, 6.0)
+        for first in (slice(None), slice(1, None, 2), slice(None, None, -1),
+                      slice(4, 0, -2), slice(3, 1)):
+            for second in (slice(None), slice(1, None), slice(None, None, -1),
+                           slice(-1, None, -2), slice(5, 7)):
+                sliced = self.seq[first][second]
+                expected = times[first][second]
+                self.assertEqual(len(expected), len(sliced))
+                assert_array_almost_equal(expected, sliced.times.magnitude)
+                assert_array_almost_equal(
+                    expected, [s.time.magnitude for s in sliced])
+                assert_array_equal(expected - 1, sliced.indices)
+        with self.assertRaises(IndexError):
+            self.seq[1::2][2]
+        self.assertEqual(3.0 * pq.s, self.seq[::-2][-2].time)
+
+    def test_arrays_are_views_unless_indexed(self):
+        self.assertIs(self.train.waveforms, self.seq.waveforms)
+        self.assertTrue(sp.may_share_memory(self.train, self.seq.times))
+        sliced = self.seq[::-1][1::2]
+        self.assertTrue(sp.may_share_memory(self.train, sliced.times))
+        self.assertTrue(
+            sp.may_share_memory(self.train.waveforms, sliced.waveforms))
+        indexed = conv.SpikeSequence(self.train, indices=[3, 1])
+        assert_array_almost_equal([4.0, 2.0], indexed.times.magnitude)
+        self.assertFalse(sp.may_share_memory(self.train, indexed.times))
+        assert_array_almost_equal([4.0], indexed[:1].times.magnitude)
+
+    def test_spike_train_from_sequence(self):
+        train = conv.spikes_to_spike_train(self.seq[:3])
+        assert_array_almost_equal([1.0, 2.0, 3.0], train.magnitude)
+        assert_array_almost_equal(self.waves[:3], train.waveforms.magnitude)
+        self.assertIs(self.unit, train.unit)
+        train = conv.spikes_to_spike_train(self.seq, False)
+        self.assertIsNone(train.waveforms)
+        without_waves = conv.spike_train_to_spikes(
+            self.train, include_waveforms=False, lazy=True)
+        self.assertIsNone(without_waves[0].waveform)
+        self.assertIsNone(without_waves.waveforms)
+
+
+if __name__ == '__main__':
+    ut.main()
@@ -0,0 +1,266 @@
+try:
+    import unittest2 as ut
+    assert ut  # Suppress pyflakes warning about redefinition of unused ut
+except ImportError:
+    import unittest as ut
+
+import os
+import tempfile
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+import spykeutils.correlations as corr
+import neo
+import quantities as pq
+import scipy as sp
+
+
+class TestCorrelogram(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(0)
+        self.trains = {}
+        for u in xrange(3):
+            self.trains[u] = [
+                neo.SpikeTrain(
+                    sp.around(rand.rand(100) * 1000.0, 1) * pq.ms,
+                    t_stop=1000.0 * pq.ms)
+                for _ in xrange(2)]
+
+    def dense_correlogram(self, train1, train2, bins):
+        return sp.histogram(sp.subtract.outer(
+            train1.rescale(pq.ms).magnitude,
+            train2.rescale(pq.ms).magnitude), bins.magnitude)[0]
+
+    def test_returns_histogram_of_spike_time_differences(self):
+        c, bins = corr.correlogram(
+            self.trains, 2.5 * pq.ms, 50 * pq.ms, border_correction=False,
+            per_second=False)
+        self.assertEqual(pq.ms, bins.units)
+        for u1 in xrange(3):
+            for u2 in xrange(3):
+                expected = sp.zeros(len(bins) - 1)
+                for t1, t2 in zip(self.trains[u1], self.trains[u2]):
+                    expected += self.dense_correlogram(t1, t2, bins)
+                    if u1 == u2:
+                        expected[len(bins) / 2 - 1] -= len(t1)
+                assert_array_almost_equal(expected / 2, c[u1][u2])
+
+    def test_cross_correlograms_are_mirrored(self):
+        c, _ = corr.correlogram(self.trains, 1 * pq.ms, 20 * pq.ms)
+        assert_array_equal(c[0][1], c[1][0][::-1])
+
+    def test_difference_histogram_in_small_blocks(self):
+        t1 = sp.sort(self.trains[0][0].magnitude)
+        t2 = self.trains[1][0].magnitude
+        bins = sp.arange(-30.5, 31.0, 1.0)
+        expected = sp.histogram(sp.subtract.outer(t1, t2), bins)[0]
+        assert_array_equal(expected, corr._difference_histogram(t1, t2, bins))
+        assert_array_equal(
+            expected, corr._difference_histogram(t1, t2, bins, max_pairs=7))
+
+
+class TestBinnedCorrelogram(ut.TestCase):
+    def setUp(self):
+        # Spikes in the bin centers are not affected by binning
+        rand = sp.random.RandomState(1)
+        self.trains = {}
+        for u in 'abc':
+            self.trains[u] = [
+                neo.SpikeTrain(
+                    (rand.randint(0, 500, 80) + 0.5) * pq.ms,
+                    t_stop=500.0 * pq.ms)
+                for _ in xrange(3)]
+
+    def test_equals_exact_correlogram_for_spikes_in_bin_centers(self):
+        for border_correction in (False, True):
+            expected, expected_bins = corr.correlogram(
+                self.trains, 1 * pq.ms, 40 * pq.ms,
+                border_correction=border_correction)
+            actual, bins = corr.correlogram(
+                self.trains, 1 * pq.ms, 40 * pq.ms,
+                border_correction=border_correction, binned=True)
+            assert_array_equal(expected_bins, bins)
+            for u1 in 'abc':
+                for u2 in 'abc':
+                    assert_array_almost_equal(
+                        expected[u1][u2], actual[u1][u2])
+
+    def test_pair_blocks_give_same_result(self):
+        indices = self.trains.keys()
+        expected = corr._binned_correlograms(
+            self.trains, indices, 3, 2.0, 10, pq.ms,
+            corr.ProgressIndicator())
+        actual = corr._binned_correlograms(
+            self.trains, indices, 3, 2.0, 10, pq.ms,
+            corr.ProgressIndicator(), max_elements=1)
+        self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+        for k in expected:
+            assert_array_almost_equal(expected[k], actual[k])
+
+
+class TestSurrogateCorrelograms(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(2)
+        self.trains = {}
+        for u in xrange(2):
+            self.trains[u] = [
+                neo.SpikeTrain(
+                    sp.sort(rand.rand(60)) * 500.0 * pq.ms,
+                    t_stop=500.0 * pq.ms)
+                for _ in xrange(2)]
+
+    def test_shift_predictor_pairs_different_trials(self):
+        surrogates, _, _, bins = corr.surrogate_correlograms(
+            self.trains, 2 * pq.ms, 20 * pq.ms, num_surrogates=4)
+        shifted = {0: self.trains[0], 1: self.trains[1][::-1],
+                   2: self.trains[0][::-1]}
+        expected, expected_bins = corr.correlogram(
+            shifted, 2 * pq.ms, 20 * pq.ms)
+        assert_array_equal(expected_bins, bins)
+        for u1, u2 in ((0, 1), (1, 0)):
+            self.assertEqual((4, len(bins) - 1), surrogates[u1][u2].shape)
+            for s in surrogates[u1][u2]:
+                assert_array_almost_equal(expected[u1][u2], s)
+        for s in surrogates[0][0]:
+            assert_array_almost_equal(expected[0][2], s)
+
+    def test_small_jitter_keeps_correlograms(self):
+        surrogates, _, _, _ = corr.surrogate_correlograms(
+            self.trains, 2 * pq.ms, 20 * pq.ms, surrogate='jitter',
+            num_surrogates=3, jitter_window=1e-9 * pq.ms)
+        expected, _ = corr.correlogram(self.trains, 2 * pq.ms, 20 * pq.ms)
+        for u1 in xrange(2):
+            for u2 in xrange(2):
+                for s in surrogates[u1][u2]:
+                    assert_array_almost_equal(expected[u1][u2], s)
+
+    def test_significance_bands_enclose_surrogates(self):
+        surrogates, pointwise, global_bands, bins = \
+            corr.surrogate_correlograms(
+                self.trains, 2 * pq.ms, 20 * pq.ms, surrogate='jitter',
+                num_surrogates=100, confidence=0.9)
+        s = surrogates[0][1]
+        inside = (s >= pointwise[0][1][0]) & (s <= pointwise[0][1][1])
+        self.assertGreaterEqual(inside.mean(), 0.9)
+        inside = sp.all((s >= global_bands[0][1][0]) &
+                        (s <= global_bands[0][1][1]), axis=1)
+        self.assertGreaterEqual(inside.mean(), 0.8)
+        assert_array_equal(pointwise[0][1][:, ::-1], pointwise[1][0])
+
+    def test_unknown_surrogate_raises_exception(self):
+        with self.assertRaises(ValueError):
+            corr.surrogate_correlograms(
+                self.trains, 2 * pq.ms, surrogate='unknown')
+
+
+class TestJPSTH(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(3)
+        self.trains = {}
+        for u in 'abc':
+            self.trains[u] = [
+                neo.SpikeTrain(
+                    sp.sort(rand.rand(40)) * pq.s, t_stop=1.0 * pq.s)
+                for _ in xrange(6)]
+
+    def counts(self, u, bins):
+        return sp.array([sp.histogram(t.rescale(bins.units), bins)[0]
+                         for t in self.trains[u]], dtype=float)
+
+    def test_raw_jpsth_is_mean_product_of_counts(self):
+        j, pairs, bins = corr.jpsth(
+            self.trains, 100 * pq.ms, shift_predictor=False)
+        self.assertEqual(3, len(pairs))
+        self.assertEqual((3, 10, 10), j.shape)
+        for i, (u1, u2) in enumerate(pairs):
+            c1 = self.counts(u1, bins)
+            c2 = self.counts(u2, bins)
+            expected = sum(sp.outer(c1[t], c2[t]) for t in xrange(6)) / 6
+            assert_array_almost_equal(expected, j[i])
+
+    def test_subtracts_shift_predictor(self):
+        j, _, bins = corr.jpsth(
+            self.trains, 200 * pq.ms, pairs=[('b', 'a')])
+        c1 = self.counts('b', bins)
+        c2 = self.counts('a', bins)
+        expected = sum(sp.outer(c1[t], c2[t]) for t in xrange(6)) / 6
+        expected -= sum(sp.outer(c1[t], c2[s]) for t in xrange(6)
+                        for s in xrange(6) if s != t) / 30
+        assert_array_almost_equal(expected, j[0])
+
+    def test_normalized_jpsth_equals_count_correlation(self):
+        j, _, bins = corr.jpsth(
+            self.trains, 100 * pq.ms, pairs=[('a', 'c')], normalize=True)
+        c1 = self.counts('a', bins)
+        c2 = self.counts('c', bins)
+        assert_array_almost_equal(
+            sp.corrcoef(c1.T, c2.T)[:10, 10:], j[0])
+
+    def test_stores_jpsths_in_file(self):
+        handle, filename = tempfile.mkstemp(suffix='.npy')
+        os.close(handle)
+        try:
+            expected, _, _ = corr.jpsth(self.trains, 100 * pq.ms)
+            actual, _, _ = corr.jpsth(
+                self.trains, 100 * pq.ms, filename=filename)
+            assert_array_almost_equal(expected, actual)
+            del actual
+            assert_array_almost_equal(expected, sp.load(filename))
+        finally:
+            os.remove(filename)
+
+
+class TestSpikeCountCorrelations(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(4)
+        shared = [rand.rand(30) for _ in xrange(8)]
+        self.trains = {}
+        for u in xrange(3):
+            self.trains[u] = [
+                neo.SpikeTrain(sp.sort(sp.concatenate(
+                    (shared[t][:10 + 5 * u], rand.rand(20)))) * pq.s,
+                    t_stop=1.0 * pq.s)
+                for t in xrange(8)]
+        self.window_sizes = sp.array([50.0, 250.0]) * pq.ms
+
+    def counts(self, indices, window_size):
+        bins = sp.linspace(0.0, 1.0, int(round(1.0 / window_size)) + 1)
+        return sp.array([[sp.histogram(t.rescale(pq.s), bins)[0]
+                          for t in self.trains[u]] for u in indices],
+                        dtype=float)
+
+    def test_total_correlations(self):
+        corrs, covs, indices = corr.spike_count_correlations(
+            self.trains, 10 * pq.ms, self.window_sizes)
+        self.assertEqual((2, 3, 3), corrs.shape)
+        for i, size in enumerate((0.05, 0.25)):
+            counts = self.counts(indices, size).reshape(3, -1)
+            assert_array_almost_equal(sp.corrcoef(counts), corrs[i])
+            assert_array_almost_equal(sp.cov(counts), covs[i])
+
+    def test_noise_correlations(self):
+        corrs, covs, indices = corr.spike_count_correlations(
+            self.trains, 10 * pq.ms, self.window_sizes, mode='noise')
+        for i, size in enumerate((0.05, 0.25)):
+            counts = self.counts(indices, size)
+            residuals = (counts - counts.mean(axis=1)[:, sp.newaxis, :])
+            residuals = residuals.reshape(3, -1)
+            assert_array_almost_equal(sp.corrcoef(residuals), corrs[i])
+            assert_array_almost_equal(
+                sp.dot(residuals, residuals.T) /
+                (7 * int(round(1.0 / size))), covs[i])
+
+    def test_signal_correlations(self):
+        corrs, covs, indices = corr.spike_count_correlations(
+            self.trains, 10 * pq.ms, self.window_sizes, mode='signal')
+        for i, size in enumerate((0.05, 0.25)):
+            means = self.counts(indices, size).mean(axis=1)
+            assert_array_almost_equal(sp.corrcoef(means), corrs[i])
+            assert_array_almost_equal(sp.cov(means), covs[i])
+
+    def test_unknown_mode_raises_exception(self):
+        with self.assertRaises(ValueError):
+            corr.spike_count_correlations(
+                self.trains, 10 * pq.ms, mode='unknown')
+
+
+if __name__ == '__main__':
+    ut.main()
@@ -7,6 +7,8 @@ except ImportError:
 from builders import arange_spikes
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 import spykeutils.rate_estimation as re
+import spykeutils.signal_processing as sigproc
+import spykeutils.tools as tools
 import neo
 import quantities as pq
 import scipy as sp
@@ -35,5 +37,409 @@ class TestScipyMaximum(ut.TestCase):
                       'an exception')
 
 
+class TestPSTH(ut.TestCase):
+    def setUp(self):
+        self.trains = {
+            0: [neo.SpikeTrain(sp.array([0.1, 0.5, 0.55, 1.0]) * pq.s,
+                               t_stop=1.0 * pq.s),
+                neo.SpikeTrain(sp.array([200.0, 500.0]) * pq.ms,
+                               t_stop=1000.0 * pq.ms)],
+            1: [arange_spikes(1.0 * pq.s, t_step=0.1 * pq.s),
+                arange_spikes(1.0 * pq.s, t_step=0.3 * pq.s)]}
+
+    def test_returns_rates(self):
+        rates, bins = re.psth(self.trains, 250 * pq.ms)
+        assert_array_almost_equal(
+            sp.array([0.0, 0.25, 0.5, 0.75, 1.0]),
+            bins.rescale(pq.s).magnitude)
+        assert_array_almost_equal(sp.array([4.0, 0.0, 6.0, 2.0]), rates[0])
+        assert_array_almost_equal(sp.array([4.0, 6.0, 8.0, 6.0]), rates[1])
+
+    def test_returns_counts_without_rate_correction(self):
+        counts, _ = re.psth(self.trains, 250 * pq.ms, rate_correction=False)
+        assert_array_equal(sp.array([2, 0, 3, 1]), counts[0])
+        assert_array_equal(sp.array([2, 3, 4, 3]), counts[1])
+
+    def test_equals_mean_of_binned_spike_trains(self):
+        trains = {0: [neo.SpikeTrain(sp.rand(50) * pq.s, t_stop=1.0 * pq.s)
+                      for i in xrange(20)]}
+        binned, expected_bins = tools.bin_spike_trains(
+            trains, 1.0 / (30 * pq.ms), 0 * pq.s, 1.0 * pq.s)
+        rates, bins = re.psth(trains, 30 * pq.ms)
+        assert_array_equal(expected_bins, bins)
+        assert_array_almost_equal(
+            sp.mean(binned[0], axis=0) / 0.03, rates[0])
+
+    def test_bootstrap_bands_enclose_rates(self):
+        rates, bins = re.psth(self.trains, 250 * pq.ms)
+        boot_rates, boot_bins, bands = re.bootstrap_psth(
+            self.trains, 250 * pq.ms, n_bootstrap=50)
+        assert_array_equal(bins, boot_bins)
+        for u in rates:
+            assert_array_almost_equal(rates[u], boot_rates[u])
+            self.assertEqual((2, 4), bands[u].shape)
+            self.assertTrue(sp.all(bands[u][0] <= bands[u][1]))
+
+    def test_bootstrap_bands_of_identical_trials_equal_rates(self):
+        trains = {0: [arange_spikes(1.0 * pq.s, t_step=0.1 * pq.s)] * 5}
+        counts, _, bands = re.bootstrap_psth(
+            trains, 250 * pq.ms, n_bootstrap=20, rate_correction=False)
+        assert_array_equal(sp.array([10, 10, 15, 10]), counts[0])
+        assert_array_almost_equal(sp.vstack((counts[0], counts[0])), bands[0])
+
+
+class TestOptimalPSTHBinSize(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(3)
+        self.trains = {0: []}
+        for i in xrange(20):
+            t = rand.rand(400) * 2.0
+            keep = rand.rand(400) < 0.5 + 0.5 * sp.sin(4 * sp.pi * t)
+            self.trains[0].append(
+                neo.SpikeTrain(sp.sort(t[keep]) * pq.s, t_stop=2.0 * pq.s))
+        self.sizes = sp.array([1.0, 5.0, 10.0, 20.0, 50.0, 100.0]) * pq.ms
+
+    def test_returns_size_minimizing_cost_function(self):
+        costs = []
+        for size in self.sizes:
+            counts, _ = re.psth(self.trains, size, rate_correction=False)
+            k = counts[0]
+            costs.append((2 * sp.mean(k) - sp.var(k)) /
+                         (20 * float(size.rescale(pq.s))) ** 2)
+        best = re.optimal_psth_bin_size(self.trains, self.sizes)
+        self.assertAlmostEqual(
+            float(self.sizes[sp.argmin(costs)].rescale(pq.s)),
+            float(best.rescale(pq.s)))
+
+    def test_psth_with_automatic_bin_size(self):
+        best = re.optimal_psth_bin_size(self.trains)
+        rates, bins = re.psth(self.trains, 'auto')
+        self.assertAlmostEqual(
+            float(best.rescale(pq.s)),
+            float((bins[1] - bins[0]).rescale(pq.s)))
+        self.assertEqual(len(bins) - 1, len(rates[0]))
+
+
+class TestPSTHAccumulator(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(1)
+        self.trials = []
+        for i in xrange(10):
+            self.trials.append({
+                u: neo.SpikeTrain(
+                    sp.sort(rand.rand(20)) * pq.s, t_stop=1.0 * pq.s)
+                for u in xrange(i % 3 + 1)})
+
+    def test_equals_batch_psth(self):
+        acc = re.PSTHAccumulator(50 * pq.ms, 0 * pq.s, 1.0 * pq.s)
+        for trial in self.trials:
+            acc.add_trial(trial)
+        counts, rates, smoothed, bins = acc.current()
+        self.assertIsNone(smoothed)
+
+        trains = {u: [t[u] for t in self.trials if u in t] for u in xrange(3)}
+        expected_rates, expected_bins = re.psth(trains, 50 * pq.ms)
+        expected_counts, _ = re.psth(
+            trains, 50 * pq.ms, rate_correction=False)
+        assert_array_almost_equal(expected_bins, bins)
+        for u in xrange(3):
+            assert_array_equal(expected_counts[u], counts[u])
+            assert_array_almost_equal(expected_rates[u], rates[u])
+
+    def test_aligns_trials_to_events(self):
+        acc = re.PSTHAccumulator(
+            100 * pq.ms, -200 * pq.ms, 500 * pq.ms, units=[0])
+        acc.add_trial(
+            {0: neo.SpikeTrain([0.25, 0.55, 0.9] * pq.s, t_stop=1.0 * pq.s),
+             1: neo.SpikeTrain([0.5] * pq.s, t_stop=1.0 * pq.s)},
+            neo.Event(time=0.5 * pq.s, label='align'))
+        counts, _, _, _ = acc.current()
+        self.assertEqual([0], counts.keys())
+        assert_array_equal(sp.array([0, 0, 1, 0, 0, 0, 1]), counts[0])
+
+    def test_smoothes_rates(self):
+        acc = re.PSTHAccumulator(10 * pq.ms, 0 * pq.s, 1.0 * pq.s)
+        for trial in self.trials:
+            acc.add_trial(trial)
+        kernel = sigproc.GaussianKernel(50 * pq.ms)
+        _, rates, smoothed, _ = acc.current(kernel)
+        self.assertEqual(pq.Hz, smoothed[0].units)
+        self.assertEqual(rates[0].shape, smoothed[0].shape)
+        self.assertAlmostEqual(
+            sp.mean(rates[0][20:-20]),
+            sp.mean(smoothed[0][20:-20].magnitude), delta=1.0)
+
+
+class TestCollapsedSpikeTrains(ut.TestCase):
+    def setUp(self):
+        self.trains = [
+            neo.SpikeTrain([1.0, 3.0, 5.0] * pq.s, t_stop=10.0 * pq.s),
+            neo.SpikeTrain(
+                [2000.0, 3000.0] * pq.ms, t_start=-1000.0 * pq.ms,
+                t_stop=8000.0 * pq.ms)]
+
+    def test_contains_all_spikes(self):
+        collapsed = re.collapsed_spike_trains(self.trains)
+        assert_array_almost_equal(
+            sp.array([1.0, 3.0, 5.0, 2.0, 3.0]),
+            collapsed.rescale(pq.s).magnitude)
+        self.assertEqual(-1.0 * pq.s, collapsed.t_start)
+        self.assertEqual(10.0 * pq.s, collapsed.t_stop)
+
+    def test_sorted_with_labels(self):
+        collapsed, labels = re.collapsed_spike_trains(
+            self.trains, sort=True, return_labels=True)
+        assert_array_almost_equal(
+            sp.array([1.0, 2.0, 3.0, 3.0, 5.0]),
+            collapsed.rescale(pq.s).magnitude)
+        assert_array_equal(sp.array([0, 1, 0, 1, 0]), labels)
+
+    def test_empty_list_with_labels(self):
+        collapsed, labels = re.collapsed_spike_trains([], return_labels=True)
+        self.assertEqual(0, len(collapsed))
+        self.assertEqual(0, len(labels))
+
+
+class TestAlignedSpikeTrains(ut.TestCase):
+    def setUp(self):
+        self.segments = [neo.Segment() for _ in xrange(3)]
+        self.trains = []
+        for i, seg in enumerate(self.segments):
+            st = neo.SpikeTrain(
+                sp.array([1.0, 2.5, 4.0]) + i, units='s', t_stop=10.0 * pq.s,
+                waveforms=sp.ones((3, 1, 4)) * i * pq.mV)
+            st.segment = seg
+            self.trains.append(st)
+        self.events = {
+            seg: neo.Event(time=i * 500.0 * pq.ms, label='align')
+            for i, seg in enumerate(self.segments[:2])}
+
+    def test_views_shift_times_without_copying(self):
+        views = re.aligned_spike_trains(self.trains, self.events, view=True)
+        self.assertEqual(2, len(views))
+        for i, v in enumerate(views):
+            assert_array_almost_equal(
+                sp.array([1.0, 2.5, 4.0]) + 0.5 * i, v.magnitude)
+            self.assertEqual(pq.s, v.units)
+            self.assertAlmostEqual(-0.5 * i, v.t_start.magnitude)
+            self.assertAlmostEqual(10.0 - 0.5 * i, v.t_stop.magnitude)
+            self.assertIs(self.trains[i].waveforms, v.waveforms)
+            self.assertIs(self.segments[i], v.segment)
+        assert_array_equal(sp.array([2.0, 3.5, 5.0]), self.trains[1])
+
+    def test_views_support_indexing_and_iteration(self):
+        v = re.aligned_spike_trains(self.trains, self.events, view=True)[1]
+        self.assertEqual(3.0 * pq.s, v[1])
+        self.assertEqual(4.5 * pq.s, v[-1])
+        assert_array_almost_equal([1.5, 3.0], v[:2].magnitude)
+        self.assertEqual(pq.s, v[:2].units)
+        assert_array_almost_equal(
+            [1.5, 3.0, 4.5], [float(t.rescale(pq.s)) for t in v])
+
+    def test_views_equal_aligned_copies(self):
+        views = re.aligned_spike_trains(self.trains, self.events, view=True)
+        copies = re.aligned_spike_trains(self.trains, self.events)
+        for v, c in zip(views, copies):
+            st = v.spike_train()
+            assert_array_almost_equal(c.rescale(pq.ms), st.rescale(pq.ms))
+            assert_array_almost_equal(c.rescale(pq.ms), v.rescale(pq.ms))
+            self.assertEqual(c.t_start, st.t_start)
+            self.assertEqual(c.t_stop, st.t_stop)
+            self.assertIs(v.waveforms, st.waveforms)
+
+    def test_views_can_be_used_for_rate_estimation(self):
+        views = {0: re.aligned_spike_trains(
+            self.trains, self.events, view=True)}
+        copies = {0: re.aligned_spike_trains(self.trains, self.events)}
+        assert_array_equal(
+            re.psth(copies, 1.0 * pq.s)[0][0],
+            re.psth(views, 1.0 * pq.s)[0][0])
+        assert_array_almost_equal(
+            re.collapsed_spike_trains(copies[0]),
+            re.collapsed_spike_trains(views[0]))
+        assert_array_almost_equal(
+            re.spike_density_estimation(copies)[0][0],
+            re.spike_density_estimation(views)[0][0])
+
+
+class TestOptimalGaussKernelSize(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(1)
+        times = sp.concatenate(
+            (rand.rand(300) * 10.0, 3.0 + rand.randn(200) * 0.2))
+        times = sp.sort(times[(times > 0.0) & (times < 10.0)])
+        self.train = neo.SpikeTrain(times * pq.s, t_stop=10.0 * pq.s)
+        self.steps = sp.arange(10.0, 500.0, 15.0) * pq.ms
+
+    def exact_costs(self):
+        # Cost function evaluated directly on the spike times
+        def gauss(d, w):
+            return sp.exp(-0.5 * (d / w) ** 2) / sp.sqrt(2 * sp.pi) / w
+
+        t = self.train.rescale(pq.ms).magnitude
+        d = sp.subtract.outer(t, t)
+        n = t.size
+        return sp.array(
+            [sp.sum(gauss(d, sp.sqrt(2.0) * w)) -
+             2 * (sp.sum(gauss(d, w)) - n * gauss(0.0, w))
+             for w in self.steps.magnitude]) / n ** 2
+
+    def test_returns_size_minimizing_cost_function(self):
+        expected = self.steps[sp.argmin(self.exact_costs())]
+        actual = re.optimal_gauss_kernel_size(self.train, self.steps)
+        self.assertAlmostEqual(expected, actual)
+
+    def test_does_not_depend_on_order_of_steps(self):
+        expected = re.optimal_gauss_kernel_size(self.train, self.steps)
+        actual = re.optimal_gauss_kernel_size(self.train, self.steps[::-1])
+        self.assertAlmostEqual(expected, actual)
+
+    def test_refines_size_between_neighboring_steps(self):
+        best = re.optimal_gauss_kernel_size(self.train, self.steps)
+        actual = re.optimal_gauss_kernel_size(
+            self.train, self.steps, refine=True)
+        self.assertEqual(best.units, actual.units)
+        self.assertLessEqual(best - 15.0 * pq.ms, actual)
+        self.assertGreaterEqual(best + 15.0 * pq.ms, actual)
+
+
+class TestSpikeDensityEstimation(ut.TestCase):
+    def setUp(self):
+        # Spikes in the bin centers for 1000 bins are not affected by binning
+        rand = sp.random.RandomState(0)
+        self.trains = {0: []}
+        for i in xrange(3):
+            times = sp.sort(rand.randint(0, 1000, 30)) + 0.5
+            self.trains[0].append(
+                neo.SpikeTrain(times * pq.ms, t_stop=1000.0 * pq.ms))
+        self.kernel_size = 20.0 * pq.ms
+
+    def expected_density(self, eval_points):
+        times = sp.concatenate(
+            [t.rescale(pq.ms).magnitude for t in self.trains[0]])
+        return sp.sum(sp.exp(-0.5 * (sp.subtract.outer(
+            eval_points.rescale(pq.ms).magnitude, times) /
+            self.kernel_size.magnitude) ** 2), axis=1) / \
+            sp.sqrt(2 * sp.pi) / self.kernel_size.magnitude / \
+            len(self.trains[0]) * 1000.0
+
+    def test_uses_requested_number_of_points(self):
+        kde, _, eval_points = re.spike_density_estimation(
+            self.trains, kernel_size=self.kernel_size, num_points=1000)
+        self.assertEqual(1000, len(eval_points))
+        self.assertEqual(1000, len(kde[0]))
+        assert_array_almost_equal(
+            sp.arange(1000) + 0.5, eval_points.rescale(pq.ms).magnitude)
+        assert_array_almost_equal(
+            self.expected_density(eval_points),
+            kde[0].rescale(pq.Hz).magnitude, 2)
+
+    def test_uses_requested_resolution(self):
+        kde, _, eval_points = re.spike_density_estimation(
+            self.trains, kernel_size=self.kernel_size,
+            resolution=0.4 * pq.ms)
+        self.assertEqual(2500, len(eval_points))
+        self.assertEqual(2500, len(kde[0]))
+
+    def test_binless_estimation_evaluates_kernel_for_spikes(self):
+        kde, _, eval_points = re.spike_density_estimation(
+            self.trains, kernel_size=self.kernel_size, num_points=333,
+            binless=True)
+        self.assertEqual(333, len(eval_points))
+        self.assertEqual(pq.Hz, kde[0].units)
+        assert_array_almost_equal(
+            self.expected_density(eval_points), kde[0].magnitude, 2)
+
+    def test_binless_estimation_at_given_points(self):
+        points = sp.array([700.3, -5.0, 10.0, 10.0, 500.0]) * pq.ms
+        kde, _, eval_points = re.spike_density_estimation(
+            self.trains, kernel_size=self.kernel_size, eval_points=points)
+        assert_array_almost_equal(points, eval_points)
+        assert_array_almost_equal(
+            self.expected_density(points), kde[0].magnitude, 2)
+
+    def test_binless_estimation_in_small_blocks(self):
+        points = sp.linspace(0.0, 1.0, 100)
+        times = sp.sort(self.trains[0][0].rescale(pq.s).magnitude)
+        kernel = sigproc.GaussianKernel(self.kernel_size)
+        assert_array_almost_equal(
+            re._binless_kernel_sum(times, points, kernel, pq.s),
+            re._binless_kernel_sum(
+                times, points, kernel, pq.s, max_pairs=3))
+
+    def test_bootstrap_bands(self):
+        kde, _, eval_points = re.spike_density_estimation(
+            self.trains, kernel_size=self.kernel_size, num_points=1000)
+        for binless in (False, True):
+            boot_kde, _, _, bands = re.bootstrap_spike_density_estimation(
+                self.trains, 30, kernel_size=self.kernel_size,
+                num_points=1000, binless=binless)
+            assert_array_almost_equal(kde[0], boot_kde[0], 2)
+            self.assertEqual((2, 1000), bands[0].shape)
+            self.assertEqual(pq.Hz, bands[0].units)
+            self.assertTrue(sp.all(bands[0][0] <= bands[0][1]))
+
+    def test_bootstrap_bands_of_identical_trials_equal_density(self):
+        trains = {0: [self.trains[0][0]] * 4}
+        for binless in (False, True):
+            kde, _, _, bands = re.bootstrap_spike_density_estimation(
+                trains, 10, kernel_size=self.kernel_size, num_points=1000,
+                binless=binless)
+            assert_array_almost_equal(kde[0], bands[0][0])
+            assert_array_almost_equal(kde[0], bands[0][1])
+
+    def test_binless_adaptive_estimation_raises_exception(self):
+        with self.assertRaises(ValueError):
+            re.spike_density_estimation(
+                self.trains, optimize_steps=sp.array([0.2]) * pq.s,
+                adaptive=True, binless=True)
+
+
+class TestAdaptiveSpikeDensityEstimation(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(0)
+        self.trains = {0: []}
+        for i in xrange(20):
+            times = sp.concatenate(
+                (rand.rand(20) * 10.0, 3.0 + rand.randn(10) * 0.05))
+            times = sp.sort(times[(times > 0.0) & (times < 10.0)])
+            self.trains[0].append(
+                neo.SpikeTrain(times * pq.s, t_stop=10.0 * pq.s))
+        self.steps = sp.linspace(10.0, 1000.0, 60) * pq.ms
+
+    def test_single_kernel_size_gives_gaussian_density(self):
+        # Spikes in the bin centers are not affected by binning
+        bin_size = 10.0 / 1024.0
+        times = (sp.array([100, 110, 500, 510, 520, 900]) + 0.5) * bin_size
+        trains = {0: [neo.SpikeTrain(times * pq.s, t_stop=10.0 * pq.s)]}
+        kde, sizes, eval_points = re.spike_density_estimation(
+            trains, optimize_steps=sp.array([0.2]) * pq.s, adaptive=True)
+        expected = sp.sum(
+            sp.exp(-0.5 * (sp.subtract.outer(
+                eval_points.rescale(pq.s).magnitude, times) / 0.2) ** 2),
+            axis=1) / sp.sqrt(2 * sp.pi) / 0.2
+        assert_array_almost_equal(expected, kde[0].rescale(pq.Hz).magnitude)
+        self.assertTrue(sp.all(sizes[0] == 0.2 * pq.s))
+
+    def test_returns_kernel_size_for_each_evaluation_point(self):
+        kde, sizes, eval_points = re.spike_density_estimation(
+            self.trains, optimize_steps=self.steps, adaptive=True)
+        self.assertEqual(eval_points.shape, kde[0].shape)
+        self.assertEqual(eval_points.shape, sizes[0].shape)
+        self.assertEqual(pq.Hz, kde[0].units)
+        self.assertTrue(sp.all(sp.in1d(sizes[0], self.steps)))
+
+    def test_uses_smaller_kernel_sizes_at_burst(self):
+        _, sizes, eval_points = re.spike_density_estimation(
+            self.trains, optimize_steps=self.steps, adaptive=True)
+        burst = sp.searchsorted(eval_points, 3.0 * pq.s)
+        flat = (eval_points > 5.0 * pq.s) & (eval_points < 9.0 * pq.s)
+        self.assertLess(sizes[0][burst], sp.median(sizes[0][flat]))
+
+    def test_needs_optimize_steps(self):
+        with self.assertRaises(ValueError):
+            re.spike_density_estimation(self.trains, adaptive=True)
+
+
 if __name__ == '__main__':
     ut.main()
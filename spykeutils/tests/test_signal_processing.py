@@ -78,6 +78,46 @@ class TestKernel(ut.TestCase):
         actual = kernel.summed_dist_matrix(vectors)
         assert_array_almost_equal(expected, actual.rescale(1.0 / pq.s))
 
+    def test_bound_evaluator_falls_back_to_call(self):
+        kernel = sigproc.Kernel(2.0 * pq.s, normalize=False)
+        kernel._evaluate = lambda t, size: (t / size).simplified
+        evaluate = kernel.bound_evaluator(pq.ms)
+        assert_array_almost_equal(
+            sp.array([0.5, 1.0]), evaluate(sp.array([1000.0, 2000.0])))
+
+    def test_bound_evaluator_is_cached(self):
+        kernel = sigproc.GaussianKernel(2.0 * pq.s)
+        self.assertIs(
+            kernel.bound_evaluator(pq.ms), kernel.bound_evaluator(pq.ms))
+        self.assertIsNot(
+            kernel.bound_evaluator(pq.ms), kernel.bound_evaluator(pq.s))
+
+    def test_bound_evaluator_matches_call(self):
+        t = sp.array([-700.0, -100.0, 0.0, 300.0, 600.0, 1000.0])
+        for cls in (sigproc.CausalDecayingExpKernel, sigproc.GaussianKernel,
+                    sigproc.LaplacianKernel, sigproc.RectangularKernel,
+                    sigproc.TriangularKernel):
+            for normalize in (True, False):
+                kernel = cls(500 * pq.ms, normalize=normalize)
+                expected = kernel(t * pq.ms)
+                if normalize:
+                    expected = expected.rescale(1.0 / pq.ms).magnitude
+                else:
+                    expected = expected.simplified.magnitude
+                actual = kernel.bound_evaluator(pq.ms)(t)
+                assert_array_almost_equal(expected, actual)
+
+    def test_bound_evaluator_respects_changed_kernel_size(self):
+        kernel = sigproc.GaussianKernel(2.0 * pq.s)
+        resized = sigproc.as_kernel_of_size(kernel, 1.0 * pq.s)
+        t = sp.array([0.0, 1.0])
+        assert_array_almost_equal(
+            kernel(t * pq.s).rescale(1.0 / pq.s).magnitude,
+            kernel.bound_evaluator(pq.s)(t))
+        assert_array_almost_equal(
+            resized(t * pq.s).rescale(1.0 / pq.s).magnitude,
+            resized.bound_evaluator(pq.s)(t))
+
 
 class TestSymmetricKernel(ut.TestCase):
     def test_summed_dist_matrix(self):
@@ -144,6 +184,16 @@ class Test_discretize_kernel(ut.TestCase):
             kernel, sampling_rate, num_bins=num_bins)
         assert_array_equal(actual, mock_discretization)
 
+    def test_centers_requested_number_of_bins_at_zero(self):
+        kernel = sigproc.Kernel(1.0, normalize=False)
+        kernel._evaluate = lambda x, _: x
+        assert_array_equal(
+            sigproc.discretize_kernel(kernel, 1.0, num_bins=5),
+            sp.array([-2, -1, 0, 1, 2]))
+        assert_array_equal(
+            sigproc.discretize_kernel(kernel, 1.0, num_bins=4),
+            sp.array([-1, 0, 1, 2]))
+
     def test_can_normalize_to_unit_area(self):
         kernel = sigproc.Kernel(1.0, normalize=False)
         kernel._evaluate = lambda x, _: sp.ones(len(x))
@@ -171,6 +221,36 @@ class TestCausalDecayingExpKernel(ut.TestCase):
         actual = self.kernel.boundary_enclosing_at_least(0.99)
         self.assertAlmostEqual(actual.rescale(pq.s), 2.30258509 * pq.s)
 
+    def test_summed_dist_matrix(self):
+        kernel = sigproc.CausalDecayingExpKernel(1.0, normalize=False)
+        vectors = [sp.array([2.0, 1.0, 3.0]), sp.array([1.5, 4.0, 1.5]),
+                   sp.array([])]
+        expected = sp.array(
+            [[3.8710941655794975, 1.6593216397221267, 0.0],
+             [1.7660631122011856, 5.1641699972477975, 0.0],
+             [0.0, 0.0, 0.0]])
+        actual = kernel.summed_dist_matrix(vectors)
+        assert_array_almost_equal(expected, actual)
+
+    def test_summed_dist_matrix_with_units(self):
+        kernel = sigproc.CausalDecayingExpKernel(1000 * pq.ms, normalize=True)
+        vectors = [sp.array([2.0, 1.0, 3.0]) * pq.s,
+                   sp.array([1500, 4000, 1500]) * pq.ms]
+        expected = sp.array(
+            [[3.8710941655794975, 1.6593216397221267],
+             [1.7660631122011856, 5.1641699972477975]]) / pq.s
+        actual = kernel.summed_dist_matrix(vectors)
+        assert_array_almost_equal(expected, actual.rescale(1.0 / pq.s))
+
+    def test_summed_dist_matrix_equals_generic_implementation(self):
+        kernel = sigproc.CausalDecayingExpKernel(0.3 * pq.s)
+        vectors = [sp.rand(n) * pq.s for n in (0, 1, 5, 20)]
+        vectors.append(sp.array([0.2, 0.2, 0.5]) * pq.s)
+        expected = sigproc.Kernel.summed_dist_matrix(kernel, vectors)
+        actual = kernel.summed_dist_matrix(vectors)
+        assert_array_almost_equal(
+            expected.rescale(1.0 / pq.s), actual.rescale(1.0 / pq.s))
+
 
 class TestGaussianKernel(ut.TestCase):
     def setUp(self):
@@ -259,6 +339,111 @@ class TestTriangularKernel(ut.TestCase):
             actual.rescale(self.kernel_size.units), self.kernel_size)
 
 
+class TestSumOfExponentialsKernel(ut.TestCase):
+    def setUp(self):
+        self.kernel_size = 500 * pq.ms
+        self.kernel = sigproc.SumOfExponentialsKernel(
+            [1.0, -0.5], [1.0, 0.5], self.kernel_size)
+        self.causal_kernel = sigproc.SumOfExponentialsKernel(
+            [1.0, -0.5], [1.0, 0.5], self.kernel_size, causal=True)
+
+    def test_evaluates_to_correct_values(self):
+        t = sp.array([-0.1, 0, 0.6, 1]) * pq.s
+        unnormalized = sp.array(
+            [0.81873075 - 0.5 * 0.67032005, 0.5,
+             0.30119421 - 0.5 * 0.09071795, 0.13533528 - 0.5 * 0.01831564])
+        expected = unnormalized / 0.75 / pq.s
+        actual = self.kernel(t)
+        assert_array_almost_equal(expected, actual.rescale(expected.units))
+
+        unnormalized[0] = 0.0
+        expected = unnormalized / 0.375 / pq.s
+        actual = self.causal_kernel(t)
+        assert_array_almost_equal(expected, actual.rescale(expected.units))
+
+    def test_symmetry_depends_on_causality(self):
+        self.assertTrue(self.kernel.is_symmetric())
+        self.assertFalse(self.causal_kernel.is_symmetric())
+
+    def test_raises_exception_for_inconsistent_components(self):
+        with self.assertRaises(ValueError):
+            sigproc.SumOfExponentialsKernel([1.0, 2.0], [1.0])
+        with self.assertRaises(ValueError):
+            sigproc.SumOfExponentialsKernel([], [])
+
+    def test_boundary_enclosing_at_least_is_correct(self):
+        kernel = sigproc.SumOfExponentialsKernel([2.0], [0.5], 1.0 * pq.s)
+        actual = kernel.boundary_enclosing_at_least(0.99)
+        self.assertAlmostEqual(actual.rescale(pq.s), 2.30258509 * pq.s)
+
+        actual = self.kernel.boundary_enclosing_at_least(0.99)
+        t = sp.linspace(0.0, float(actual.rescale(pq.s)), 10001) * pq.s
+        area = sp.sum(self.kernel(t)[:-1]) * (t[1] - t[0]) * 2.0
+        self.assertAlmostEqual(0.99, float(area.simplified), 3)
+
+    def test_bound_evaluator_matches_call(self):
+        t = sp.array([-700.0, -100.0, 0.0, 300.0, 600.0, 1000.0])
+        for kernel in (self.kernel, self.causal_kernel):
+            expected = kernel(t * pq.ms).rescale(1.0 / pq.ms).magnitude
+            actual = kernel.bound_evaluator(pq.ms)(t)
+            assert_array_almost_equal(expected, actual)
+
+    def test_summed_dist_matrix_equals_generic_implementation(self):
+        vectors = [sp.rand(n) * pq.s for n in (0, 1, 5, 20)]
+        vectors.append(sp.array([0.2, 0.2, 0.5]) * pq.s)
+        for kernel in (self.kernel, self.causal_kernel):
+            expected = sigproc.Kernel.summed_dist_matrix(kernel, vectors)
+            actual = kernel.summed_dist_matrix(vectors)
+            assert_array_almost_equal(
+                expected.rescale(1.0 / pq.s), actual.rescale(1.0 / pq.s))
+
+    def test_fit_approximates_gaussian_kernel(self):
+        gaussian = sigproc.GaussianKernel(self.kernel_size)
+        kernel = sigproc.SumOfExponentialsKernel.fit(gaussian, 1e-3)
+        self.assertTrue(kernel.is_symmetric())
+        self.assertEqual(self.kernel_size, kernel.kernel_size)
+        t = sp.linspace(-2.0, 2.0, 101) * pq.s
+        expected = gaussian(t).rescale(1.0 / pq.s)
+        actual = kernel(t).rescale(1.0 / pq.s)
+        self.assertLess(
+            sp.amax(sp.absolute(expected - actual)), 2e-3 * expected.max())
+
+    def test_fit_approximates_kernel_from_function(self):
+        func = lambda t, size: sp.exp(-(t / size).simplified ** 2) * (t >= 0)
+        kernel = sigproc.SumOfExponentialsKernel.fit(
+            sigproc.KernelFromFunction(func, 1.0 * pq.s), 1e-2,
+            support=3.0 * pq.s)
+        self.assertFalse(kernel.is_symmetric())
+        t = sp.linspace(-1.0, 3.0, 101) * pq.s
+        assert_array_almost_equal(func(t, 1.0 * pq.s), kernel(t), 2)
+
+    def test_fit_approximates_symmetric_kernel_from_function(self):
+        func = lambda t, size: sp.exp(-(t / size).simplified ** 2)
+        kernel = sigproc.SumOfExponentialsKernel.fit(
+            sigproc.KernelFromFunction(func, 1.0 * pq.s), 1e-2,
+            support=3.0 * pq.s)
+        self.assertTrue(kernel.is_symmetric())
+        t = sp.linspace(-3.0, 3.0, 101) * pq.s
+        assert_array_almost_equal(func(t, 1.0 * pq.s), kernel(t), 2)
+
+    def test_fit_raises_exception_for_non_causal_asymmetric_kernel(self):
+        func = lambda t, size: sp.exp(-((t / size).simplified - 0.5) ** 2)
+        with self.assertRaises(ValueError):
+            sigproc.SumOfExponentialsKernel.fit(
+                sigproc.KernelFromFunction(func, 1.0 * pq.s), 1e-2,
+                support=3.0 * pq.s)
+
+    def test_fit_checks_tolerance_for_negative_times(self):
+        with self.assertRaises(ValueError):
+            sigproc.SumOfExponentialsKernel.fit(
+                sigproc.GaussianKernel(), 1e-2, causal=True)
+
+    def test_fit_raises_exception_if_tolerance_cannot_be_met(self):
+        with self.assertRaises(ValueError):
+            sigproc.SumOfExponentialsKernel.fit(
+                sigproc.GaussianKernel(), 1e-10, max_components=2)
+
+
 class Test_smooth(ut.TestCase):
     def test_convolution_with_empty_binned_array_returns_array_of_zeros(self):
         binned = sp.zeros(10)
@@ -284,6 +469,17 @@ class Test_smooth(ut.TestCase):
         actual = sigproc.smooth(binned, kernel, sampling_rate=sampling_rate)
         assert_array_almost_equal(expected, actual)
 
+    def test_smoothes_each_row_of_2d_array(self):
+        binned = sp.array([[0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0],
+                           [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+        sampling_rate = 4 * pq.Hz
+        kernel = sigproc.RectangularKernel(0.3 * pq.s)
+        actual = sigproc.smooth(binned, kernel, sampling_rate=sampling_rate)
+        self.assertEqual(binned.shape, actual.shape)
+        for i in xrange(binned.shape[0]):
+            assert_array_almost_equal(
+                sigproc.smooth(binned[i], kernel, sampling_rate), actual[i])
+
     def test_mode_allows_full_convolution(self):
         binned = sp.ones(10)
         sampling_rate = 2.0 * pq.Hz
@@ -375,5 +571,51 @@ class Test_st_convolve(ut.TestCase):
         assert_array_almost_equal(expected_bins, bins)
 
 
+class Test_st_convolve_chunks(ut.TestCase):
+    def setUp(self):
+        self.st = neo.SpikeTrain(
+            sp.array([0.1, 1.0, 1.05, 2.0, 2.75, 3.5, 5.0]) * pq.s,
+            t_start=0.0 * pq.s, t_stop=5.0 * pq.s)
+        self.kernel = sigproc.GaussianKernel(0.3 * pq.s)
+        self.sampling_rate = 20 * pq.Hz
+
+    def assert_chunks_equal_one_shot(self, mode, chunk_size):
+        expected, expected_bins = sigproc.st_convolve(
+            self.st, self.kernel, self.sampling_rate, mode)
+        chunks = list(sigproc.st_convolve_chunks(
+            self.st, self.kernel, self.sampling_rate, chunk_size, mode))
+        actual = sp.concatenate([c.magnitude for c, _ in chunks])
+        assert_array_almost_equal(expected.magnitude, actual)
+        for c, _ in chunks:
+            self.assertEqual(expected.units, c.units)
+        for (c, b), (next_c, next_b) in zip(chunks[:-1], chunks[1:]):
+            self.assertEqual(c.size + 1, b.size)
+            self.assertAlmostEqual(b[-1], next_b[0])
+        self.assertAlmostEqual(expected_bins[0], chunks[0][1][0])
+        self.assertAlmostEqual(expected_bins[-1], chunks[-1][1][-1])
+
+    def test_chunks_equal_one_shot_convolution(self):
+        self.assert_chunks_equal_one_shot('same', 0.5 * pq.s)
+
+    def test_chunks_equal_one_shot_full_convolution(self):
+        self.assert_chunks_equal_one_shot('full', 700 * pq.ms)
+
+    def test_chunks_equal_one_shot_valid_convolution(self):
+        self.assert_chunks_equal_one_shot('valid', 0.35 * pq.s)
+
+    def test_chunk_size_smaller_than_bin_yields_single_bins(self):
+        chunks = list(sigproc.st_convolve_chunks(
+            self.st, self.kernel, self.sampling_rate, 1 * pq.ms))
+        self.assertEqual(100, len(chunks))
+        self.assertTrue(all(c.size == 1 for c, _ in chunks))
+
+    def test_empty_spike_train_yields_zeros(self):
+        st = create_empty_spike_train()
+        chunks = list(sigproc.st_convolve_chunks(
+            st, sigproc.GaussianKernel(), 1 * pq.Hz, 3 * pq.s))
+        self.assertEqual(4, len(chunks))
+        self.assertTrue(all(sp.all(c == 0.0) for c, _ in chunks))
+
+
 if __name__ == '__main__':
     ut.main()
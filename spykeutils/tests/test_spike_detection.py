@@ -0,0 +1,88 @@
+try:
+    import unittest2 as ut
+    assert ut  # Suppress pyflakes warning about redefinition of unused ut
+except ImportError:
+    import unittest as ut
+
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+import spykeutils.spike_detection as sd
+import neo
+import quantities as pq
+import scipy as sp
+
+
+class TestDetectSpikes(ut.TestCase):
+    def setUp(self):
+        rand = sp.random.RandomState(6)
+        self.data = rand.randn(30000, 3) * 10.0
+        # Spike troughs (in samples) and channels
+        self.peaks = sp.array([1000, 1010, 5000, 5003, 12345, 20000, 29990])
+        self.channels = sp.array([0, 0, 1, 2, 2, 0, 1])
+        scales = [1.0, 0.7, 0.8, 1.0, 1.0, 1.0, 1.0]
+        for p, c, a in zip(self.peaks, self.channels, scales):
+            self.data[p - 3:p + 4, c] -= \
+                a * sp.array([30, 80, 150, 200, 150, 80, 30])
+        self.signals = [
+            neo.AnalogSignal(self.data[:, c] * pq.uV,
+                             sampling_rate=10 * pq.kHz)
+            for c in xrange(3)]
+
+    def test_detects_troughs_with_dead_time_and_merging(self):
+        train = sd.detect_spikes(self.signals, dead_time=2 * pq.ms)
+        # 1010 is within dead time of 1000, 5003 is merged with 5000
+        expected = [1000, 5003, 12345, 20000, 29990]
+        assert_array_almost_equal(
+            sp.array(expected) / 10.0, train.rescale(pq.ms).magnitude)
+        assert_array_equal([0, 2, 2, 0, 1], train.annotations['channels'])
+        self.assertEqual(3 * pq.s, train.t_stop)
+
+    def test_separate_channels(self):
+        train = sd.detect_spikes(
+            self.signals, dead_time=0.5 * pq.ms, merge_channels=False)
+        assert_array_almost_equal(
+            self.peaks / 10.0, train.rescale(pq.ms).magnitude)
+        assert_array_equal(self.channels, train.annotations['channels'])
+
+    def test_result_does_not_depend_on_chunk_size(self):
+        expected = sd.detect_spikes(
+            self.data, sampling_rate=10 * pq.kHz, noise=[10.0] * 3)
+        for chunk_size in (1, 7, 1000):
+            actual = sd.detect_spikes(
+                self.data, sampling_rate=10 * pq.kHz, noise=[10.0] * 3,
+                chunk_size=chunk_size)
+            assert_array_almost_equal(expected, actual)
+            assert_array_equal(
+                expected.annotations['channels'],
+                actual.annotations['channels'])
+
+    def test_estimated_noise_does_not_depend_on_chunk_size(self):
+        for duration in (0.5 * pq.s, 10 * pq.s):
+            expected = sd.detect_spikes(
+                self.data, sampling_rate=10 * pq.kHz,
+                noise_duration=duration)
+            assert_array_almost_equal(
+                [100.0, 500.3, 1234.5, 2000.0, 2999.0],
+                expected.rescale(pq.ms).magnitude)
+            for chunk_size in (1, 7, 1000):
+                actual = sd.detect_spikes(
+                    self.data, sampling_rate=10 * pq.kHz,
+                    noise_duration=duration, chunk_size=chunk_size)
+                assert_array_almost_equal(expected, actual)
+                assert_array_equal(
+                    expected.annotations['channels'],
+                    actual.annotations['channels'])
+
+    def test_positive_threshold(self):
+        train = sd.detect_spikes(
+            -self.data[:, 1], sampling_rate=10 * pq.kHz,
+            direction='positive', t_start=1 * pq.s)
+        assert_array_almost_equal(
+            [1.5, 3.999], train.rescale(pq.s).magnitude)
+
+    def test_array_without_sampling_rate_raises_exception(self):
+        with self.assertRaises(ValueError):
+            sd.detect_spikes(self.data)
+
+
+if __name__ == '__main__':
+    ut.main()
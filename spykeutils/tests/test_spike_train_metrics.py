@@ -752,6 +752,17 @@ class Test_victor_purpura_dist(ut.TestCase, CommonMetricTestCases):
         expected = sp.array([[0.0, 2.0], [2.0, 0.0]])
         assert_array_almost_equal(expected, stm.victor_purpura_dist([a, b], q))
 
+    def test_result_does_not_depend_on_time_unit(self):
+        k = sigproc.TriangularKernel(50.0 * pq.ms, normalize=True)
+        a = neo.SpikeTrain(
+            sp.array([1.0, 2.0, 4.1, 7.0, 7.1]) * pq.s, t_stop=8.0 * pq.s)
+        b = neo.SpikeTrain(
+            sp.array([1.01, 4.0, 4.12]) * pq.s, t_stop=8.0 * pq.s)
+        expected = stm.victor_purpura_dist([a, b], kernel=k)
+        actual = stm.victor_purpura_dist(
+            [a.rescale(pq.ms), b.rescale(pq.ms)], kernel=k)
+        assert_array_almost_equal(expected, actual)
+
 
 class Test_victor_purpura_multiunit_dist(ut.TestCase, CommonMetricTestCases):
     # With only one spike train each we should get the normal VP distance.
@@ -769,6 +780,22 @@ class Test_victor_purpura_multiunit_dist(ut.TestCase, CommonMetricTestCases):
         actual = stm.victor_purpura_multiunit_dist(units, reassignment_cost)
         assert_array_almost_equal(expected, actual)
 
+    def test_result_does_not_depend_on_time_unit(self):
+        k = sigproc.TriangularKernel(50.0 * pq.ms, normalize=True)
+        a0 = neo.SpikeTrain(
+            sp.array([1.0, 5.0, 7.0]) * pq.s, t_stop=8.0 * pq.s)
+        a1 = neo.SpikeTrain(
+            sp.array([1.0, 2.0, 5.0]) * pq.s, t_stop=8.0 * pq.s)
+        b0 = neo.SpikeTrain(
+            sp.array([1.02, 4.0, 5.01]) * pq.s, t_stop=8.0 * pq.s)
+        b1 = neo.SpikeTrain(sp.array([2.03, 8.0]) * pq.s, t_stop=9.0 * pq.s)
+        units = {0: [a0, a1], 1: [b0, b1]}
+        expected = stm.victor_purpura_multiunit_dist(units, 0.7, kernel=k)
+        units_ms = dict((u, [st.rescale(pq.ms) for st in trains])
+                        for u, trains in units.iteritems())
+        actual = stm.victor_purpura_multiunit_dist(units_ms, 0.7, kernel=k)
+        assert_array_almost_equal(expected, actual)
+
     def test_returns_empty_array_if_empty_dict_is_passed(self):
         expected = sp.zeros((0, 0))
         actual = stm.victor_purpura_multiunit_dist({}, 1.0)
@@ -4,6 +4,8 @@ try:
 except ImportError:
     import unittest as ut
 
+import os
+import tempfile
 from builders import arange_spikes
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 from spykeutils import tools
@@ -101,6 +103,90 @@ class TestBinSpikeTrains(ut.TestCase):
             expectedBins, actualBins.rescale(expectedBins.units))
 
 
+class TestSpikeCountMatrix(ut.TestCase):
+    def test_equals_binned_spike_trains(self):
+        trains = [
+            neo.SpikeTrain(sp.rand(50) * pq.s, t_stop=1.0 * pq.s),
+            neo.SpikeTrain(sp.array([]) * pq.s, t_stop=1.0 * pq.s),
+            neo.SpikeTrain(sp.rand(20) * 1000.0 * pq.ms,
+                           t_stop=1000.0 * pq.ms)]
+        binned, bins = tools.bin_spike_trains(
+            {0: trains}, 1.0 / (40.0 * pq.ms), 0.0 * pq.s, 1.0 * pq.s)
+        assert_array_equal(
+            sp.array(binned[0]), tools.spike_count_matrix(trains, bins))
+
+
+class TestSpikeCountArray(ut.TestCase):
+    def test_dense_and_sparse_output_equal_binned_spike_trains(self):
+        trains = {
+            'a': [arange_spikes(5 * pq.s), arange_spikes(3 * pq.s)],
+            'b': [arange_spikes(7 * pq.s), arange_spikes(0.5 * pq.s)]}
+        expected, expected_bins = tools.bin_spike_trains(trains, 4.0 * pq.Hz)
+        dense, bins, indices = tools.spike_count_array(
+            trains, 4.0 * pq.Hz, dtype=sp.uint8)
+        self.assertEqual(sorted(trains.keys()), sorted(indices))
+        self.assertEqual(sp.uint8, dense.dtype)
+        self.assertEqual((2, 2, len(bins) - 1), dense.shape)
+        sparse, _, _ = tools.spike_count_array(
+            trains, 4.0 * pq.Hz, sparse=True)
+        assert_array_equal(expected_bins, bins)
+        for i, u in enumerate(indices):
+            for j in xrange(2):
+                assert_array_equal(expected[u][j], dense[i, j])
+                assert_array_equal(
+                    expected[u][j], sparse[i * 2 + j].toarray().ravel())
+
+    def test_requires_same_number_of_trains(self):
+        trains = {'a': [arange_spikes(5 * pq.s)],
+                  'b': [arange_spikes(5 * pq.s), arange_spikes(5 * pq.s)]}
+        with self.assertRaises(ValueError):
+            tools.spike_count_array(trains, 4.0 * pq.Hz)
+
+    def test_raises_exception_if_counts_do_not_fit_dtype(self):
+        a = neo.SpikeTrain(sp.ones(300) * pq.s, t_stop=2.0 * pq.s)
+        with self.assertRaises(ValueError):
+            tools.spike_count_array(
+                {0: [a]}, 1.0 * pq.Hz, sparse=True, dtype=sp.uint8)
+        binned, _, _ = tools.spike_count_array(
+            {0: [a]}, 1.0 * pq.Hz, dtype=sp.uint16)
+        assert_array_equal([[[0, 300]]], binned)
+
+
+class TestSpikeTrainBinIndices(ut.TestCase):
+    def test_assigns_same_bins_as_histogram(self):
+        trains = [
+            neo.SpikeTrain(
+                sp.array([0.0, 0.25, 0.3, 0.7, 0.75, 0.99, 1.0]) * pq.s,
+                t_stop=1.0 * pq.s),
+            neo.SpikeTrain(sp.array([500.0, 1000.0]) * pq.ms,
+                           t_stop=1000.0 * pq.ms),
+            neo.SpikeTrain(sp.rand(100) * pq.s, t_stop=1.0 * pq.s)]
+        bins = tools.bin_edges(
+            1.0 / (30.0 * pq.ms), 0.0 * pq.s, 1.0 * pq.s)
+        bin_indices, train_indices = tools.spike_train_bin_indices(
+            trains, bins)
+        for i, st in enumerate(trains):
+            expected = sp.histogram(st.rescale(bins.units), bins)[0]
+            actual = sp.bincount(
+                bin_indices[train_indices == i], minlength=bins.size - 1)
+            assert_array_equal(expected, actual)
+
+    def test_ignores_spikes_outside_of_bins(self):
+        st = neo.SpikeTrain(
+            sp.array([0.5, 1.0, 1.5, 2.5, 3.0]) * pq.s, t_stop=3.0 * pq.s)
+        bins = sp.array([1.0, 1.5, 2.0]) * pq.s
+        bin_indices, train_indices = tools.spike_train_bin_indices(
+            [st, st], bins)
+        assert_array_equal(sp.array([0, 1, 0, 1]), bin_indices)
+        assert_array_equal(sp.array([0, 0, 1, 1]), train_indices)
+
+    def test_works_on_empty_sequence(self):
+        bins = sp.array([1.0, 1.5, 2.0]) * pq.s
+        bin_indices, train_indices = tools.spike_train_bin_indices([], bins)
+        self.assertEqual(0, bin_indices.size)
+        self.assertEqual(0, train_indices.size)
+
+
 class TestConcatenateSpikeTrains(ut.TestCase):
     def test_concatenates_spike_trains(self):
         a = arange_spikes(3.0 * pq.s)
@@ -464,5 +550,141 @@ class TestRemoveFromHierarchy(ut.TestCase):
             self.assertAlmostEqual(s.waveform[:, 0].mean(), i)
             self.assertAlmostEqual(s.waveform[:, 1].mean(), -i)
 
+    def test_extract_spikes_as_spike_train(self):
+        s1 = sp.arange(10000.0)
+        s2 = -sp.arange(10000.0)
+        t = sp.array([0.0005, 1.0, 2.5, 9.998])
+
+        sig1 = neo.AnalogSignal(s1 * pq.uV, sampling_rate=pq.kHz)
+        sig2 = neo.AnalogSignal(s2 * pq.mV, sampling_rate=pq.kHz)
+        train = neo.SpikeTrain(t * pq.s, 10 * pq.s)
+
+        spikes = tools.extract_spikes(
+            train, [sig1, sig2], 4 * pq.ms, 1 * pq.ms, as_spike_train=True)
+
+        assert_array_almost_equal([1.0, 2.5], spikes.rescale(pq.s).magnitude)
+        self.assertEqual((2, 4, 2), spikes.waveforms.shape)
+        self.assertEqual(pq.uV, spikes.waveforms.units)
+        for i, start in enumerate((999, 2499)):
+            expected = sp.arange(start, start + 4.0)
+            assert_array_almost_equal(
+                expected, spikes.waveforms[i, :, 0].magnitude)
+            assert_array_almost_equal(
+                -expected * 1000.0, spikes.waveforms[i, :, 1].magnitude)
+
+    def test_extract_spikes_with_sub_sample_precision(self):
+        sig = neo.AnalogSignal(sp.arange(1000.0) * pq.uV, sampling_rate=pq.kHz)
+        train = neo.SpikeTrain(
+            sp.array([100.25, 500.5]) * pq.ms, t_stop=1 * pq.s)
+        spikes = tools.extract_spikes(
+            train, [sig], 5 * pq.ms, 2 * pq.ms, as_spike_train=True,
+            upsampling=4)
+        assert_array_almost_equal(
+            [100.25, 500.5], spikes.rescale(pq.ms).magnitude)
+        for i, start in enumerate((98.25, 498.5)):
+            assert_array_almost_equal(
+                start + sp.arange(5.0), spikes.waveforms[i, :, 0].magnitude)
+
+    def test_extract_spikes_realignment_respects_max_shift(self):
+        x = sp.arange(1000.0)
+        sig = neo.AnalogSignal(
+            sp.exp(-(x - 500.0) ** 2 / 8.0) * pq.mV, sampling_rate=pq.kHz)
+        train = neo.SpikeTrain(sp.array([499.0, 500.3]) * pq.ms,
+                               t_stop=1 * pq.s)
+        spikes = tools.extract_spikes(
+            train, [sig], 10 * pq.ms, 5 * pq.ms, as_spike_train=True,
+            realign='peak', upsampling=10, max_shift=0.4 * pq.ms)
+        shifts = (spikes - train).rescale(pq.ms).magnitude
+        self.assertTrue(sp.all(sp.absolute(shifts) <= 0.4 + 1e-9))
+        assert_array_almost_equal([0.4, -0.3], shifts)
+
+    def test_extract_spikes_realigns_to_exact_peak_time(self):
+        x = sp.arange(1000.0)
+        sig = neo.AnalogSignal(
+            sp.exp(-(x - 500.0) ** 2 / 8.0) * pq.mV, sampling_rate=pq.kHz)
+        train = neo.SpikeTrain(sp.array([498.7, 500.4]) * pq.ms,
+                               t_stop=1 * pq.s)
+        for upsampling in (1, 4):
+            spikes = tools.extract_spikes(
+                train, [sig], 10 * pq.ms, 5 * pq.ms, as_spike_train=True,
+                realign='peak', upsampling=upsampling, max_shift=2 * pq.ms)
+            assert_array_almost_equal(
+                [500.0, 500.0], spikes.rescale(pq.ms).magnitude)
+            assert_array_almost_equal(
+                spikes.waveforms[0], spikes.waveforms[1])
+
+        # Without realignment, waveforms start at the sample before the
+        # spike time regardless of the method
+        plain = tools.extract_spikes(
+            train, [sig], 10 * pq.ms, 5 * pq.ms, as_spike_train=True)
+        exact = tools.extract_spikes(
+            train, [sig], 10 * pq.ms, 5 * pq.ms, as_spike_train=True,
+            realign='peak', max_shift=0 * pq.ms)
+        assert_array_almost_equal(sig.magnitude[493:503],
+                                  plain.waveforms[0, :, 0].magnitude)
+        assert_array_almost_equal(plain.waveforms, exact.waveforms)
+        assert_array_almost_equal(
+            [498.0, 500.0], exact.rescale(pq.ms).magnitude)
+
+    def test_extract_spikes_realigns_to_extremum(self):
+        x = sp.arange(2000.0)
+        peaks = [300.3, 1000.0, 1500.7]
+        s1 = sum(sp.exp(-(x - p) ** 2 / 8.0) for p in peaks)
+        s2 = -2.0 * s1
+        signals = [neo.AnalogSignal(s * pq.mV, sampling_rate=10 * pq.kHz)
+                   for s in (s1, s2)]
+        train = neo.SpikeTrain(
+            (sp.array(peaks) + [-2.0, 1.6, 3.0]) * 0.1 * pq.ms,
+            t_stop=200 * pq.ms)
+        for realign, channel in (('peak', 0), ('trough', 1), ('abs', 1)):
+            spikes = tools.extract_spikes(
+                train, signals, 2 * pq.ms, 0.5 * pq.ms, realign=realign,
+                upsampling=10)
+            self.assertEqual(3, len(spikes))
+            for p, s in zip(peaks, spikes):
+                self.assertAlmostEqual(
+                    p * 0.1, float(s.time.rescale(pq.ms)), 2)
+                self.assertEqual(
+                    5, sp.absolute(s.waveform[:, channel]).argmax())
+
+    def test_extract_spikes_chunked_equals_extract_spikes(self):
+        data = sp.random.RandomState(5).randn(5000, 3)
+        signals = [neo.AnalogSignal(data[:, c] * pq.uV, sampling_rate=pq.kHz)
+                   for c in xrange(3)]
+        train = neo.SpikeTrain(
+            sp.array([3.2, 0.01, 1.5, 1.503, 4.999, 2.7]) * pq.s,
+            t_stop=5 * pq.s)
+        expected = tools.extract_spikes(
+            train, signals, 2 * pq.ms, 0.5 * pq.ms, as_spike_train=True)
+        out = sp.zeros((5, 2, 3))
+        actual = tools.extract_spikes_chunked(
+            train, data, pq.kHz, 2 * pq.ms, 0.5 * pq.ms, unit=pq.uV,
+            chunk_size=4, out=out)
+        assert_array_almost_equal(
+            expected.rescale(pq.s).magnitude, actual.rescale(pq.s).magnitude)
+        assert_array_almost_equal(expected.waveforms.magnitude, out)
+        self.assertEqual(pq.uV, actual.waveforms.units)
+        actual.waveforms[0, 0, 0] = 1000.0 * pq.uV
+        self.assertEqual(1000.0, out[0, 0, 0])
+
+    def test_extract_spikes_chunked_to_file(self):
+        data = sp.arange(1000.0)
+        train = neo.SpikeTrain(
+            sp.array([300.0, 100.0]) * pq.ms, t_start=50.0 * pq.ms,
+            t_stop=1100.0 * pq.ms)
+        handle, filename = tempfile.mkstemp(suffix='.npy')
+        os.close(handle)
+        try:
+            spikes = tools.extract_spikes_chunked(
+                train, data, pq.kHz, 3 * pq.ms, 1 * pq.ms,
+                t_start=50.0 * pq.ms, filename=filename)
+            expected = sp.array([[[249.0], [250.0], [251.0]],
+                                 [[49.0], [50.0], [51.0]]])
+            assert_array_almost_equal(expected, spikes.waveforms.magnitude)
+            del spikes
+            assert_array_almost_equal(expected, sp.load(filename))
+        finally:
+            os.remove(filename)
+
 if __name__ == '__main__':
     ut.main()
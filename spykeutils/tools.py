@@ -6,6 +6,10 @@ except ImportError:
     HAS_DESCRIPTION = False
 import quantities as pq
 import scipy as sp
+import scipy.sparse
+import scipy.interpolate
+import numpy.lib.format
+from numpy.lib.stride_tricks import as_strided
 import _scipy_quantities as spq
 
 
@@ -31,6 +35,11 @@ def apply_to_dict(fn, dictionary, *args):
 def bin_spike_trains(trains, sampling_rate, t_start=None, t_stop=None):
     """ Creates binned representations of spike trains.
 
+    The bin index of every spike is computed arithmetically from the equally
+    spaced bins (see :func:`spike_train_bin_indices`), the spike counts
+    are the same as with :func:`scipy.histogram`. For a single array of
+    all spike counts, use :func:`spike_count_array`.
+
     :param dict trains: A dictionary of sequences of
         :class:`neo.core.SpikeTrain` objects.
     :param sampling_rate: The sampling rate which will be used to bin
@@ -48,32 +57,222 @@ def bin_spike_trains(trains, sampling_rate, t_start=None, t_stop=None):
         of spike train counts and the bin borders.
     :rtype: dict, Quantity 1D with time units
     """
+    bins = _spike_train_bins(trains, sampling_rate, t_start, t_stop)
+    binned = {}
+    for u, st in trains.iteritems():
+        binned[u] = list(spike_count_matrix(st, bins))
+    return binned, bins
+
+
+def _spike_train_bins(trains, sampling_rate, t_start, t_stop):
+    """ Return the bin edges for :func:`bin_spike_trains` and
+    :func:`spike_count_array`.
+    """
     if t_start is None or t_stop is None:
         max_start, max_stop = maximum_spike_train_interval(trains)
         if t_start is None:
             t_start = max_start
         if t_stop is None:
             t_stop = max_stop
+    return bin_edges(sampling_rate, t_start, t_stop)
+
+
+def _check_count_type(counts, dtype):
+    """ Raises a ``ValueError`` if the counts do not fit into the integer
+    type ``dtype``.
+    """
+    if not sp.issubdtype(dtype, sp.integer) or counts.size < 1:
+        return
+    if counts.max() > sp.iinfo(dtype).max:
+        raise ValueError('Spike counts are too large for %s.' %
+                         sp.dtype(dtype).name)
+
+
+def bin_edges(sampling_rate, t_start, t_stop):
+    """ Returns equally spaced bin edges as used by :func:`bin_spike_trains`.
 
+    :param sampling_rate: The sampling rate of the bins as inverse time
+        scalar.
+    :type sampling_rate: Quantity scalar
+    :param t_start: The start of the first bin as time scalar.
+    :type t_start: Quantity scalar
+    :param t_stop: The end of the last bin as time scalar.
+    :type t_stop: Quantity scalar
+    :returns: The bin edges, including the rightmost edge, in the units of
+        ``t_stop``.
+    :rtype: Quantity 1D
+    """
     t_start = t_start.rescale(t_stop.units)
 
     duration = t_stop - t_start
     num_bins = (sampling_rate * duration).simplified
-    bins = sp.arange(num_bins + 1) * (duration / num_bins) + t_start
-    return apply_to_dict(_bin_single_spike_train, trains, bins), bins
+    return sp.arange(num_bins + 1) * (duration / num_bins) + t_start
 
 
-def _bin_single_spike_train(train, bins):
-    """ Return a binned representation of SpikeTrain object.
+def spike_train_bin_indices(trains, bins):
+    """ Determines the bins all spikes of a sequence of spike trains fall
+    into.
 
-    :param train: A spike train to bin.
-    :type train: :class:`neo.core.SpikeTrain`
-    :param bins: The bin edges, including the rightmost edge, with time units.
+    The spikes are assigned to the same bins as with
+    :func:`bin_spike_trains`, but the bin index is computed arithmetically
+    for all spikes at once instead of searching the bins for each spike
+    train. Together with :func:`numpy.bincount`, this allows to get summed
+    spike counts of many spike trains efficiently.
+
+    :param sequence trains: A sequence of :class:`neo.core.SpikeTrain`
+        objects.
+    :param bins: Equally spaced bin edges, including the rightmost edge, with
+        time units (e.g. as returned by :func:`bin_edges`).
     :type bins: Quantity 1D
-    :returns: The binned spike train.
-    :rtype: 1-D array
+    :returns: Two arrays with one entry for each spike inside of the bins: The
+        bin index of the spike and the index of the spike train in
+        ``trains`` it belongs to.
+    :rtype: 1-D array, 1-D array
+    """
+    units = bins.units
+    times = []
+    for t in trains:
+        factor = float(t.units.rescale(units))
+        if factor == 1.0:
+            times.append(sp.asarray(t.magnitude, dtype=float))
+        else:
+            times.append(factor * t.magnitude)
+
+    if times:
+        times = sp.concatenate(times)
+    else:
+        times = sp.array([])
+    train_indices = sp.repeat(
+        sp.arange(len(trains)), [t.size for t in trains])
+
+    inside = _uniform_bin_indices(times, sp.asarray(bins))
+    return inside[1], train_indices[inside[0]]
+
+
+def spike_count_matrix(trains, bins):
+    """ Returns the spike counts of a sequence of spike trains as 2-D array.
+
+    The counts are the same as returned by :func:`bin_spike_trains`, but
+    all spike trains are binned at once with
+    :func:`spike_train_bin_indices`.
+
+    :param sequence trains: A sequence of :class:`neo.core.SpikeTrain`
+        objects, e.g. the trials of a unit.
+    :param bins: Equally spaced bin edges, including the rightmost edge, with
+        time units (e.g. as returned by :func:`bin_edges`).
+    :type bins: Quantity 1D
+    :returns: The spike counts with one row per spike train and one column
+        per bin.
+    :rtype: 2-D array
+    """
+    num_bins = bins.size - 1
+    bin_indices, train_indices = spike_train_bin_indices(trains, bins)
+    return sp.bincount(
+        train_indices * num_bins + bin_indices,
+        minlength=len(trains) * num_bins).reshape(len(trains), num_bins)
+
+
+def spike_count_array(trains, sampling_rate, t_start=None, t_stop=None,
+                      sparse=False, dtype=None):
+    """ Returns the spike counts of a dictionary of spike train sequences
+    as a single dense or sparse array.
+
+    The counts are the same as returned by :func:`bin_spike_trains`. All
+    indices of ``trains`` need the same number of spike trains.
+
+    :param dict trains: A dictionary of sequences of
+        :class:`neo.core.SpikeTrain` objects.
+    :param sampling_rate: The sampling rate which will be used to bin
+        the spike trains as inverse time scalar.
+    :type sampling_rate: Quantity scalar
+    :param t_start: The desired time for the start of the first bin as time
+        scalar. It will be the minimum start time of all spike trains if
+        ``None`` is passed.
+    :type t_start: Quantity scalar
+    :param t_stop: The desired time for the end of the last bin as time
+        scalar. It will be the maximum stop time of all spike trains if
+        ``None`` is passed.
+    :type t_stop: Quantity scalar
+    :param bool sparse: If ``False``, the counts are returned as 3-D array
+        (indices x spike trains x bins). If ``True``, they are returned as
+        :class:`scipy.sparse.csr_matrix` with one row per spike train and
+        one column per bin. The rows contain all spike trains of the first
+        index, followed by all spike trains of the second index and so on.
+    :param dtype: The data type of the counts, e.g. :class:`numpy.uint8` to
+        save memory. If a count is too large for the data type, a
+        ``ValueError`` is raised. Default: int
+    :returns: The spike counts, the bin borders and a list of the indices
+        of ``trains`` in the order used in the spike counts.
+    :rtype: 3-D array or :class:`scipy.sparse.csr_matrix`, Quantity 1D with
+        time units, list
+    """
+    bins = _spike_train_bins(trains, sampling_rate, t_start, t_stop)
+    num_bins = bins.size - 1
+
+    indices = list(trains.keys())
+    num_trains = len(trains[indices[0]]) if indices else 0
+    if any(len(trains[u]) != num_trains for u in indices):
+        raise ValueError(
+            'All indices need the same number of spike trains for a spike '
+            'count array.')
+    if dtype is None:
+        dtype = int
+
+    rows = []
+    columns = []
+    for i, u in enumerate(indices):
+        bin_indices, train_indices = spike_train_bin_indices(trains[u], bins)
+        rows.append(train_indices + i * num_trains)
+        columns.append(bin_indices)
+    rows = sp.concatenate(rows) if rows else sp.array([], dtype=int)
+    columns = sp.concatenate(columns) if columns else sp.array([], dtype=int)
+
+    if not sparse:
+        # Counts of nonzero bins only, so that no temporary array of the
+        # full output size with a larger data type is needed
+        nonzero, counts = sp.unique(
+            rows * num_bins + columns, return_counts=True)
+        _check_count_type(counts, dtype)
+        binned = sp.zeros((len(indices), num_trains, num_bins), dtype=dtype)
+        binned.flat[nonzero] = counts
+    else:
+        binned = scipy.sparse.csr_matrix(
+            (sp.ones(rows.size, dtype=int), (rows, columns)),
+            shape=(len(indices) * num_trains, num_bins))
+        binned.sum_duplicates()
+        _check_count_type(binned.data, dtype)
+        binned = binned.astype(dtype)
+    return binned, bins, indices
+
+
+def _uniform_bin_indices(times, edges):
+    """ Return the bin indices of time points for equally spaced bin edges.
+
+    Equal to the assignment done by :func:`scipy.histogram`: All bins but
+    the last are half-open and time points outside of the bins are ignored.
+
+    :param times: Time points in the units of ``edges``.
+    :type times: 1-D array
+    :param edges: Equally spaced bin edges, including the rightmost edge.
+    :type edges: 1-D array
+    :returns: The indices of the time points inside of the bins and their
+        bin indices.
+    :rtype: 1-D array, 1-D array
     """
-    return sp.histogram(train.rescale(bins.units), bins)[0]
+    num_bins = edges.size - 1
+    if num_bins < 1:
+        return sp.array([], dtype=int), sp.array([], dtype=int)
+
+    selected = sp.nonzero((times >= edges[0]) & (times <= edges[-1]))[0]
+    t = times[selected]
+    idx = sp.floor(
+        (t - edges[0]) * (num_bins / (edges[-1] - edges[0]))).astype(int)
+    sp.clip(idx, 0, num_bins - 1, out=idx)
+
+    # Correct rounding errors by comparing with the actual edges
+    idx -= t < edges[idx]
+    idx += (t >= edges[idx + 1]) & (idx < num_bins - 1)
+    return selected, idx
 
 
 def concatenate_spike_trains(trains):
@@ -266,11 +465,23 @@ def remove_from_hierarchy(obj, remove_half_orphans=True):
     _handle_orphans(obj, remove_half_orphans)
 
 
-def extract_spikes(train, signals, length, align_time):
-    """ Extract spikes with waveforms from analog signals using a spike train. 
+def extract_spikes(train, signals, length, align_time,
+                   as_spike_train=False, realign=None, upsampling=1,
+                   max_shift=0.5 * pq.ms):
+    """ Extract spikes with waveforms from analog signals using a spike train.
     Spikes that are too close to the beginning or end of the shortest signal
     to be fully extracted are ignored.
 
+    The waveforms of all spikes are gathered at once from strided views of
+    the signals, the signal data is only copied if it needs to be rescaled
+    to the unit of the first signal.
+
+    By default, waveforms start at the sample before the exact start time.
+    With ``realign`` or ``upsampling``, the signals are interpolated with
+    cubic splines (in batches of spikes) so that waveforms can be cut at
+    sub-sample precision and aligned to their extremum. The returned
+    waveforms still have the sampling rate of the signals.
+
     :type train: :class:`neo.core.SpikeTrain`
     :param train: The spike times.
     :param sequence signals: A sequence of :class:`neo.core.AnalogSignal`
@@ -283,10 +494,28 @@ def extract_spikes(train, signals, length, align_time):
     :param align_time: The alignment time of the spike times as time scalar.
         This is the time delta from the start of the extracted waveform
         to the exact time of the spike.
+    :param bool as_spike_train: If ``True``, a single spike train containing
+        the extracted spikes and their waveforms (spikes x samples x
+        channels) is returned instead of a list of spikes.
+    :param str realign: If given, each spike is moved to the extremum of its
+        waveform within ``max_shift`` of the original spike time and the
+        waveform is cut around the new spike time. Possible values:
+
+        * ``'peak'``: Align to the maximum over all channels.
+        * ``'trough'``: Align to the minimum over all channels.
+        * ``'abs'``: Align to the maximum absolute value over all channels.
+
+        Spikes that are too close to the beginning or end of the signals
+        for the search are ignored.
+    :param int upsampling: The number of interpolated points per sample
+        that determines the precision of waveform cutting and realignment.
+    :type max_shift: Quantity scalar
+    :param max_shift: The maximum time a spike is moved by ``realign``.
     :returns: A list of :class:`neo.core.Spike` objects, one for each
         time point in ``train``. All returned spikes include their
-        ``waveform`` property.
-    :rtype: list
+        ``waveform`` property. If ``as_spike_train`` is ``True``, a
+        :class:`neo.core.SpikeTrain` with ``waveforms`` is returned instead.
+    :rtype: list or :class:`neo.core.SpikeTrain`
     """
     if not signals:
         raise ValueError('No signals to extract spikes from')
@@ -305,25 +534,235 @@ def extract_spikes(train, signals, length, align_time):
 
     st = sp.asarray((aligned_train * srate).simplified)
 
-    # Find extraction epochs
-    st_ok = (st >= 0) * (st < end - cut_samples)
-    epochs = sp.vstack((st[st_ok], st[st_ok] + cut_samples)).T.astype(sp.int64)
-
-    nspikes = epochs.shape[0]
-    if not nspikes:
-        return []
-
-    # Create data
-    data = sp.vstack([sp.asarray(s.rescale(wave_unit)) for s in signals])
-    nc = len(signals)
-
+    if realign is None and upsampling == 1:
+        # Find extraction epochs
+        st_ok = (st >= 0) * (st < end - cut_samples)
+        starts = st[st_ok].astype(sp.int64)
+        waveforms = _extract_waveforms(
+            signals, wave_unit, starts, cut_samples, end)
+        times = train[st_ok]
+    else:
+        if realign not in (None, 'peak', 'trough', 'abs'):
+            raise ValueError('Unknown realignment: %s' % realign)
+        # The search is limited by the exact maximum shift, the extracted
+        # windows are extended by whole samples
+        max_shift_samples = 0.0
+        if realign is not None:
+            max_shift_samples = float((max_shift * srate).simplified)
+        shift_samples = int(sp.ceil(max_shift_samples))
+        align_samples = float((align_time * srate).simplified)
+
+        # Extended windows with room for the shift and the interpolation
+        ext_starts = sp.floor(st).astype(sp.int64) - shift_samples - 1
+        ext_length = cut_samples + 2 * shift_samples + 3
+        st_ok = (ext_starts >= 0) * (ext_starts <= end - ext_length)
+        ext_starts = ext_starts[st_ok]
+        ext = _extract_waveforms(
+            signals, wave_unit, ext_starts, ext_length, end)
+        waveforms, shifts = _realign_waveforms(
+            ext, st[st_ok] - ext_starts, cut_samples, align_samples,
+            realign, upsampling, max_shift_samples)
+        times = train[st_ok] + (shifts / srate).rescale(train.units)
+
+    if as_spike_train:
+        return neo.SpikeTrain(
+            times, t_start=train.t_start, t_stop=train.t_stop,
+            waveforms=pq.Quantity(waveforms, wave_unit, copy=False),
+            sampling_rate=srate, left_sweep=align_time)
+
+    nspikes = times.size
     spikes = []
     for s in xrange(nspikes):
-        waveform = sp.zeros((cut_samples, nc))
-        for c in xrange(nc):
-            waveform[:, c] = \
-                data[c, epochs[s, 0]:epochs[s, 1]]
-        spikes.append(neo.Spike(train[st_ok][s], waveform=waveform * wave_unit,
-                                sampling_rate=srate))
+        spikes.append(neo.Spike(
+            times[s], waveform=pq.Quantity(
+                waveforms[s], wave_unit, copy=False), sampling_rate=srate))
 
     return spikes
+
+
+def extract_spikes_chunked(train, data, sampling_rate, length, align_time,
+                           unit=pq.dimensionless, t_start=0 * pq.s,
+                           chunk_size=2 ** 20, out=None, filename=None):
+    """ Extract spike waveforms from a large (e.g. memory-mapped) array of
+    samples. Spikes that are too close to the beginning or end of the data
+    to be fully extracted are ignored.
+
+    The spikes are processed in order of their times. Only blocks of at
+    most ``chunk_size`` samples that contain spike windows are read from
+    ``data``, so the memory needed is bounded by the chunk size and not
+    by the length of the recording.
+
+    :type train: :class:`neo.core.SpikeTrain`
+    :param train: The spike times.
+    :param data: The signal samples (samples x channels), e.g. a
+        :class:`numpy.memmap`. Any object that supports slicing along the
+        first axis and conversion to an array can be used. One-dimensional
+        data is treated as a single channel.
+    :type sampling_rate: Quantity scalar
+    :param sampling_rate: The sampling rate of ``data``.
+    :type length: Quantity scalar
+    :param length: The length of the waveform to extract as time scalar.
+    :type align_time: Quantity scalar
+    :param align_time: The alignment time of the spike times as time scalar.
+        This is the time delta from the start of the extracted waveform
+        to the exact time of the spike.
+    :type unit: Quantity scalar
+    :param unit: The unit of the values in ``data``.
+    :type t_start: Quantity scalar
+    :param t_start: The time of the first sample in ``data``.
+    :param int chunk_size: The maximum number of samples read from
+        ``data`` at once. Needs to be at least the number of samples per
+        waveform.
+    :param out: An array (spikes x samples x channels) in which the
+        waveforms are written. It needs one row for every spike that can
+        be extracted. If ``None``, a new array is created.
+    :type out: ndarray
+    :param str filename: If given (and ``out`` is ``None``), the waveforms
+        are stored in a memory-mapped ``.npy`` file with this name instead
+        of memory.
+    :returns: A spike train with the extracted spikes. Its ``waveforms``
+        (spikes x samples x channels) share memory with ``out`` or the
+        memory-mapped file.
+    :rtype: :class:`neo.core.SpikeTrain`
+    """
+    num_samples = data.shape[0]
+    num_channels = data.shape[1] if len(data.shape) > 1 else 1
+    cut_samples = int((length * sampling_rate).simplified)
+    if chunk_size < cut_samples:
+        raise ValueError('Chunk size is smaller than the waveform length')
+
+    st = sp.asarray(
+        ((train - align_time - t_start) * sampling_rate).simplified)
+    st_ok = (st >= 0) * (st < num_samples - cut_samples)
+    starts = st[st_ok].astype(sp.int64)
+    shape = (starts.size, cut_samples, num_channels)
+
+    if out is None:
+        if filename is None:
+            out = sp.empty(shape)
+        else:
+            out = numpy.lib.format.open_memmap(
+                filename, mode='w+', dtype=float, shape=shape)
+    elif out.shape != shape:
+        raise ValueError('Output array needs shape %s' % (shape,))
+
+    order = sp.argsort(starts, kind='mergesort')
+    sorted_starts = starts[order]
+    offsets = sp.arange(cut_samples)
+    i = 0
+    while i < starts.size:
+        first = sorted_starts[i]
+        # All windows in this chunk end before first + chunk_size
+        j = sp.searchsorted(
+            sorted_starts, first + chunk_size - cut_samples, 'right')
+        block = sp.asarray(data[first:sorted_starts[j - 1] + cut_samples])
+        block = block.reshape(block.shape[0], num_channels)
+        windows = (sorted_starts[i:j] - first)[:, sp.newaxis] + offsets
+        out[order[i:j]] = block[windows]
+        i = j
+
+    if isinstance(out, sp.memmap):
+        out.flush()
+    return neo.SpikeTrain(
+        train[st_ok], t_start=train.t_start, t_stop=train.t_stop,
+        waveforms=pq.Quantity(out, unit, copy=False),
+        sampling_rate=sampling_rate, left_sweep=align_time)
+
+
+def _realign_waveforms(windows, positions, num_samples, align_samples,
+                       realign, upsampling, max_shift, max_elements=2 ** 24):
+    """ Cut (realigned) waveforms with sub-sample precision from windows of
+    signal data.
+
+    :param windows: Signal data around each spike (spikes x window samples
+        x channels).
+    :type windows: 3-D array
+    :param positions: Start position of each waveform (in samples, relative
+        to the start of the window) before realignment.
+    :type positions: 1-D array
+    :param int num_samples: The number of samples per waveform.
+    :param float align_samples: The position of the spike time within the
+        waveform (in samples).
+    :param str realign: None, ``'peak'``, ``'trough'`` or ``'abs'``.
+    :param int upsampling: The number of interpolated points per sample.
+    :param float max_shift: The maximum shift for realignment (in samples).
+        The windows need to extend at least this far beyond the
+        waveforms on both sides.
+    :param int max_elements: The maximum number of interpolated values
+        for a batch of spikes.
+    :returns: The waveforms (spikes x samples x channels) and the shift of
+        each spike (in samples).
+    :rtype: 3-D array, 1-D array
+    """
+    num_spikes, window_length, num_channels = windows.shape
+    waveforms = sp.empty((num_spikes, num_samples, num_channels))
+    shifts = sp.zeros(num_spikes)
+    if num_spikes < 1:
+        return waveforms, shifts
+
+    fine = sp.arange((window_length - 1) * upsampling + 1) / float(upsampling)
+    offsets = sp.arange(num_samples) * upsampling
+    align_fine = int(round(align_samples * upsampling))
+    batch = max(1, max_elements // (fine.size * num_channels))
+    for i in xrange(0, num_spikes, batch):
+        upsampled = scipy.interpolate.interp1d(
+            sp.arange(window_length), windows[i:i + batch], kind='cubic',
+            axis=1)(fine)
+        n = upsampled.shape[0]
+        # Waveforms start at the interpolated point at or before the
+        # exact position, like the whole samples without interpolation
+        start = sp.floor(positions[i:i + n] * upsampling).astype(int)
+
+        if realign is not None:
+            if realign == 'peak':
+                feature = upsampled.max(axis=2)
+            elif realign == 'trough':
+                feature = -upsampled.min(axis=2)
+            else:
+                feature = sp.absolute(upsampled).max(axis=2)
+            # Only search within max_shift of the original spike time (but
+            # at least at the interpolated point at or before it)
+            center = (positions[i:i + n] + align_samples) * upsampling
+            distance = sp.absolute(
+                sp.arange(fine.size) - center[:, sp.newaxis])
+            outside = distance > max_shift * upsampling
+            outside[sp.arange(n), sp.floor(center).astype(int)] = False
+            feature[outside] = -sp.inf
+            extremum = feature.argmax(axis=1)
+            shifts[i:i + n] = (extremum - center) / float(upsampling)
+            start = extremum - align_fine
+
+        indices = start[:, sp.newaxis] + offsets
+        waveforms[i:i + n] = upsampled[
+            sp.arange(n)[:, sp.newaxis], indices]
+    return waveforms, shifts
+
+
+def _extract_waveforms(signals, unit, starts, num_samples, end):
+    """ Gather waveforms of equal length from signals.
+
+    :param sequence signals: A sequence of :class:`neo.core.AnalogSignal`
+        objects.
+    :param unit: The unit to which the signals are rescaled (if necessary).
+    :type unit: Quantity scalar
+    :param starts: Start sample index of each waveform.
+    :type starts: 1-D array of int
+    :param int num_samples: The number of samples per waveform.
+    :param int end: The number of samples of the shortest signal.
+    :returns: The waveforms (spikes x samples x channels).
+    :rtype: 3-D array
+    """
+    waveforms = sp.empty((starts.size, num_samples, len(signals)))
+    if starts.size < 1 or num_samples < 1:
+        return waveforms
+
+    for c, s in enumerate(signals):
+        if s.units != unit:
+            s = s.rescale(unit)
+        data = sp.asarray(s)
+        # Row i of the view is the window starting at sample i
+        windows = as_strided(
+            data, shape=(end - num_samples + 1, num_samples),
+            strides=(data.strides[0], data.strides[0]))
+        waveforms[:, :, c] = windows[starts]
+    return waveforms